@@ -0,0 +1,225 @@
+"""タスクの変更履歴
+
+変更と同じトランザクションで、変わった項目だけを {"項目": [変更前, 変更後]} の形で記録する。
+一定期間たった履歴は、同じユーザーによる連続した更新を ACTIVITY_MERGE_WINDOW 秒ごとに1行へまとめ
+(途中の値は捨てて最初の変更前と最後の変更後だけを残す)、テーブルが編集回数に比例して増えないようにする。
+
+    python -m app.activity           # 今すぐ圧縮を実行
+"""
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, or_, select, update
+
+from . import metrics, models
+
+# これより古い履歴を圧縮する
+ACTIVITY_COMPACT_AFTER_DAYS = int(os.getenv("ACTIVITY_COMPACT_AFTER_DAYS", "7"))
+# 1行にまとめる連続した更新の期間(秒)
+ACTIVITY_MERGE_WINDOW = float(os.getenv("ACTIVITY_MERGE_WINDOW", "3600"))
+# これより古い履歴は削除する(0なら削除しない)
+ACTIVITY_RETENTION_DAYS = int(os.getenv("ACTIVITY_RETENTION_DAYS", "0"))
+# 1バッチで圧縮するタスク数
+ACTIVITY_BATCH_SIZE = int(os.getenv("ACTIVITY_BATCH_SIZE", "200"))
+ACTIVITY_MAX_BATCHES = int(os.getenv("ACTIVITY_MAX_BATCHES", "20"))
+ACTIVITY_COMPACT_INTERVAL = float(os.getenv("ACTIVITY_COMPACT_INTERVAL", "3600"))
+
+# 履歴に残す項目
+TRACKED_FIELDS = (
+    "title", "description", "status", "priority", "due_date",
+    "start_time", "end_time", "assignee_id", "project_id",
+)
+
+Activity = models.TaskActivity
+
+
+def snapshot(task) -> dict:
+    """履歴に残す項目の現在の値"""
+    return {name: getattr(task, name) for name in TRACKED_FIELDS}
+
+
+def diff(old: dict, new: dict) -> dict:
+    """変わった項目だけを {"項目": [変更前, 変更後]} で返す"""
+    return {name: [old.get(name), new.get(name)] for name in TRACKED_FIELDS if old.get(name) != new.get(name)}
+
+
+def record(db, task_id: int, user_id: Optional[int], action: str, changes: Optional[dict] = None):
+    """変更履歴を追加(コミットは呼び出し側)"""
+    db.add(Activity(
+        task_id=task_id,
+        user_id=user_id,
+        action=action,
+        changes=json.dumps(changes or {}, ensure_ascii=False),
+        created_at=datetime.utcnow(),
+    ))
+
+
+def record_update(db, task, old: dict, user_id: Optional[int]) -> dict:
+    """更新前のスナップショットと比べ、変わった項目があれば記録"""
+    changes = diff(old, snapshot(task))
+    if changes:
+        record(db, task.id, user_id, "updated", changes)
+    return changes
+
+
+def to_dict(row: models.TaskActivity) -> dict:
+    return {
+        "id": row.id,
+        "task_id": row.task_id,
+        "user_id": row.user_id,
+        "action": row.action,
+        "changes": json.loads(row.changes),
+        "edits": row.edits,
+        "created_at": row.created_at,
+    }
+
+
+def encode_cursor(row: models.TaskActivity) -> str:
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """カーソルを (created_at, id) に戻す(不正な値は ValueError)"""
+    created_at, _, row_id = cursor.rpartition("_")
+    return datetime.fromisoformat(created_at), int(row_id)
+
+
+def get_timeline(db, task_id: int, cursor: Optional[str] = None, limit: int = 50) -> dict:
+    """タスクの履歴を新しい順に取得(cursor は前のページの next_cursor)
+
+    (task_id, created_at) のインデックスを使うキーセット方式なので、圧縮で行が消えても続きから読める。
+    """
+    query = select(Activity).where(Activity.task_id == task_id)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.where(or_(
+            Activity.created_at < created_at,
+            and_(Activity.created_at == created_at, Activity.id < row_id),
+        ))
+    rows = db.execute(
+        query.order_by(Activity.created_at.desc(), Activity.id.desc()).limit(limit + 1)
+    ).scalars().all()
+    items = rows[:limit]
+    return {
+        "items": [to_dict(row) for row in items],
+        "next_cursor": encode_cursor(items[-1]) if len(rows) > limit else None,
+    }
+
+
+def _groups(rows: List[models.TaskActivity], window: float) -> List[List[models.TaskActivity]]:
+    """同じユーザーによる連続した更新を window 秒ごとにまとめる"""
+    groups: List[List[models.TaskActivity]] = []
+    for row in rows:
+        head = groups[-1][0] if groups else None
+        if (head is not None and head.action == row.action == "updated" and head.user_id == row.user_id
+                and (row.created_at - head.created_at).total_seconds() <= window):
+            groups[-1].append(row)
+        else:
+            groups.append([row])
+    return groups
+
+
+def _merged_changes(group: List[models.TaskActivity]) -> dict:
+    changes: Dict[str, list] = {}
+    for row in group:
+        for name, (old, new) in json.loads(row.changes).items():
+            if name in changes:
+                changes[name][1] = new
+            else:
+                changes[name] = [old, new]
+    return {name: values for name, values in changes.items() if values[0] != values[1]}
+
+
+def compact_activity(db, older_than_days: int = ACTIVITY_COMPACT_AFTER_DAYS, window: float = ACTIVITY_MERGE_WINDOW,
+                     batch_size: int = ACTIVITY_BATCH_SIZE, max_batches: int = ACTIVITY_MAX_BATCHES) -> int:
+    """古い履歴の連続した更新を1行にまとめ、削除した行数を返す(タスクごとにバッチでコミット)"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    removed = 0
+    for _ in range(max_batches):
+        task_ids = list(db.execute(
+            select(Activity.task_id)
+            .where(Activity.compacted == False, Activity.created_at < cutoff)  # noqa: E712
+            .group_by(Activity.task_id)
+            .limit(batch_size)
+        ).scalars())
+        if not task_ids:
+            break
+        # 前回までにまとめた行とも続けてまとめられるよう、期限より古い行は全て読む
+        rows = db.execute(
+            select(Activity)
+            .where(Activity.task_id.in_(task_ids), Activity.created_at < cutoff)
+            .order_by(Activity.task_id, Activity.created_at, Activity.id)
+        ).scalars().all()
+        by_task: Dict[int, List[models.TaskActivity]] = {}
+        for row in rows:
+            by_task.setdefault(row.task_id, []).append(row)
+
+        merged_ids = []
+        for task_rows in by_task.values():
+            for group in _groups(task_rows, window):
+                if len(group) < 2:
+                    continue
+                head = group[0]
+                head.changes = json.dumps(_merged_changes(group), ensure_ascii=False)
+                head.edits = sum(row.edits for row in group)
+                merged_ids.extend(row.id for row in group[1:])
+        db.flush()
+        if merged_ids:
+            db.execute(
+                delete(Activity).where(Activity.id.in_(merged_ids)),
+                execution_options={"synchronize_session": False},
+            )
+        db.execute(
+            update(Activity)
+            .where(Activity.task_id.in_(task_ids), Activity.created_at < cutoff, Activity.compacted == False)  # noqa: E712
+            .values(compacted=True),
+            execution_options={"synchronize_session": False},
+        )
+        db.commit()
+        metrics.ACTIVITY_ROWS_REMOVED.inc("compacted", amount=len(merged_ids))
+        removed += len(merged_ids)
+        if len(task_ids) < batch_size:
+            break
+    return removed
+
+
+def purge_activity(db, older_than_days: int = ACTIVITY_RETENTION_DAYS,
+                   batch_size: int = ACTIVITY_BATCH_SIZE * 10, max_batches: int = ACTIVITY_MAX_BATCHES) -> int:
+    """保持期間を過ぎた履歴を削除し、件数を返す(older_than_days=0 なら何もしない)"""
+    if older_than_days <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    removed = 0
+    for _ in range(max_batches):
+        ids = list(db.execute(
+            select(Activity.id).where(Activity.created_at < cutoff).order_by(Activity.id).limit(batch_size)
+        ).scalars())
+        if not ids:
+            break
+        db.execute(delete(Activity).where(Activity.id.in_(ids)), execution_options={"synchronize_session": False})
+        db.commit()
+        metrics.ACTIVITY_ROWS_REMOVED.inc("expired", amount=len(ids))
+        removed += len(ids)
+        if len(ids) < batch_size:
+            break
+    return removed
+
+
+def run_compaction(db) -> dict:
+    """定期実行用: 履歴の圧縮と期限切れの削除"""
+    return {
+        "compacted": compact_activity(db),
+        "expired": purge_activity(db),
+    }
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Activity: {run_compaction(session)}")
+    finally:
+        session.close()
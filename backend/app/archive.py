@@ -0,0 +1,178 @@
+"""完了タスクと古い通知のアーカイブ
+
+done になってから一定期間たったタスク(とそのコメント)と、保持期間を過ぎた既読の通知を
+*_archive テーブルへ一定件数ずつ移し、よく参照されるテーブルを小さく保つ。
+
+    python -m app.archive            # 今すぐアーカイブを実行
+"""
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select, update
+
+from . import activity, hierarchy, metrics, models, outbox, ranking, stats
+
+ARCHIVE_DONE_TASKS_AFTER_DAYS = int(os.getenv("ARCHIVE_DONE_TASKS_AFTER_DAYS", "30"))
+ARCHIVE_NOTIFICATIONS_AFTER_DAYS = int(os.getenv("ARCHIVE_NOTIFICATIONS_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# 1回のジョブで処理するバッチ数の上限(残りは次回に回す)
+ARCHIVE_MAX_BATCHES = int(os.getenv("ARCHIVE_MAX_BATCHES", "20"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+
+tasks = models.Task.__table__
+comments = models.Comment.__table__
+notifications = models.Notification.__table__
+tasks_archive = models.ArchivedTask.__table__
+comments_archive = models.ArchivedComment.__table__
+notifications_archive = models.ArchivedNotification.__table__
+
+
+def _copy_columns(target) -> List[str]:
+    return [column.name for column in target.columns if column.name != "archived_at"]
+
+
+def _move(db, source, target, ids: List[int], archived_at: Optional[datetime]):
+    """idの行をsourceからtargetへ移す(archived_at=Noneならアーカイブから戻す)"""
+    if archived_at is not None:
+        names = _copy_columns(target)
+        columns = [source.c[name] for name in names] + [literal(archived_at, DateTime)]
+        names = names + ["archived_at"]
+    else:
+        names = _copy_columns(source)
+        columns = [source.c[name] for name in names]
+    db.execute(insert(target).from_select(names, select(*columns).where(source.c.id.in_(ids))))
+    db.execute(delete(source).where(source.c.id.in_(ids)))
+
+
+def _lock_batch(db, query, batch_size: int) -> List[int]:
+    # 複数ワーカーで同時に動いても同じ行を取り合わないようにする(SQLiteでは無視される)
+    return list(db.execute(
+        query.order_by(query.selected_columns[0]).limit(batch_size).with_for_update(skip_locked=True)
+    ).scalars())
+
+
+def archive_done_tasks(db, older_than_days: int = ARCHIVE_DONE_TASKS_AFTER_DAYS,
+                       batch_size: int = ARCHIVE_BATCH_SIZE, max_batches: int = ARCHIVE_MAX_BATCHES) -> int:
+    """完了から一定期間たったタスクをバッチごとにコミットしながら移し、件数を返す"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    query = select(tasks.c.id).where(
+        tasks.c.status == models.TaskStatus.DONE.value,
+        func.coalesce(tasks.c.completed_at, tasks.c.created_at) < cutoff,
+        # 未完了のサブタスクがある親は残す
+        tasks.c.subtasks_done == tasks.c.subtasks_total,
+    )
+    moved = 0
+    for _ in range(max_batches):
+        ids = _lock_batch(db, query, batch_size)
+        if not ids:
+            break
+        now = datetime.utcnow()
+        # アーカイブしたタスクはダッシュボード集計から外す
+        stats.remove_tasks(db, models.Task.id.in_(ids))
+        # 残るサブタスクは一つ上の親へ付け替える
+        hierarchy.detach(db, ids)
+        # 通知は残し、タスクへの参照だけ外す(メッセージにタイトルが含まれている)
+        db.execute(update(notifications).where(notifications.c.task_id.in_(ids)).values(task_id=None))
+        comment_ids = list(db.execute(select(comments.c.id).where(comments.c.task_id.in_(ids))).scalars())
+        if comment_ids:
+            _move(db, comments, comments_archive, comment_ids, now)
+        _move(db, tasks, tasks_archive, ids, now)
+        db.commit()
+        metrics.ARCHIVED_ROWS.inc("tasks", amount=len(ids))
+        moved += len(ids)
+        if len(ids) < batch_size:
+            break
+    return moved
+
+
+def archive_read_notifications(db, older_than_days: int = ARCHIVE_NOTIFICATIONS_AFTER_DAYS,
+                               batch_size: int = ARCHIVE_BATCH_SIZE, max_batches: int = ARCHIVE_MAX_BATCHES) -> int:
+    """保持期間を過ぎた既読の通知をバッチごとにコミットしながら移し、件数を返す"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    query = select(notifications.c.id).where(
+        notifications.c.is_read == True,  # noqa: E712
+        notifications.c.created_at < cutoff,
+    )
+    moved = 0
+    for _ in range(max_batches):
+        ids = _lock_batch(db, query, batch_size)
+        if not ids:
+            break
+        _move(db, notifications, notifications_archive, ids, datetime.utcnow())
+        db.commit()
+        metrics.ARCHIVED_ROWS.inc("notifications", amount=len(ids))
+        moved += len(ids)
+        if len(ids) < batch_size:
+            break
+    return moved
+
+
+def run_archival(db) -> dict:
+    """定期実行用: タスクと通知をアーカイブ"""
+    return {
+        "tasks": archive_done_tasks(db),
+        "notifications": archive_read_notifications(db),
+    }
+
+
+def get_archived_tasks(db, project_id: Optional[int] = None, assignee_id: Optional[int] = None,
+                       skip: int = 0, limit: int = 100):
+    """アーカイブ済みのタスクを新しく完了した順に取得"""
+    query = db.query(models.ArchivedTask)
+    if project_id is not None:
+        query = query.filter(models.ArchivedTask.project_id == project_id)
+    if assignee_id is not None:
+        query = query.filter(models.ArchivedTask.assignee_id == assignee_id)
+    return query.order_by(
+        models.ArchivedTask.completed_at.desc(), models.ArchivedTask.id.desc()
+    ).offset(skip).limit(limit).all()
+
+
+def get_archived_notifications(db, user_id: int, skip: int = 0, limit: int = 50):
+    """アーカイブ済みの通知を新しい順に取得"""
+    return db.query(models.ArchivedNotification).filter(
+        models.ArchivedNotification.user_id == user_id
+    ).order_by(models.ArchivedNotification.created_at.desc()).offset(skip).limit(limit).all()
+
+
+def restore_task(db, task_id: int, user_id: Optional[int] = None):
+    """アーカイブしたタスクとコメントを元に戻す
+
+    アーカイブ時に階層から外しているので、サブタスクだったタスクも最上位のタスクとして戻る。
+    """
+    exists = db.execute(select(tasks_archive.c.id).where(tasks_archive.c.id == task_id)).first()
+    if exists is None:
+        return None
+    _move(db, tasks_archive, tasks, [task_id], None)
+    comment_ids = list(db.execute(
+        select(comments_archive.c.id).where(comments_archive.c.task_id == task_id)
+    ).scalars())
+    if comment_ids:
+        _move(db, comments_archive, comments, comment_ids, None)
+    db_task = db.query(models.Task).filter(models.Task.id == task_id).first()
+    # 添付ファイルの行はアーカイブ中も残しているので、件数はそこから数え直す
+    db_task.attachments = db.execute(
+        select(func.count()).select_from(models.Attachment).where(models.Attachment.task_id == task_id)
+    ).scalar_one()
+    # アーカイブ中に列の並びが変わっているので末尾に戻す
+    db_task.rank = ranking.append_rank(db, db_task.project_id, db_task.status)
+    # 完了日時のままだと次のアーカイブでまた移されるので、戻した時点から数え直す
+    if db_task.completed_at is not None:
+        db_task.completed_at = datetime.utcnow()
+    stats.record_change(db, None, stats.task_key(db_task))
+    activity.record(db, task_id, user_id, "restored")
+    outbox.enqueue_emit(db, 'task_update', 'task_created', outbox.task_payload(db_task), f"task:{task_id}")
+    db.commit()
+    db.refresh(db_task)
+    return db_task
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Archived: {run_archival(session)}")
+    finally:
+        session.close()
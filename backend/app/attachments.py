@@ -0,0 +1,314 @@
+"""タスクの添付ファイル(分割・再開可能なアップロードと Range 対応のダウンロード)
+
+    1. POST /api/tasks/{id}/attachments/uploads でアップロードを開始(ファイル名・サイズ・任意で sha256)
+    2. PUT /api/attachments/uploads/{upload_id} に Upload-Offset ヘッダー付きで続きのバイト列を送る
+       (途切れたら GET で受信済みのオフセットを確認して続きから送り直す)
+    3. 最後まで受け取ったら sha256 の名前で保存して添付ファイルを作る
+
+本文はリクエストから読みながらディスクに書き、sha256 も同時に計算するので、メモリ使用量は
+ファイルサイズによらず一定。保存名は内容のハッシュなので同じ内容のファイルは1つしか持たない。
+"""
+import asyncio
+import hashlib
+import os
+import time
+import unicodedata
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+from . import metrics, models, outbox, storage
+
+ATTACHMENT_DIR = os.getenv("ATTACHMENT_DIR", "uploads/attachments")
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(100 * 1024 * 1024)))
+# クライアントに勧める1リクエストあたりのサイズ
+ATTACHMENT_CHUNK_BYTES = int(os.getenv("ATTACHMENT_CHUNK_BYTES", str(5 * 1024 * 1024)))
+# 受信したバイト列をまとめてディスクに書く単位
+ATTACHMENT_WRITE_BUFFER = 1024 * 1024
+# これより長く放置されたアップロードは破棄する
+ATTACHMENT_UPLOAD_TTL = float(os.getenv("ATTACHMENT_UPLOAD_TTL", str(24 * 3600)))
+ATTACHMENT_GC_INTERVAL = float(os.getenv("ATTACHMENT_GC_INTERVAL", "3600"))
+# 参照されていないファイルを消すまでの猶予(保存直後で行がまだコミットされていない場合に備える)
+ATTACHMENT_GC_GRACE = 3600
+ATTACHMENT_GC_BATCH_SIZE = 500
+
+Attachment = models.Attachment
+Upload = models.AttachmentUpload
+
+store = storage.LocalBlobStore(ATTACHMENT_DIR)
+
+# アップロードIDごとの計算途中のハッシュ (オフセット, hashlibオブジェクト)。
+# 別のプロセスが続きを受けた場合やプロセスを再起動した場合は、受信済みの部分を読み直して作る。
+_hashers: Dict[str, Tuple[int, "hashlib._Hash"]] = {}
+# 同じアップロードへの同時書き込みを防ぐ [ロック, 使用中・待機中のリクエスト数]。
+# 誰も使っていなければ消すので、件数は処理中のリクエスト数までしか増えない
+_locks: Dict[str, List] = {}
+
+
+class UploadTooLarge(Exception):
+    """申告したサイズを超えて送られた"""
+
+
+class ChecksumMismatch(Exception):
+    """申告した sha256 と内容が一致しない"""
+
+
+def clean_filename(filename: str) -> str:
+    """保存・表示用のファイル名(パスと制御文字を除く)"""
+    name = os.path.basename((filename or "").replace("\\", "/"))
+    name = "".join(ch for ch in name if unicodedata.category(ch)[0] != "C").strip()
+    return name[:255] or "file"
+
+
+def attachment_payload(attachment: models.Attachment) -> dict:
+    return {
+        "id": attachment.id,
+        "task_id": attachment.task_id,
+        "user_id": attachment.user_id,
+        "filename": attachment.filename,
+        "content_type": attachment.content_type,
+        "size": attachment.size,
+        "sha256": attachment.sha256,
+        "created_at": attachment.created_at,
+    }
+
+
+def upload_status(upload: models.AttachmentUpload) -> dict:
+    return {
+        "upload_id": upload.id,
+        "offset": upload.received,
+        "size": upload.size,
+        "chunk_size": ATTACHMENT_CHUNK_BYTES,
+        "complete": False,
+        "attachment": None,
+    }
+
+
+def _change_count(db, task_id: int, delta: int):
+    """タスクの添付ファイル数を増減して送信を予約"""
+    tasks = models.Task.__table__
+    db.execute(
+        update(tasks).where(tasks.c.id == task_id)
+        .values(attachments=func.coalesce(tasks.c.attachments, 0) + delta)
+    )
+    count = db.execute(select(tasks.c.attachments).where(tasks.c.id == task_id)).scalar()
+    outbox.enqueue_emit(db, 'task_update', 'attachments_changed',
+                        {'id': task_id, 'attachments': count}, f"task:{task_id}")
+
+
+def _create_attachment(db, task_id: int, user_id: int, filename: str, content_type: str,
+                       size: int, digest: str) -> models.Attachment:
+    attachment = Attachment(task_id=task_id, user_id=user_id, filename=filename,
+                            content_type=content_type, size=size, sha256=digest)
+    db.add(attachment)
+    db.flush()
+    _change_count(db, task_id, 1)
+    return attachment
+
+
+def start_upload(db, task: models.Task, user_id: int, filename: str, content_type: Optional[str],
+                 size: int, sha256: Optional[str] = None) -> dict:
+    """アップロードを開始する
+
+    自分が以前に同じ内容(sha256)をアップロードしていれば、送らずにそのまま添付する
+    (他人のファイルはハッシュを知っているだけでは取得できないように、自分の分だけを対象にする)。
+    """
+    if size < 0 or size > ATTACHMENT_MAX_BYTES:
+        raise UploadTooLarge()
+    filename = clean_filename(filename)
+    content_type = content_type or "application/octet-stream"
+    sha256 = sha256.lower() if sha256 else None
+    if sha256 and storage.HASH_PATTERN.match(sha256) is None:
+        raise ChecksumMismatch()
+
+    if sha256 and store.has_blob(sha256):
+        owned = db.execute(
+            select(Attachment.id).where(Attachment.sha256 == sha256, Attachment.user_id == user_id).limit(1)
+        ).first()
+        if owned is not None:
+            size = os.path.getsize(store.blob_path(sha256))
+            attachment = _create_attachment(db, task.id, user_id, filename, content_type, size, sha256)
+            db.commit()
+            metrics.ATTACHMENTS.inc("deduplicated")
+            return {"upload_id": None, "offset": size, "size": size, "chunk_size": ATTACHMENT_CHUNK_BYTES,
+                    "complete": True, "attachment": attachment_payload(attachment)}
+
+    upload = Upload(id=uuid.uuid4().hex, task_id=task.id, user_id=user_id, filename=filename,
+                    content_type=content_type, size=size, received=0, sha256=sha256)
+    db.add(upload)
+    db.commit()
+    return upload_status(upload)
+
+
+def get_upload(db, upload_id: str, user_id: int) -> Optional[models.AttachmentUpload]:
+    # 他のリクエストが続きを受け取った後でも最新の受信済みサイズを読む
+    upload = db.get(Upload, upload_id, populate_existing=True)
+    if upload is None or upload.user_id != user_id:
+        return None
+    return upload
+
+
+@asynccontextmanager
+async def upload_lock(upload_id: str):
+    """アップロードへの書き込みを1件ずつにする(存在を確認したアップロードにだけ使う)"""
+    entry = _locks.get(upload_id)
+    if entry is None:
+        entry = _locks[upload_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and _locks.get(upload_id) is entry:
+            del _locks[upload_id]
+
+
+def _resume_hasher(upload_id: str, offset: int):
+    """offset までのハッシュ(メモリに無ければ受信済みの部分を読み直す)"""
+    cached = _hashers.pop(upload_id, None)
+    if cached is not None and cached[0] == offset:
+        return cached[1]
+    hasher = hashlib.sha256()
+    if offset:
+        for chunk in store.read_partial(upload_id, offset):
+            hasher.update(chunk)
+    return hasher
+
+
+def _write(f, hasher, data: bytes):
+    f.write(data)
+    hasher.update(data)
+
+
+async def receive(upload_id: str, offset: int, size: int,
+                  stream: AsyncIterator[bytes]) -> Tuple[int, "hashlib._Hash"]:
+    """リクエスト本文をディスクに書きながらハッシュを更新し、受信済みのバイト数を返す
+
+    途中で接続が切れても、そこまでに受け取った分は受信済みとして扱う。
+    """
+    # 超過して書いた分は次回の受信時に切り捨てられる
+    hasher = await run_in_threadpool(_resume_hasher, upload_id, offset)
+    f = await run_in_threadpool(store.open_partial, upload_id, offset)
+    start = offset
+    buffer = bytearray()
+    try:
+        try:
+            async for chunk in stream:
+                if offset + len(buffer) + len(chunk) > size:
+                    raise UploadTooLarge()
+                buffer += chunk
+                if len(buffer) >= ATTACHMENT_WRITE_BUFFER:
+                    await run_in_threadpool(_write, f, hasher, bytes(buffer))
+                    offset += len(buffer)
+                    buffer.clear()
+        except ClientDisconnect:
+            pass
+        if buffer:
+            await run_in_threadpool(_write, f, hasher, bytes(buffer))
+            offset += len(buffer)
+    finally:
+        await run_in_threadpool(f.close)
+    metrics.ATTACHMENT_BYTES.inc(amount=offset - start)
+    return offset, hasher
+
+
+def finish_chunk(db, upload_id: str, received: int, hasher) -> dict:
+    """受信済みのバイト数を記録し、最後まで受け取っていれば添付ファイルを作る"""
+    upload = db.get(Upload, upload_id, with_for_update=True, populate_existing=True)
+    if upload is None:
+        store.delete_partial(upload_id)
+        raise LookupError(upload_id)
+    upload.received = received
+    upload.updated_at = datetime.utcnow()
+    if received < upload.size:
+        db.commit()
+        _hashers[upload_id] = (received, hasher)
+        return upload_status(upload)
+
+    digest = hasher.hexdigest()
+    if upload.sha256 and upload.sha256 != digest:
+        db.delete(upload)
+        db.commit()
+        store.delete_partial(upload_id)
+        raise ChecksumMismatch()
+    created = store.commit_partial(upload_id, digest)
+    metrics.ATTACHMENTS.inc("stored" if created else "deduplicated")
+    attachment = _create_attachment(db, upload.task_id, upload.user_id, upload.filename,
+                                    upload.content_type, upload.size, digest)
+    db.delete(upload)
+    db.commit()
+    return {"upload_id": upload_id, "offset": received, "size": received, "chunk_size": ATTACHMENT_CHUNK_BYTES,
+            "complete": True, "attachment": attachment_payload(attachment)}
+
+
+def cancel_upload(db, upload: models.AttachmentUpload):
+    upload_id = upload.id
+    db.delete(upload)
+    db.commit()
+    store.delete_partial(upload_id)
+    _hashers.pop(upload_id, None)
+
+
+def get_task_attachments(db, task_id: int):
+    return db.query(Attachment).filter(Attachment.task_id == task_id).order_by(Attachment.id).all()
+
+
+def delete_attachment(db, attachment: models.Attachment):
+    """添付ファイルを削除(他から参照されていなければ本体も消す)"""
+    digest = attachment.sha256
+    _change_count(db, attachment.task_id, -1)
+    db.delete(attachment)
+    db.commit()
+    in_use = db.execute(select(Attachment.id).where(Attachment.sha256 == digest).limit(1)).first()
+    if in_use is None:
+        store.delete_blob(digest)
+
+
+def collect_garbage(db) -> dict:
+    """期限切れのアップロード、タスクが無くなった添付、参照されていないファイルを削除"""
+    removed = {"uploads": 0, "attachments": 0, "blobs": 0}
+
+    cutoff = datetime.utcnow() - timedelta(seconds=ATTACHMENT_UPLOAD_TTL)
+    expired = list(db.execute(
+        select(Upload.id).where(Upload.updated_at < cutoff).limit(ATTACHMENT_GC_BATCH_SIZE)
+    ).scalars())
+    if expired:
+        db.execute(delete(Upload).where(Upload.id.in_(expired)))
+        db.commit()
+        for upload_id in expired:
+            store.delete_partial(upload_id)
+            _hashers.pop(upload_id, None)
+        removed["uploads"] = len(expired)
+
+    # タスクの削除(一括削除ジョブを含む)で残った行
+    orphans = list(db.execute(
+        select(Attachment.id)
+        .where(
+            ~Attachment.task_id.in_(select(models.Task.id)),
+            ~Attachment.task_id.in_(select(models.ArchivedTask.id)),
+        )
+        .limit(ATTACHMENT_GC_BATCH_SIZE)
+    ).scalars())
+    if orphans:
+        db.execute(delete(Attachment).where(Attachment.id.in_(orphans)))
+        db.commit()
+        removed["attachments"] = len(orphans)
+
+    grace = time.time() - ATTACHMENT_GC_GRACE
+    candidates = [digest for digest, mtime in store.iter_blobs() if mtime < grace]
+    for start in range(0, len(candidates), ATTACHMENT_GC_BATCH_SIZE):
+        batch = candidates[start:start + ATTACHMENT_GC_BATCH_SIZE]
+        in_use = set(db.execute(select(Attachment.sha256).where(Attachment.sha256.in_(batch))).scalars())
+        for digest in batch:
+            if digest not in in_use:
+                store.delete_blob(digest)
+                removed["blobs"] += 1
+    db.rollback()
+    return removed
+
@@ -2,11 +2,11 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 import hashlib
-from . import models, schemas
+from . import batch, models, schemas, statements
 from .database import get_db
 
 # パスワードハッシュ化の設定(bcryptの代わりにargon2を使用)
@@ -40,15 +40,18 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 def authenticate_user(db: Session, email: str, password: str):
     """ユーザー認証"""
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = statements.user_by_email(db, email)
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
         return False
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """現在のユーザーを取得"""
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    """現在のユーザーを取得(バッチ内の呼び出しでは検証済みのユーザーを引き継ぐ)"""
+    user = batch.current_user(request, db)
+    if user is not None:
+        return user
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="認証情報を検証できませんでした",
@@ -62,7 +65,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = statements.user_by_email(db, email)
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,187 @@
+"""複数のAPI呼び出しを1回のHTTPリクエストで実行(POST /api/batch)
+
+各呼び出しは既存のルートへそのまま渡すので、権限チェックやレート制限は個別に呼んだ場合と同じ。
+まとめて行うのは次の部分:
+
+- 認証: バッチのリクエストで一度だけトークンを検証してユーザーを読み込み、各呼び出しに引き継ぐ
+- DBセッション: 書き込み(GET以外)はバッチのセッションを共有し、指定した順に1件ずつ実行する
+- 読み込み: 連続したGETは並行に実行する(Sessionはスレッドセーフでないので、それぞれ別のセッションを使う)
+
+ミドルウェア(圧縮・メトリクスなど)はバッチ全体に一度だけかかる。
+失敗した呼び出しは、その呼び出しの status と本文で返し、他の呼び出しは続ける。
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import List, Optional
+from urllib.parse import urlencode
+
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# 1回のバッチに含められる呼び出し数
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+# 並行に実行するGETの数(DBの接続プールを使い切らないようにする)
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+READ_METHODS = ("GET",)
+ALLOWED_METHODS = ("GET", "POST", "PUT", "DELETE")
+# 呼び出しに引き継ぐヘッダー(認証やクライアントの識別に使うもの)
+FORWARDED_HEADERS = (b"authorization", b"accept-language", b"user-agent", b"x-forwarded-for")
+
+# 呼び出しのASGIスコープに入れる BatchContext のキー
+SCOPE_KEY = "app.batch"
+
+
+class BatchContext:
+    """バッチ内の呼び出しに引き継ぐユーザーとセッション(session=None なら呼び出しごとに開く)"""
+
+    def __init__(self, user, session=None):
+        self.user = user
+        self.session = session
+
+
+def shared_session(request):
+    """バッチ内の書き込みならバッチのセッション(get_db から使う)"""
+    context = request.scope.get(SCOPE_KEY)
+    return context.session if context is not None else None
+
+
+def current_user(request, db):
+    """バッチ内の呼び出しなら検証済みのユーザー(get_current_user から使う)"""
+    context = request.scope.get(SCOPE_KEY)
+    if context is None:
+        return None
+    if context.session is db:
+        return context.user
+    # 別のセッションで使えるよう、DBを読まずにコピーする
+    return db.merge(context.user, load=False)
+
+
+def validate(items) -> Optional[str]:
+    """実行できないバッチならエラーメッセージ"""
+    if not items:
+        return "requests を指定してください"
+    if len(items) > BATCH_MAX_REQUESTS:
+        return f"一度に実行できるのは{BATCH_MAX_REQUESTS}件までです"
+    for item in items:
+        if item.method.upper() not in ALLOWED_METHODS:
+            return f"指定できないメソッドです: {item.method}"
+        path = item.path.split("?", 1)[0]
+        if not path.startswith("/api/") or path.rstrip("/") == "/api/batch":
+            return f"指定できないパスです: {item.path}"
+    return None
+
+
+def _scope(parent: dict, item, body: bytes, context: BatchContext) -> dict:
+    path, _, query = item.path.partition("?")
+    if item.params:
+        extra = urlencode(
+            {key: str(value).lower() if isinstance(value, bool) else value for key, value in item.params.items()},
+            doseq=True,
+        )
+        query = f"{query}&{extra}" if query else extra
+    headers = [(name, value) for name, value in parent["headers"] if name in FORWARDED_HEADERS]
+    headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http",
+        "asgi": parent.get("asgi", {"version": "3.0"}),
+        "http_version": parent.get("http_version", "1.1"),
+        "method": item.method.upper(),
+        "scheme": parent.get("scheme", "http"),
+        "server": parent.get("server"),
+        "client": parent.get("client"),
+        "root_path": parent.get("root_path", ""),
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": headers,
+        "app": parent.get("app"),
+        "state": parent.get("state", {}),
+        SCOPE_KEY: context,
+    }
+    if "starlette.exception_handlers" in parent:
+        # HTTPException などを通常のリクエストと同じレスポンスにする
+        scope["starlette.exception_handlers"] = parent["starlette.exception_handlers"]
+    return scope
+
+
+def _decode(body: bytes, content_type: str):
+    if not body:
+        return None
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    return body.decode("utf-8", errors="replace")
+
+
+async def _dispatch(router, parent: dict, item, context: BatchContext) -> dict:
+    """1件の呼び出しをルーターへ渡し、{id, status, body} を返す"""
+    body = json.dumps(item.body).encode() if item.body is not None else b""
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            return {"type": "http.disconnect"}
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status = 500
+    content_type = ""
+    chunks: List[bytes] = []
+
+    async def send(message):
+        nonlocal status, content_type
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for name, value in message.get("headers", []):
+                if name.lower() == b"content-type":
+                    content_type = value.decode("latin-1")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await router(_scope(parent, item, body, context), receive, send)
+        result = _decode(b"".join(chunks), content_type)
+    except HTTPException as exc:
+        # どのルートにも一致しない場合など、ルーターが直接送出するもの
+        status, result = exc.status_code, {"detail": exc.detail}
+    except Exception:
+        logger.exception("バッチの呼び出し %s %s が失敗しました", item.method, item.path)
+        status, result = 500, {"detail": "内部エラーが発生しました"}
+    metrics.BATCH_REQUESTS.inc(item.method.upper(), f"{status // 100}xx")
+    return {"id": item.id, "status": status, "body": result}
+
+
+async def run(request, items, user, session) -> List[dict]:
+    """呼び出しを順に実行(連続したGETはまとめて並行に)し、指定した順の結果を返す"""
+    router = request.app.router
+    parent = request.scope
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def read(item):
+        async with semaphore:
+            return await _dispatch(router, parent, item, BatchContext(user))
+
+    results: List[dict] = []
+    index = 0
+    while index < len(items):
+        if items[index].method.upper() in READ_METHODS:
+            end = index
+            while end < len(items) and items[end].method.upper() in READ_METHODS:
+                end += 1
+            results += await asyncio.gather(*(read(item) for item in items[index:end]))
+            index = end
+            continue
+        result = await _dispatch(router, parent, items[index], BatchContext(user, session))
+        if result["status"] >= 400:
+            # 失敗した書き込みのトランザクションを次の呼び出しに持ち越さない
+            await run_in_threadpool(session.rollback)
+        results.append(result)
+        index += 1
+    return results
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+from sqlalchemy import event, select, update
+
+from . import metrics, models
+
+# 他ワーカーの更新を検知するためにバージョンを確認する間隔(秒)
+CACHE_VERSION_TTL = float(os.getenv("CACHE_VERSION_TTL", "1.0"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "64"))
+
+# キャッシュ対象のモデルとコレクション名
+CACHED_MODELS = {
+    models.Project: "projects",
+    models.User: "users",
+}
+
+
+class CollectionCache:
+    """DB上のバージョン番号で無効化される一覧レスポンスのキャッシュ"""
+
+    def __init__(self, name: str, max_entries: int = CACHE_MAX_ENTRIES, version_ttl: float = CACHE_VERSION_TTL):
+        self.name = name
+        self.max_entries = max_entries
+        self.version_ttl = version_ttl
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def mark_stale(self):
+        """次回アクセス時にDBのバージョンを必ず確認させる"""
+        self._stale = True
+
+    def _current_version(self, db) -> Optional[int]:
+        now = time.monotonic()
+        if not self._stale and self._version is not None and now - self._checked_at < self.version_ttl:
+            return self._version
+        version = db.execute(
+            select(models.CacheVersion.version).where(models.CacheVersion.name == self.name)
+        ).scalar()
+        self._checked_at = now
+        self._stale = False
+        return version
+
+    def get_or_load(self, db, key: Hashable, loader: Callable[[], bytes]) -> bytes:
+        """キャッシュがあれば返し、無ければloaderで作成して保存"""
+        version = self._current_version(db)
+        if version is None:
+            # バージョン行が無い(マイグレーション前)ならキャッシュしない
+            metrics.CACHE_REQUESTS.inc(self.name, "bypass")
+            return loader()
+
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+        if body is not None:
+            metrics.CACHE_REQUESTS.inc(self.name, "hit")
+            return body
+
+        metrics.CACHE_REQUESTS.inc(self.name, "miss")
+        body = loader()
+        with self._lock:
+            if self._version == version:
+                self._entries[key] = body
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            metrics.CACHE_ENTRIES.set(self.name, value=len(self._entries))
+        return body
+
+
+CACHES: Dict[str, CollectionCache] = {name: CollectionCache(name) for name in CACHED_MODELS.values()}
+
+
+def bump_version(session, name: str):
+    """コレクションのバージョンを更新中のトランザクション内で上げる"""
+    # flush中でも使えるようにセッションのautoflushを経由せずに実行
+    session.connection().execute(
+        update(models.CacheVersion)
+        .where(models.CacheVersion.name == name)
+        .values(version=models.CacheVersion.version + 1)
+    )
+    session.info.setdefault("cache_bumped", set()).add(name)
+
+
+def _before_flush(session, flush_context, instances):
+    names = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        name = CACHED_MODELS.get(type(obj))
+        if name and (obj not in session.dirty or session.is_modified(obj)):
+            names.add(name)
+    for name in names - session.info.get("cache_bumped", set()):
+        bump_version(session, name)
+
+
+def _do_orm_execute(orm_execute_state):
+    # query(...).delete() / update() のような一括更新はflushを通らない
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    name = CACHED_MODELS.get(mapper.class_) if mapper is not None else None
+    if name and name not in orm_execute_state.session.info.get("cache_bumped", set()):
+        bump_version(orm_execute_state.session, name)
+
+
+def _after_commit(session):
+    for name in session.info.pop("cache_bumped", set()):
+        CACHES[name].mark_stale()
+
+
+def _after_rollback(session):
+    session.info.pop("cache_bumped", None)
+
+
+def install(session_factory):
+    """セッションの書き込みを監視してキャッシュを無効化するイベントを登録"""
+    event.listen(session_factory, "before_flush", _before_flush)
+    event.listen(session_factory, "do_orm_execute", _do_orm_execute)
+    event.listen(session_factory, "after_commit", _after_commit)
+    event.listen(session_factory, "after_rollback", _after_rollback)
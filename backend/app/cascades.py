@@ -0,0 +1,168 @@
+"""ジョブキューで実行する一括削除
+
+どの手順も「条件に合う行を batch_size 件だけ処理して件数を返す」形にしてあり、
+何度実行しても同じ結果になるので途中から再開できる。
+"""
+from sqlalchemy import delete, select, update
+
+from . import jobs, models, outbox, stats
+
+tasks = models.Task.__table__
+comments = models.Comment.__table__
+notifications = models.Notification.__table__
+tasks_archive = models.ArchivedTask.__table__
+comments_archive = models.ArchivedComment.__table__
+notifications_archive = models.ArchivedNotification.__table__
+dependencies = models.TaskDependency.__table__
+
+
+def _ids(db, query, batch_size: int):
+    return list(db.execute(query.limit(batch_size)).scalars())
+
+
+def _delete_batch(db, table, query, batch_size: int) -> int:
+    ids = _ids(db, query, batch_size)
+    if ids:
+        db.execute(delete(table).where(table.c.id.in_(ids)))
+    return len(ids)
+
+
+# プロジェクトの削除
+def _project_task_ids(params):
+    return select(tasks.c.id).where(tasks.c.project_id == params["project_id"])
+
+
+def delete_project_comments(db, params, batch_size):
+    query = select(comments.c.id).where(comments.c.task_id.in_(_project_task_ids(params)))
+    return _delete_batch(db, comments, query, batch_size)
+
+
+def delete_project_notifications(db, params, batch_size):
+    query = select(notifications.c.id).where(notifications.c.task_id.in_(_project_task_ids(params)))
+    return _delete_batch(db, notifications, query, batch_size)
+
+
+def delete_project_tasks(db, params, batch_size):
+    ids = _ids(db, _project_task_ids(params), batch_size)
+    if ids:
+        stats.remove_tasks(db, models.Task.id.in_(ids))
+        # 削除中に追加されたコメント・通知があっても外部キーで失敗しないようにする
+        db.execute(delete(comments).where(comments.c.task_id.in_(ids)))
+        db.execute(delete(notifications).where(notifications.c.task_id.in_(ids)))
+        # 他のプロジェクトのタスクとの依存も外す(親子は同じプロジェクト内なのでまとめて消える)
+        db.execute(delete(dependencies).where(
+            dependencies.c.task_id.in_(ids) | dependencies.c.depends_on_id.in_(ids)
+        ))
+        db.execute(delete(tasks).where(tasks.c.id.in_(ids)))
+    return len(ids)
+
+
+def delete_project_archived_comments(db, params, batch_size):
+    task_ids = select(tasks_archive.c.id).where(tasks_archive.c.project_id == params["project_id"])
+    query = select(comments_archive.c.id).where(comments_archive.c.task_id.in_(task_ids))
+    return _delete_batch(db, comments_archive, query, batch_size)
+
+
+def delete_project_archived_tasks(db, params, batch_size):
+    query = select(tasks_archive.c.id).where(tasks_archive.c.project_id == params["project_id"])
+    return _delete_batch(db, tasks_archive, query, batch_size)
+
+
+def delete_project_row(db, params, batch_size):
+    # 削除中に追加されたタスクが残っていれば先に片付ける
+    leftover = delete_project_tasks(db, params, batch_size)
+    if leftover:
+        return leftover
+    project = db.get(models.Project, params["project_id"])
+    if project is None:
+        return 0
+    outbox.enqueue_emit(db, 'project_update', 'project_deleted', {'id': project.id}, f"project:{project.id}")
+    db.delete(project)
+    db.flush()
+    return 1
+
+
+# ユーザーの削除(user_id指定)とリセット(max_user_id以下の全員)
+def _user_filter(column, params):
+    if params.get("user_id") is not None:
+        return column == params["user_id"]
+    return column <= params["max_user_id"]
+
+
+def delete_user_notifications(db, params, batch_size):
+    query = select(notifications.c.id).where(_user_filter(notifications.c.user_id, params))
+    return _delete_batch(db, notifications, query, batch_size)
+
+
+def delete_user_archived_notifications(db, params, batch_size):
+    query = select(notifications_archive.c.id).where(_user_filter(notifications_archive.c.user_id, params))
+    return _delete_batch(db, notifications_archive, query, batch_size)
+
+
+def delete_user_comments(db, params, batch_size):
+    query = select(comments.c.id).where(_user_filter(comments.c.user_id, params))
+    return _delete_batch(db, comments, query, batch_size)
+
+
+def unassign_user_tasks(db, params, batch_size):
+    """担当タスクは残して担当者を外す(ユーザー削除の従来の挙動)"""
+    ids = _ids(db, select(tasks.c.id).where(_user_filter(tasks.c.assignee_id, params)), batch_size)
+    if ids:
+        stats.remove_tasks(db, models.Task.id.in_(ids))
+        db.execute(update(tasks).where(tasks.c.id.in_(ids)).values(assignee_id=None))
+        stats.add_tasks(db, models.Task.id.in_(ids))
+    return len(ids)
+
+
+def unassign_user_archived_tasks(db, params, batch_size):
+    ids = _ids(db, select(tasks_archive.c.id).where(_user_filter(tasks_archive.c.assignee_id, params)), batch_size)
+    if ids:
+        db.execute(update(tasks_archive).where(tasks_archive.c.id.in_(ids)).values(assignee_id=None))
+    return len(ids)
+
+
+def release_user_projects(db, params, batch_size):
+    """所有プロジェクトは残して所有者を外す"""
+    ids = _ids(db, select(models.Project.id).where(_user_filter(models.Project.owner_id, params)), batch_size)
+    if ids:
+        # ORMの一括更新にしてプロジェクト一覧のキャッシュを無効化する
+        db.query(models.Project).filter(models.Project.id.in_(ids)).update(
+            {"owner_id": None}, synchronize_session=False
+        )
+    return len(ids)
+
+
+def delete_user_rows(db, params, batch_size):
+    ids = _ids(db, select(models.User.id).where(_user_filter(models.User.id, params)), batch_size)
+    if ids:
+        # 削除中に追加された関連行があれば先に片付ける
+        for _, step in USER_STEPS[:-1]:
+            leftover = step(db, params, batch_size)
+            if leftover:
+                return leftover
+        db.query(models.User).filter(models.User.id.in_(ids)).delete(synchronize_session=False)
+    return len(ids)
+
+
+PROJECT_STEPS = [
+    ("comments", delete_project_comments),
+    ("notifications", delete_project_notifications),
+    ("tasks", delete_project_tasks),
+    ("archived_comments", delete_project_archived_comments),
+    ("archived_tasks", delete_project_archived_tasks),
+    ("project", delete_project_row),
+]
+
+USER_STEPS = [
+    ("notifications", delete_user_notifications),
+    ("archived_notifications", delete_user_archived_notifications),
+    ("comments", delete_user_comments),
+    ("tasks", unassign_user_tasks),
+    ("archived_tasks", unassign_user_archived_tasks),
+    ("projects", release_user_projects),
+    ("users", delete_user_rows),
+]
+
+jobs.register("delete_project", PROJECT_STEPS)
+jobs.register("delete_user", USER_STEPS)
+jobs.register("reset_users", USER_STEPS)
@@ -1,5 +1,8 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from . import models, schemas
+from . import models, schemas, stats, outbox, ranking, activity, hierarchy, statements
 from .auth import get_password_hash
 
 # ユーザー操作
@@ -9,7 +12,7 @@ def get_user(db: Session, user_id: int):
 
 def get_user_by_email(db: Session, email: str):
     """ユーザーをメールアドレスで取得"""
-    return db.query(models.User).filter(models.User.email == email).first()
+    return statements.user_by_email(db, email)
 
 def create_user(db: Session, user: schemas.UserCreate):
     """新規ユーザーを作成"""
@@ -35,6 +38,9 @@ def create_project(db: Session, project: schemas.ProjectCreate, user_id: int):
     """新規プロジェクトを作成"""
     db_project = models.Project(**project.dict(), owner_id=user_id)
     db.add(db_project)
+    db.flush()
+    outbox.enqueue_emit(db, 'project_update', 'project_created', outbox.project_payload(db_project),
+                        f"project:{db_project.id}")
     db.commit()
     db.refresh(db_project)
     return db_project
@@ -44,47 +50,266 @@ def get_project(db: Session, project_id: int):
     return db.query(models.Project).filter(models.Project.id == project_id).first()
 
 # タスク操作
-def get_tasks(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    """ユーザーのタスク一覧を取得"""
-    return db.query(models.Task).filter(
-        models.Task.assignee_id == user_id
-    ).offset(skip).limit(limit).all()
+def get_tasks(db: Session, user_id: Optional[int] = None, skip: int = 0, limit: int = 100):
+    """タスク一覧を取得(user_id指定時はそのユーザーの担当分のみ)"""
+    query = db.query(models.Task)
+    if user_id is not None:
+        query = query.filter(models.Task.assignee_id == user_id)
+    return query.offset(skip).limit(limit).all()
+
+def get_task_rows(db: Session, columns, user_id: Optional[int] = None, skip: int = 0, limit: int = 100):
+    """タスク一覧を列タプルで取得(ORMオブジェクトを生成しない)"""
+    query = db.query(*columns)
+    if user_id is not None:
+        query = query.filter(models.Task.assignee_id == user_id)
+    return query.offset(skip).limit(limit).all()
 
 def get_project_tasks(db: Session, project_id: int):
     """プロジェクトのタスク一覧を取得"""
     return db.query(models.Task).filter(
         models.Task.project_id == project_id
-    ).all()
+    ).order_by(models.Task.status, models.Task.rank, models.Task.id).all()
+
+def get_project_task_rows(db: Session, project_id: int, columns):
+    """プロジェクトのタスク一覧を列タプルで取得"""
+    return db.query(*columns).filter(
+        models.Task.project_id == project_id
+    ).order_by(models.Task.status, models.Task.rank, models.Task.id).all()
+
+def _calendar_filter(query, date_from: str, date_to: str, project_id: Optional[int], assignee_id: Optional[int]):
+    """期間・プロジェクト・担当者で絞り込む"""
+    query = query.filter(
+        models.Task.due_date >= date_from,
+        models.Task.due_date <= date_to
+    )
+    if project_id is not None:
+        query = query.filter(models.Task.project_id == project_id)
+    if assignee_id is not None:
+        query = query.filter(models.Task.assignee_id == assignee_id)
+    return query
+
+def get_calendar_task_rows(db: Session, columns, date_from: str, date_to: str,
+                           project_id: Optional[int] = None, assignee_id: Optional[int] = None):
+    """期間内に期限があるタスクを列タプルで取得"""
+    query = _calendar_filter(db.query(*columns), date_from, date_to, project_id, assignee_id)
+    return query.order_by(models.Task.due_date, models.Task.start_time, models.Task.id).all()
+
+def get_calendar_day_counts(db: Session, date_from: str, date_to: str,
+                            project_id: Optional[int] = None, assignee_id: Optional[int] = None):
+    """期間内のタスク数を日付・ステータスごとに集計"""
+    query = db.query(models.Task.due_date, models.Task.status, func.count(models.Task.id))
+    query = _calendar_filter(query, date_from, date_to, project_id, assignee_id)
+    return query.group_by(models.Task.due_date, models.Task.status).order_by(models.Task.due_date).all()
+
+def _emit_progress(db: Session, project_id: Optional[int], task_ids):
+    """子孫の集計が変わった祖先を送る"""
+    items = hierarchy.progress_payload(db, task_ids)
+    if items:
+        outbox.enqueue_emit(db, 'task_update', 'subtasks_progress',
+                            {'project_id': project_id, 'items': items}, f"project:{project_id}")
 
 def create_task(db: Session, task: schemas.TaskCreate, user_id: int):
-    """新規タスクを作成"""
+    """新規タスクを作成(parent_id 指定時はサブタスク。親が無い・別プロジェクトなら ValueError)"""
     # assignee_idが指定されていない場合のみ、作成者を担当者にする
     task_data = task.dict()
     if task_data.get('assignee_id') is None:
         task_data['assignee_id'] = user_id
+    if task_data.get('parent_id') is not None:
+        parent = db.query(models.Task).filter(models.Task.id == task_data['parent_id']).with_for_update().first()
+        if parent is None:
+            raise ValueError("親タスクが見つかりません")
+        if task_data.get('project_id') is None:
+            task_data['project_id'] = parent.project_id
+        elif task_data['project_id'] != parent.project_id:
+            raise ValueError("親タスクは同じプロジェクトから選んでください")
     
+    task_data['is_overdue'] = stats.compute_overdue(task_data.get('due_date'), task_data.get('status'))
+    if task_data.get('status') == models.TaskStatus.DONE.value:
+        task_data['completed_at'] = datetime.utcnow()
+    # 列の末尾に追加
+    task_data['rank'] = ranking.append_rank(
+        db, task_data.get('project_id'), task_data.get('status') or models.TaskStatus.TODO.value
+    )
     db_task = models.Task(**task_data)
     db.add(db_task)
+    db.flush()
+    stats.record_change(db, None, stats.task_key(db_task))
+    activity.record(db, db_task.id, user_id, "created")
+    outbox.enqueue_emit(db, 'task_update', 'task_created', outbox.task_payload(db_task), f"task:{db_task.id}")
+    if db_task.parent_id is not None:
+        _emit_progress(db, db_task.project_id, hierarchy.adjust_rollup(db, [db_task.id], 1))
     db.commit()
     db.refresh(db_task)
     return db_task
 
 
-def update_task(db: Session, task_id: int, task: schemas.TaskUpdate):
-    """タスクを更新"""
-    db_task = db.query(models.Task).filter(models.Task.id == task_id).first()
+def update_task(db: Session, task_id: int, task: schemas.TaskUpdate, actor: Optional[models.User] = None):
+    """タスクを更新(actorが他人を担当者にしたらその人に通知)
+
+    親の付け替えができない場合や、階層の中のタスクを別のプロジェクトへ移す場合は ValueError。
+    """
+    db_task = statements.task_by_id(db, task_id)
     if db_task:
+        old_key = stats.task_key(db_task)
+        old_values = activity.snapshot(db_task)
+        old_assignee_id = db_task.assignee_id
+        old_column = (db_task.project_id, db_task.status)
+        was_done = db_task.status == models.TaskStatus.DONE.value
         update_data = task.dict(exclude_unset=True)
+        has_parent = 'parent_id' in update_data
+        parent_id = update_data.pop('parent_id', None)
+        new_project_id = update_data.get('project_id', db_task.project_id)
+        if new_project_id != db_task.project_id and (
+                (parent_id if has_parent else db_task.parent_id) is not None or db_task.subtasks_total):
+            raise ValueError("親やサブタスクのあるタスクは別のプロジェクトへ移動できません")
         for key, value in update_data.items():
             setattr(db_task, key, value)
+        is_done = db_task.status == models.TaskStatus.DONE.value
+        changed = []
+        if is_done != was_done:
+            db_task.completed_at = datetime.utcnow() if is_done else None
+            changed += hierarchy.adjust_done(db, task_id, 1 if is_done else -1)
+        if has_parent:
+            try:
+                changed += hierarchy.set_parent(db, db_task, parent_id)
+            except ValueError:
+                db.rollback()
+                raise
+        if (db_task.project_id, db_task.status) != old_column:
+            # 別の列に移ったら末尾に並べる
+            db_task.rank = ranking.append_rank(db, db_task.project_id, db_task.status)
+        db_task.is_overdue = stats.compute_overdue(db_task.due_date, db_task.status)
+        stats.record_change(db, old_key, stats.task_key(db_task))
+        activity.record_update(db, db_task, old_values, actor.id if actor else None)
+        new_assignee_id = db_task.assignee_id
+        if actor and new_assignee_id and new_assignee_id != old_assignee_id and new_assignee_id != actor.id:
+            outbox.enqueue_notification(
+                db, new_assignee_id, task_id, 'assigned',
+                f'{actor.name}さんがあなたに「{db_task.title}」を割り当てました'
+            )
+        outbox.enqueue_emit(db, 'task_update', 'task_updated', outbox.task_payload(db_task), f"task:{task_id}")
+        _emit_progress(db, db_task.project_id, list(dict.fromkeys(changed)))
         db.commit()
         db.refresh(db_task)
     return db_task
 
-def delete_task(db: Session, task_id: int):
+def _lock_task(db: Session, task_id: int):
+    return db.query(models.Task).filter(models.Task.id == task_id).with_for_update().first()
+
+def _move_rank(db: Session, db_task: models.Task, status: Optional[str],
+               after: Optional[models.Task], before: Optional[models.Task]) -> str:
+    """after の直後・before の直前に置くランク(どちらも無ければ列の末尾)"""
+    project_id = db_task.project_id
+    prev_rank = after.rank if after else None
+    next_rank = before.rank if before else None
+    if after is not None and before is None:
+        next_rank = ranking.neighbor_rank(db, project_id, status, prev_rank, db_task.id, after=True)
+    elif before is not None and after is None:
+        prev_rank = ranking.neighbor_rank(db, project_id, status, next_rank, db_task.id, after=False)
+    elif after is None and before is None:
+        prev_rank = ranking.neighbor_rank(db, project_id, status, None, db_task.id, after=False)
+    if (after is not None and prev_rank is None) or (before is not None and next_rank is None):
+        raise ValueError("前後のタスクにランクがありません")
+    return ranking.rank_between(prev_rank, next_rank)
+
+def move_task(db: Session, task_id: int, move: schemas.TaskMove, actor: Optional[models.User] = None):
+    """ボードの列内・列間でタスクを移動(更新するのは移動したタスクの1行だけ)
+
+    前後のタスクが同じ列に無い、または順序が合わない場合は ValueError。
+    """
+    db_task = _lock_task(db, task_id)
+    if db_task is None:
+        return None
+    status = move.status or db_task.status
+    neighbors = {}
+    for name, neighbor_id in (("after", move.after_id), ("before", move.before_id)):
+        if neighbor_id is None:
+            neighbors[name] = None
+            continue
+        neighbor = _lock_task(db, neighbor_id) if neighbor_id != task_id else None
+        if neighbor is None or neighbor.project_id != db_task.project_id or neighbor.status != status:
+            raise ValueError("前後のタスクが移動先の列にありません")
+        neighbors[name] = neighbor
+    after, before = neighbors["after"], neighbors["before"]
+    if after is not None and before is not None and after.rank and before.rank and after.rank > before.rank:
+        raise ValueError("前後のタスクの順序が一致しません")
+    try:
+        rank = _move_rank(db, db_task, status, after, before)
+    except ValueError:
+        # ランクの重複や未設定で間が取れなければ、列を振り直してからもう一度
+        ranking.rebalance_column(db, db_task.project_id, status)
+        db.expire_all()
+        try:
+            rank = _move_rank(db, db_task, status, after, before)
+        except ValueError:
+            db.rollback()
+            raise ValueError("前後のタスクの順序が一致しません")
+
+    old_key = stats.task_key(db_task)
+    old_values = activity.snapshot(db_task)
+    was_done = db_task.status == models.TaskStatus.DONE.value
+    db_task.status = status
+    db_task.rank = rank
+    is_done = status == models.TaskStatus.DONE.value
+    if is_done != was_done:
+        db_task.completed_at = datetime.utcnow() if is_done else None
+        _emit_progress(db, db_task.project_id, hierarchy.adjust_done(db, task_id, 1 if is_done else -1))
+    db_task.is_overdue = stats.compute_overdue(db_task.due_date, db_task.status)
+    stats.record_change(db, old_key, stats.task_key(db_task))
+    # 列内の並び替えは履歴に残さない(ステータスが変わったときだけ記録される)
+    activity.record_update(db, db_task, old_values, actor.id if actor else None)
+    # 並び替えでは移動したタスクの位置だけを送る
+    outbox.enqueue_emit(db, 'task_update', 'task_moved', {
+        'id': db_task.id,
+        'project_id': db_task.project_id,
+        'status': db_task.status,
+        'rank': rank,
+    }, f"task:{task_id}")
+    db.commit()
+    db.refresh(db_task)
+    return db_task
+
+def delete_task(db: Session, task_id: int, actor: Optional[models.User] = None):
     """タスクを削除"""
-    db_task = db.query(models.Task).filter(models.Task.id == task_id).first()
+    db_task = statements.task_by_id(db, task_id)
     if db_task:
+        stats.record_change(db, stats.task_key(db_task), None)
+        # 削除後も何のタスクだったか分かるよう、消える値を残す
+        activity.record(db, task_id, actor.id if actor else None, "deleted",
+                        activity.diff(activity.snapshot(db_task), {}))
+        outbox.enqueue_emit(db, 'task_update', 'task_deleted', {'id': task_id}, f"task:{task_id}")
+        # サブタスクは一つ上の親へ付け替える
+        _emit_progress(db, db_task.project_id, hierarchy.detach(db, [task_id]))
         db.delete(db_task)
         db.commit()
     return db_task
+
+def add_dependency(db: Session, task_id: int, depends_on_id: int):
+    """task_id が depends_on_id の完了を待つ依存を追加(循環する場合は ValueError)"""
+    # 逆向きの依存を同時に追加して循環しないよう、両方のタスクをID順にロック
+    found = db.query(models.Task.id).filter(
+        models.Task.id.in_([task_id, depends_on_id])
+    ).order_by(models.Task.id).with_for_update().all()
+    if len(found) < len({task_id, depends_on_id}):
+        return None
+    if hierarchy.would_create_dependency_cycle(db, task_id, depends_on_id):
+        raise ValueError("依存関係が循環します")
+    dependency = db.get(models.TaskDependency, (task_id, depends_on_id))
+    if dependency is None:
+        dependency = models.TaskDependency(task_id=task_id, depends_on_id=depends_on_id)
+        db.add(dependency)
+        outbox.enqueue_emit(db, 'task_update', 'dependency_added',
+                            {'task_id': task_id, 'depends_on_id': depends_on_id}, f"task:{task_id}")
+        db.commit()
+    return dependency
+
+def remove_dependency(db: Session, task_id: int, depends_on_id: int) -> bool:
+    """依存を削除(無ければ False)"""
+    dependency = db.get(models.TaskDependency, (task_id, depends_on_id))
+    if dependency is None:
+        return False
+    db.delete(dependency)
+    outbox.enqueue_emit(db, 'task_update', 'dependency_removed',
+                        {'task_id': task_id, 'depends_on_id': depends_on_id}, f"task:{task_id}")
+    db.commit()
+    return True
@@ -1,18 +1,149 @@
 import os
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.elements import TextClause
+
+from . import batch
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
 
 if not SQLALCHEMY_DATABASE_URL:
     raise RuntimeError("環境変数 DATABASE_URL が設定されていません。")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# SQLite(ファイル)の設定。単一ノード・ローカル用に、WALで読み込みと書き込みを並行させ、
+# 書き込みは1本の接続に直列化して "database is locked" を避ける
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+SQLITE_TUNED = (
+    IS_SQLITE
+    and os.getenv("SQLITE_TUNED", "true").lower() in ("1", "true", "yes")
+    # sqlite:// や :memory: はプロセス内だけのDBなので対象外
+    and make_url(SQLALCHEMY_DATABASE_URL).database not in (None, "", ":memory:")
+    and "mode=memory" not in SQLALCHEMY_DATABASE_URL
+)
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))
+# ロックが解けるのを待つ時間(ミリ秒)。他のプロセスが書き込み中でもすぐには失敗しない
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# 書き込み用の接続が空くのを待つ時間(秒)
+SQLITE_WRITE_TIMEOUT = float(os.getenv("SQLITE_WRITE_TIMEOUT", "30"))
+# WALなら NORMAL でもコミット済みのデータは壊れない(電源断で直近のコミットを失うことはある)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# SQLのコンパイル結果をキャッシュする件数(エンジンごと。SQLAlchemy の既定は500)
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1000"))
+# Postgres(psycopg 3)で同じSQLをこの回数実行したらサーバー側でプリペアする(0で初回から、空で無効)。
+# psycopg2 にはサーバー側のプリペアが無いので、postgresql+psycopg:// のURLでのみ使う
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "5").strip()
+
+
+def _sqlite_engine(pool_size: int, max_overflow: int, begin=None, **kwargs):
+    sqlite_engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        query_cache_size=DB_QUERY_CACHE_SIZE,
+        **kwargs,
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        # pysqlite の自動BEGINを止める。読み込み用は文ごとに最新のコミットを読む(Postgres の READ COMMITTED と同じ)
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in (
+            "PRAGMA journal_mode=WAL",
+            f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+            f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+            f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+            f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+            "PRAGMA temp_store=MEMORY",
+        ):
+            cursor.execute(pragma)
+        cursor.close()
+
+    if begin is not None:
+        @event.listens_for(sqlite_engine, "begin")
+        def _begin(conn):
+            # ドライバーへ直接送る(SQLの計測やクエリログに数えない)
+            conn.connection.driver_connection.execute(begin)
+
+    return sqlite_engine
+
+
+if SQLITE_TUNED:
+    # 読み込み用のプール(WALなので書き込み中も読める)
+    engine = _sqlite_engine(SQLITE_READ_POOL_SIZE, SQLITE_READ_POOL_SIZE)
+    # 書き込み用の1接続。最初から書き込みロックを取り、途中でロックの昇格に失敗しないようにする
+    write_engine = _sqlite_engine(1, 0, "BEGIN IMMEDIATE", pool_timeout=SQLITE_WRITE_TIMEOUT)
+else:
+    connect_args = {}
+    if SQLALCHEMY_DATABASE_URL.startswith("postgresql+psycopg:"):
+        connect_args["prepare_threshold"] = int(DB_PREPARE_THRESHOLD) if DB_PREPARE_THRESHOLD else None
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL, connect_args=connect_args, query_cache_size=DB_QUERY_CACHE_SIZE
+    )
+    write_engine = engine
+
+# 計測などのイベントを登録するエンジン
+ENGINES = (engine,) if write_engine is engine else (engine, write_engine)
+
+
+def _is_write(clause) -> bool:
+    if clause is None:
+        # session.connection() など文の無い要求は書き込みに使われる
+        return True
+    if getattr(clause, "is_dml", False) or getattr(clause, "_for_update_arg", None) is not None:
+        return True
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith(("SELECT", "WITH"))
+    return False
+
+
+class RoutingSession(Session):
+    """SQLite: 書き込み・行ロック付きの読み込みは書き込み用の接続、それ以外は読み込み用のプールで実行
+
+    一度書き込んだトランザクションは、自分の書いた内容が見えるようコミットまで書き込み用の接続を使う。
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.info.get("use_writer") or self._flushing or _is_write(clause):
+            self.info["use_writer"] = True
+            return write_engine
+        return engine
+
+
+def _reset_writer(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("use_writer", None)
+
+
+if SQLITE_TUNED:
+    SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
+    event.listen(SessionLocal, "after_transaction_end", _reset_writer)
+else:
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
+
+def is_lock_error(exc: Exception) -> bool:
+    """SQLite の書き込みを待ちきれなかったか("database is locked" か、書き込み用の接続が空かなかった)"""
+    if not IS_SQLITE:
+        return False
+    return isinstance(exc, PoolTimeoutError) or "database is locked" in str(getattr(exc, "orig", exc))
+
+
+def get_db(request: Request):
+    # POST /api/batch の中の書き込みは、バッチのセッションを共有する(閉じるのはバッチ側)
+    shared = batch.shared_session(request)
+    if shared is not None:
+        yield shared
+        return
     db = SessionLocal()
     try:
         yield db
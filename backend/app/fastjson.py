@@ -0,0 +1,104 @@
+import os
+from typing import List, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+from . import models, schemas
+
+try:
+    import orjson
+except ImportError:  # orjsonが無い環境ではpydanticでシリアライズ
+    orjson = None
+
+
+def _dump(data, adapter: TypeAdapter, partial: bool) -> bytes:
+    # 列はスキーマのフィールドから選んでいて型もDBの列の型なので、orjson があれば検証せずにエンコード
+    if orjson is not None:
+        return orjson.dumps(data)
+    if partial:
+        # フィールド指定ありの一部の列だけの応答はスキーマと形が違う
+        return (DictListAdapter if isinstance(data, list) else DictAdapter).dump_json(data)
+    return adapter.dump_json(adapter.validate_python(data))
+
+# 高速シリアライズを有効にするか(環境変数でオプトイン)
+FAST_JSON_ENABLED = os.getenv("FAST_JSON", "").lower() in ("1", "true", "yes")
+
+# レスポンスに含める列(スキーマのフィールドと同じ順序)
+TASK_COLUMNS = (
+    models.Task.title,
+    models.Task.description,
+    models.Task.status,
+    models.Task.priority,
+    models.Task.due_date,
+    models.Task.start_time,
+    models.Task.end_time,
+    models.Task.project_id,
+    models.Task.parent_id,
+    models.Task.id,
+    models.Task.assignee_id,
+    models.Task.created_at,
+    models.Task.rank,
+    models.Task.attachments,
+    models.Task.subtasks_total,
+    models.Task.subtasks_done,
+)
+PROJECT_COLUMNS = (
+    models.Project.title,
+    models.Project.description,
+    models.Project.color,
+    models.Project.id,
+    models.Project.owner_id,
+    models.Project.created_at,
+)
+USER_COLUMNS = (
+    models.User.email,
+    models.User.name,
+    models.User.id,
+    models.User.is_active,
+    models.User.avatar,
+    models.User.created_at,
+)
+
+# 一覧スキーマのアダプター(起動時に一度だけ構築)
+TaskListAdapter = TypeAdapter(List[schemas.Task])
+ProjectListAdapter = TypeAdapter(List[schemas.Project])
+UserListAdapter = TypeAdapter(List[schemas.User])
+TaskHierarchyAdapter = TypeAdapter(schemas.TaskHierarchy)
+DictListAdapter = TypeAdapter(List[dict])
+DictAdapter = TypeAdapter(dict)
+
+
+def select_columns(fields: Optional[str], columns: Sequence) -> Sequence:
+    """?fields=id,title のような指定から取得する列を絞り込む"""
+    if not fields:
+        return columns
+    available = {column.key: column for column in columns}
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if not names or unknown:
+        raise HTTPException(status_code=400, detail=f"指定できないフィールドです: {', '.join(unknown)}")
+    return tuple(available[name] for name in dict.fromkeys(names))
+
+
+def rows_to_dicts(rows: Sequence) -> List[dict]:
+    """列タプルを辞書に変換"""
+    if not rows:
+        return []
+    keys = rows[0]._fields
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def list_response(rows: Sequence, adapter: TypeAdapter, partial: bool = False) -> Response:
+    """列タプルからORMを経由せずにJSONレスポンスを生成
+
+    列(*_COLUMNS)はレスポンスのスキーマのフィールドと同じなので、行ごとの検証はせずに orjson でエンコードする。
+    orjson が無い環境ではスキーマ(adapter)で検証して pydantic-core でエンコードする。
+    """
+    return Response(content=_dump(rows_to_dicts(rows), adapter, partial), media_type="application/json")
+
+
+def object_response(data: dict, adapter: TypeAdapter, partial: bool = False) -> Response:
+    """list_response の一覧以外(辞書)版"""
+    return Response(content=_dump(data, adapter, partial), media_type="application/json")
@@ -0,0 +1,224 @@
+"""サブタスクとタスク間の依存
+
+親子関係は tasks.parent_id、依存関係は task_dependencies で持ち、どちらも再帰CTEで
+1回のクエリで辿る(階層の深さだけ往復しない)。
+子孫タスクの数と完了数は祖先の行に持ち、作成・ステータス変更・付け替え・削除のたびに
+祖先へ差分を足すので、一覧では集計し直さずに進捗を表示できる。
+親子は同じプロジェクト内に限る。
+
+    python -m app.hierarchy          # 集計を作り直す
+"""
+import os
+from typing import Iterable, List, Optional, Sequence
+
+from sqlalchemy import bindparam, case, delete, exists, func, literal, or_, select, update
+
+from . import models
+
+# 再帰CTEで辿る深さの上限(万一循環したデータがあっても止まるようにする)
+HIERARCHY_MAX_DEPTH = int(os.getenv("HIERARCHY_MAX_DEPTH", "50"))
+
+tasks = models.Task.__table__
+dependencies = models.TaskDependency.__table__
+
+DONE = models.TaskStatus.DONE.value
+
+
+def _ancestors(task_ids: Iterable[int]):
+    """(origin, ancestor_id) の再帰CTE: task_ids それぞれの祖先"""
+    anchor = select(
+        tasks.c.id.label("origin"), tasks.c.parent_id.label("ancestor_id"), literal(1).label("depth")
+    ).where(tasks.c.id.in_(list(task_ids)), tasks.c.parent_id.isnot(None))
+    cte = anchor.cte("ancestors", recursive=True)
+    parent = tasks.alias("parent")
+    return cte.union_all(
+        select(cte.c.origin, parent.c.parent_id, cte.c.depth + 1)
+        .join(parent, parent.c.id == cte.c.ancestor_id)
+        .where(parent.c.parent_id.isnot(None), cte.c.depth < HIERARCHY_MAX_DEPTH)
+    )
+
+
+def _descendants(root_filter, columns: Sequence[str]):
+    """root_filter に合うタスクとその子孫の再帰CTE(columns と depth を持つ)"""
+    anchor = select(*(tasks.c[name] for name in columns), literal(0).label("depth")).where(root_filter)
+    cte = anchor.cte("subtree", recursive=True)
+    child = tasks.alias("child")
+    return cte.union_all(
+        select(*(child.c[name] for name in columns), cte.c.depth + 1)
+        .join(cte, child.c.parent_id == cte.c.id)
+        .where(cte.c.depth < HIERARCHY_MAX_DEPTH)
+    )
+
+
+def _load(db, root_filter, columns: Sequence[str]) -> List:
+    """親が子より先に来る順(深さ、列、ランク順)で1回のクエリで取得"""
+    cte = _descendants(root_filter, list(dict.fromkeys(["id", "status", "rank", *columns])))
+    # CTEの列名は str の派生型になるので、orjson でキーにできるようラベルを付け直す
+    return db.execute(
+        select(*(cte.c[name].label(name) for name in columns), cte.c.depth)
+        .order_by(cte.c.depth, cte.c.status, cte.c.rank, cte.c.id)
+    ).all()
+
+
+def load_subtree(db, task_id: int, columns: Sequence[str]) -> List:
+    """タスクとその子孫(depth はタスクからの深さ)"""
+    return _load(db, tasks.c.id == task_id, columns)
+
+
+def load_project(db, project_id: int, columns: Sequence[str]) -> List:
+    """プロジェクトの全タスクを階層順に(depth は最上位からの深さ)"""
+    return _load(db, (tasks.c.project_id == project_id) & tasks.c.parent_id.is_(None), columns)
+
+
+def get_dependencies(db, task_ids) -> List[dict]:
+    """task_ids(IDの一覧またはサブクエリ)のタスクの依存関係"""
+    rows = db.execute(
+        select(dependencies.c.task_id, dependencies.c.depends_on_id)
+        .where(dependencies.c.task_id.in_(task_ids))
+        .order_by(dependencies.c.task_id, dependencies.c.depends_on_id)
+    ).all()
+    return [{"task_id": task_id, "depends_on_id": depends_on_id} for task_id, depends_on_id in rows]
+
+
+def would_create_parent_cycle(db, task_id: int, parent_id: int) -> bool:
+    """parent_id がタスク自身か、その子孫なら True"""
+    if task_id == parent_id:
+        return True
+    ancestors = _ancestors([parent_id])
+    return db.execute(select(exists().where(ancestors.c.ancestor_id == task_id))).scalar()
+
+
+def would_create_dependency_cycle(db, task_id: int, depends_on_id: int) -> bool:
+    """task_id → depends_on_id の依存を足すと循環する(depends_on_id から task_id へ辿れる)なら True"""
+    if task_id == depends_on_id:
+        return True
+    anchor = select(dependencies.c.depends_on_id.label("node")).where(dependencies.c.task_id == depends_on_id)
+    cte = anchor.cte("reachable", recursive=True)
+    # UNION で重複を除くので、既存のデータが循環していても終わる
+    cte = cte.union(
+        select(dependencies.c.depends_on_id).join(cte, dependencies.c.task_id == cte.c.node)
+    )
+    return db.execute(select(exists().where(cte.c.node == task_id))).scalar()
+
+
+def _bump(db, deltas: List[dict]):
+    if deltas:
+        db.execute(
+            update(tasks).where(tasks.c.id == bindparam("ancestor")).values(
+                subtasks_total=tasks.c.subtasks_total + bindparam("total"),
+                subtasks_done=tasks.c.subtasks_done + bindparam("done"),
+            ),
+            deltas,
+        )
+
+
+def adjust_rollup(db, task_ids: List[int], sign: int, include_subtree: bool = False) -> List[int]:
+    """task_ids が増えた(sign=1)・減った(sign=-1)分を祖先の集計に反映し、祖先のIDを返す
+
+    include_subtree=True なら子孫ごと付け替える場合で、タスクの子孫の分も動かす。
+    変更内容がDBに書かれてから(flush後に)呼ぶ。
+    """
+    if not task_ids:
+        return []
+    ancestors = _ancestors(task_ids)
+    origin = tasks.alias("origin")
+    total = literal(1)
+    done = case((origin.c.status == DONE, 1), else_=0)
+    if include_subtree:
+        total = total + origin.c.subtasks_total
+        done = done + origin.c.subtasks_done
+    rows = db.execute(
+        select(ancestors.c.ancestor_id, func.sum(total), func.sum(done))
+        .join(origin, origin.c.id == ancestors.c.origin)
+        .group_by(ancestors.c.ancestor_id)
+    ).all()
+    _bump(db, [{"ancestor": ancestor, "total": sign * int(t), "done": sign * int(d)} for ancestor, t, d in rows])
+    return [row[0] for row in rows]
+
+
+def adjust_done(db, task_id: int, delta: int) -> List[int]:
+    """タスクの完了・未完了が変わった分を祖先の完了数に反映し、祖先のIDを返す"""
+    ancestors = _ancestors([task_id])
+    ids = list(db.execute(select(ancestors.c.ancestor_id)).scalars())
+    if ids:
+        db.execute(
+            update(tasks).where(tasks.c.id.in_(ids)).values(subtasks_done=tasks.c.subtasks_done + delta)
+        )
+    return ids
+
+
+def set_parent(db, db_task: models.Task, parent_id: Optional[int]) -> List[int]:
+    """親を付け替え(子孫ごと移る)、集計が変わった祖先のIDを返す
+
+    親が無い・別のプロジェクト・自身の子孫なら ValueError。
+    """
+    if parent_id == db_task.parent_id:
+        return []
+    if parent_id is not None:
+        parent = db.query(models.Task).filter(models.Task.id == parent_id).with_for_update().first()
+        if parent is None:
+            raise ValueError("親タスクが見つかりません")
+        if parent.project_id != db_task.project_id:
+            raise ValueError("親タスクは同じプロジェクトから選んでください")
+        if would_create_parent_cycle(db, db_task.id, parent_id):
+            raise ValueError("子孫のタスクを親にはできません")
+    db.flush()
+    changed = adjust_rollup(db, [db_task.id], -1, include_subtree=True)
+    db_task.parent_id = parent_id
+    db.flush()
+    changed += adjust_rollup(db, [db_task.id], 1, include_subtree=True)
+    return list(dict.fromkeys(changed))
+
+
+def detach(db, task_ids: List[int]) -> List[int]:
+    """削除・アーカイブするタスクを階層と依存関係から外し、集計が変わった祖先のIDを返す
+
+    子は一つ上の親へ付け替える(子孫の集計はそのまま祖先に残る)。
+    """
+    if not task_ids:
+        return []
+    changed = adjust_rollup(db, task_ids, -1)
+    parent = tasks.alias("parent")
+    grandparent_id = select(parent.c.parent_id).where(parent.c.id == tasks.c.parent_id).scalar_subquery()
+    # 親子とも外す場合は祖父母も外れるので、外すタスクを指す子がいなくなるまで繰り返す
+    for _ in range(HIERARCHY_MAX_DEPTH):
+        result = db.execute(
+            update(tasks).where(tasks.c.parent_id.in_(task_ids)).values(parent_id=grandparent_id)
+        )
+        if not result.rowcount:
+            break
+    db.execute(delete(dependencies).where(or_(
+        dependencies.c.task_id.in_(task_ids), dependencies.c.depends_on_id.in_(task_ids)
+    )))
+    return [task_id for task_id in changed if task_id not in task_ids]
+
+
+def progress_payload(db, task_ids: List[int]) -> List[dict]:
+    """祖先の集計を送る内容"""
+    if not task_ids:
+        return []
+    rows = db.execute(
+        select(tasks.c.id, tasks.c.subtasks_total, tasks.c.subtasks_done).where(tasks.c.id.in_(task_ids))
+    ).all()
+    return [{"id": row.id, "subtasks_total": row.subtasks_total, "subtasks_done": row.subtasks_done}
+            for row in rows]
+
+
+def rebuild_rollups(db) -> int:
+    """全タスクの集計を作り直す(差分がずれたときの復旧用)。件数を返す"""
+    db.execute(update(tasks).values(subtasks_total=0, subtasks_done=0))
+    ids = list(db.execute(select(tasks.c.id).where(tasks.c.parent_id.isnot(None))).scalars())
+    for start in range(0, len(ids), 1000):
+        adjust_rollup(db, ids[start:start + 1000], 1)
+    return len(ids)
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Rebuilt rollups for {rebuild_rollups(session)} subtasks")
+        session.commit()
+    finally:
+        session.close()
@@ -0,0 +1,115 @@
+import hashlib
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+# アバター画像の設定
+AVATAR_SIZES = (32, 64, 200)
+DEFAULT_AVATAR_SIZE = 200
+AVATAR_FORMATS = {"jpg": "JPEG", "webp": "WEBP"}
+ALLOWED_IMAGE_FORMATS = {"JPEG", "PNG", "GIF", "WEBP"}
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024
+MAX_IMAGE_PIXELS = 25_000_000
+MAX_IMAGE_SIDE = 8000
+AVATAR_WORKERS = int(os.getenv("AVATAR_WORKERS", "1"))
+
+# {ハッシュ}_{サイズ}.{拡張子} 形式のファイル名
+AVATAR_NAME_PATTERN = re.compile(r"^([0-9a-f]{32})_(\d+)\.(jpg|webp)$")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class ImageRejected(Exception):
+    """画像が受け付けられない場合の例外"""
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """画像処理用のプロセスプールを取得(初回呼び出し時に起動)"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=AVATAR_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    """プロセスプールを停止"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def content_hash(data: bytes) -> str:
+    """画像データのハッシュ値を計算"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def variant_filename(digest: str, size: int = DEFAULT_AVATAR_SIZE, ext: str = "jpg") -> str:
+    """バリアントのファイル名を生成"""
+    return f"{digest}_{size}.{ext}"
+
+
+def all_variant_filenames(digest: str) -> List[str]:
+    """ハッシュ値に対応する全バリアントのファイル名を取得"""
+    return [variant_filename(digest, size, ext) for size in AVATAR_SIZES for ext in AVATAR_FORMATS]
+
+
+def variant_filenames(avatar: str) -> List[str]:
+    """アバターに紐づく全バリアントのファイル名を取得"""
+    match = AVATAR_NAME_PATTERN.match(avatar)
+    if match is None:
+        # 旧形式(UUIDファイル名)は単一ファイル
+        return [avatar]
+    return all_variant_filenames(match.group(1))
+
+
+def _encode(img, image_format: str) -> bytes:
+    """画像をエンコードしてバイト列を返す"""
+    buffer = io.BytesIO()
+    if image_format == "WEBP":
+        img.save(buffer, image_format, quality=80, method=4)
+    else:
+        img.save(buffer, image_format, quality=85, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def process_avatar(data: bytes) -> Dict[str, bytes]:
+    """アバター画像を検証・縮小し、全サイズのバリアントを生成(プロセスプール上で実行)
+
+    戻り値は {ファイル名: 画像データ}。
+    """
+    from PIL import Image
+
+    digest = content_hash(data)
+    try:
+        img = Image.open(io.BytesIO(data))
+    except Exception:
+        raise ImageRejected("画像の処理に失敗しました")
+
+    # ヘッダーの情報だけで判定(デコード前)
+    if img.format not in ALLOWED_IMAGE_FORMATS:
+        raise ImageRejected("画像ファイル(JPEG, PNG, GIF, WEBP)のみアップロード可能です")
+    width, height = img.size
+    if width * height > MAX_IMAGE_PIXELS or max(width, height) > MAX_IMAGE_SIDE:
+        raise ImageRejected("画像の解像度が大きすぎます")
+
+    variants = {}
+    try:
+        largest = max(AVATAR_SIZES)
+        if img.format == "JPEG":
+            # JPEGは縮小デコードで必要な解像度だけ展開する
+            img.draft("RGB", (largest, largest))
+        img = img.convert("RGB")
+        img.thumbnail((largest, largest), Image.Resampling.LANCZOS)
+
+        for size in sorted(AVATAR_SIZES, reverse=True):
+            variant = img if size == largest else img.copy()
+            variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for ext, image_format in AVATAR_FORMATS.items():
+                variants[variant_filename(digest, size, ext)] = _encode(variant, image_format)
+    except Exception:
+        raise ImageRejected("画像の処理に失敗しました")
+
+    return variants
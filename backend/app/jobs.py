@@ -0,0 +1,239 @@
+"""DBを使ったジョブキュー
+
+ジョブは「手順」のリストとして実行する。各手順は1バッチ分を処理して件数を返す関数で、
+0を返したら次の手順へ進む。バッチごとに進捗とリースを同じトランザクションで記録するので、
+プロセスが落ちてもリースが切れたら別のワーカーが途中の手順から再開する。
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, select, update
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics, models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "500"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2.0"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# 停止時に実行中のバッチの完了を待つ秒数
+JOB_SHUTDOWN_TIMEOUT = float(os.getenv("JOB_SHUTDOWN_TIMEOUT", "10"))
+
+# 手順: (名前, 関数(db, params, batch_size) -> 処理件数)
+Step = Tuple[str, Callable[..., int]]
+
+# ジョブの種類 -> 手順のリスト
+HANDLERS: Dict[str, List[Step]] = {}
+
+Job = models.Job
+
+
+def register(kind: str, steps: List[Step]):
+    """ジョブの種類と手順を登録"""
+    HANDLERS[kind] = steps
+
+
+def enqueue(db, kind: str, **params) -> models.Job:
+    """ジョブを追加(コミットは呼び出し側で行う)"""
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind: {kind}")
+    job = Job(kind=kind, params=json.dumps(params), progress="{}", available_at=time.time())
+    db.add(job)
+    db.flush()
+    return job
+
+
+def job_status(job: models.Job) -> dict:
+    """APIで返すジョブの状態"""
+    steps = HANDLERS.get(job.kind, [])
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "step": steps[job.step][0] if job.step < len(steps) else None,
+        "steps_done": job.step,
+        "steps_total": len(steps),
+        "progress": json.loads(job.progress or "{}"),
+        "attempts": job.attempts,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def _claim(db, worker_id: str) -> Optional[int]:
+    """待機中か、リースが切れた実行中のジョブを1件取得"""
+    now = time.time()
+    job = db.execute(
+        select(Job)
+        .where(or_(
+            (Job.status == "queued") & (Job.available_at <= now),
+            (Job.status == "running") & (Job.locked_until < now),
+        ))
+        .order_by(Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalars().first()
+    if job is None:
+        db.rollback()
+        return None
+    job.status = "running"
+    job.locked_by = worker_id
+    job.locked_until = now + JOB_LEASE_SECONDS
+    job.attempts += 1
+    db.commit()
+    return job.id
+
+
+def _run_batch(db, job_id: int, worker_id: str, batch_size: int) -> bool:
+    """1バッチ分を実行し、ジョブが終わったらTrueを返す"""
+    job = db.get(Job, job_id, with_for_update=True)
+    if job is None or job.locked_by != worker_id or job.status != "running":
+        # 他のワーカーに引き継がれた
+        db.rollback()
+        return True
+    steps = HANDLERS[job.kind]
+    params = json.loads(job.params)
+    progress = json.loads(job.progress or "{}")
+
+    if job.step < len(steps):
+        name, step = steps[job.step]
+        processed = step(db, params, batch_size)
+        progress[name] = progress.get(name, 0) + processed
+        if processed == 0:
+            job.step += 1
+        metrics.JOB_ROWS.inc(job.kind, amount=processed)
+
+    finished = job.step >= len(steps)
+    job.progress = json.dumps(progress)
+    job.locked_until = time.time() + JOB_LEASE_SECONDS
+    if finished:
+        job.status = "done"
+        job.locked_by = None
+        job.finished_at = datetime.utcnow()
+    db.commit()
+    return finished
+
+
+def _fail(db, job_id: int, error: str):
+    db.rollback()
+    job = db.get(Job, job_id)
+    if job is None:
+        return
+    job.error = error[:1000]
+    job.locked_by = None
+    if job.attempts >= JOB_MAX_ATTEMPTS:
+        job.status = "failed"
+        job.finished_at = datetime.utcnow()
+    else:
+        job.status = "queued"
+        job.available_at = time.time() + min(60, 2 ** job.attempts)
+    db.commit()
+
+
+def _release(db, worker_id: str):
+    """停止時に実行中のジョブを待機中に戻す(すぐに他のワーカーが再開できるように)"""
+    db.execute(
+        update(Job)
+        .where(Job.status == "running", Job.locked_by == worker_id)
+        .values(status="queued", locked_by=None, locked_until=None)
+    )
+    db.commit()
+
+
+class JobQueue:
+    """ジョブを取り出して実行するワーカーコルーチン群"""
+
+    def __init__(self, workers: int = JOB_WORKERS, batch_size: int = JOB_BATCH_SIZE,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def wake(self):
+        """ジョブを追加したことを知らせる(どのスレッドからでも呼べる)"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _execute(self, job_id: int, worker_id: str):
+        db = SessionLocal()
+        start = time.perf_counter()
+        try:
+            while not await run_in_threadpool(_run_batch, db, job_id, worker_id, self.batch_size):
+                if self._stopping:
+                    # 残りは停止時に待機中へ戻し、次に起動したワーカーが続きから実行する
+                    return
+                # バッチの間で他のリクエストに譲る
+                await asyncio.sleep(0)
+            metrics.JOB_RUNS.inc("job", "ok")
+        except Exception as exc:
+            logger.exception("ジョブ %s が失敗しました", job_id)
+            metrics.JOB_RUNS.inc("job", "error")
+            await run_in_threadpool(_fail, db, job_id, repr(exc))
+        finally:
+            metrics.JOB_DURATION.observe("job", value=time.perf_counter() - start)
+            db.close()
+
+    async def _worker(self, worker_id: str):
+        while not self._stopping:
+            db = SessionLocal()
+            try:
+                job_id = await run_in_threadpool(_claim, db, worker_id)
+            except Exception:
+                logger.exception("ジョブの取得に失敗しました")
+                job_id = None
+            finally:
+                db.close()
+            if job_id is not None:
+                await self._execute(job_id, worker_id)
+                continue
+            if self._stopping:
+                break
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        for n in range(self.workers):
+            worker_id = f"{self.prefix}:{n}"
+            self._tasks.append(asyncio.create_task(self._worker(worker_id), name=f"job-worker:{n}"))
+
+    async def stop(self):
+        # 実行中のバッチは最後までコミットさせてから止める
+        self._stopping = True
+        if self._tasks:
+            self._wakeup.set()
+            _, pending = await asyncio.wait(self._tasks, timeout=JOB_SHUTDOWN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        db = SessionLocal()
+        try:
+            for n in range(self.workers):
+                _release(db, f"{self.prefix}:{n}")
+        finally:
+            db.close()
+        self._loop = None
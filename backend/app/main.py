@@ -1,29 +1,102 @@
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile
+from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Request, Query, Header
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import FileResponse, Response, PlainTextResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, joinedload
 from datetime import timedelta, datetime, date
-from typing import List
-from sqlalchemy import or_
-from PIL import Image
+from typing import List, Optional, Union
+from contextlib import asynccontextmanager
+from sqlalchemy import func, or_, select, text
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+import asyncio
 import socketio
+import mimetypes
+import json
 import os
-import uuid
 
-from . import models, schemas, crud, auth
-from .database import engine, get_db
+from . import models, schemas, crud, auth, images, storage, fastjson, compression, metrics, querylog, ratelimit, cache, stats, scheduler, archive, outbox, replay, jobs, cascades, ranking, activity, notify, attachments, hierarchy, batch, profiling, statements
+from .ratelimit import rate_limit
+from .database import engine, get_db, SessionLocal, ENGINES, is_lock_error
 
-# データベーステーブルを作成（元のコードに戻す）
-models.Base.metadata.create_all(bind=engine)
+# テーブル作成は起動時ではなく `python -m app.migrate` で行う(コールドスタート短縮のため)
+
+# SQLの発行回数・実行時間を計測(SQLiteでは読み込み用と書き込み用の両方)
+for db_engine in ENGINES:
+    metrics.instrument_engine(db_engine)
+
+# ユーザー・プロジェクトの書き込みで一覧キャッシュを無効化
+cache.install(SessionLocal)
+
+# 開発・ステージングではN+1と遅いSQLを検出
+if querylog.QUERY_DEBUG_ENABLED:
+    for db_engine in ENGINES:
+        querylog.instrument_engine(db_engine)
 
 # Socket.IO サーバーを作成（明示的なCORS設定）
 sio = socketio.AsyncServer(
     async_mode='asgi',
-    cors_allowed_origins=["https://asana-frontend.onrender.com"]
+    cors_allowed_origins=["https://asana-frontend.onrender.com"],
+    # ポーリング時のペイロードもJSONと同じ閾値で圧縮
+    http_compression=True,
+    compression_threshold=compression.COMPRESSION_MINIMUM_SIZE
 )
 
-app = FastAPI(title="Asana Clone API")
+# 期限切れフラグと集計を定期的に更新
+scheduler.register("refresh_overdue", stats.OVERDUE_REFRESH_INTERVAL, stats.refresh_overdue_job, initial_delay=5)
+# 完了タスクと既読の古い通知をアーカイブへ移す
+scheduler.register("archive", archive.ARCHIVE_INTERVAL, archive.run_archival, initial_delay=60)
+# ランクが長くなりすぎたボードの列を振り直す
+scheduler.register("rebalance_ranks", ranking.RANK_REBALANCE_INTERVAL, ranking.rebalance_dense_columns, initial_delay=30)
+# 古い変更履歴をまとめる
+scheduler.register("compact_activity", activity.ACTIVITY_COMPACT_INTERVAL, activity.run_compaction, initial_delay=90)
+# 期限切れのアップロードと参照されなくなった添付ファイルを削除
+scheduler.register("attachments_gc", attachments.ATTACHMENT_GC_INTERVAL, attachments.collect_garbage, initial_delay=150)
+# 未読がたまったユーザーに通知のダイジェストを作る(NOTIFICATION_DIGEST_INTERVAL を設定したときだけ)
+if notify.NOTIFICATION_DIGEST_INTERVAL > 0:
+    scheduler.register("notification_digest", notify.NOTIFICATION_DIGEST_INTERVAL, notify.run_digest_job,
+                       initial_delay=120)
+
+# 送信したイベントを連番付きで保持し、再接続したクライアントに送り直す
+replay_hub = replay.ReplayHub(sio)
+
+# 変更と同じトランザクションで書いたイベントを送信するディスパッチャー
+dispatcher = outbox.OutboxDispatcher(emit=replay_hub.emit)
+outbox.install(SessionLocal, dispatcher)
+
+# 一括削除などの重い処理を実行するワーカー
+job_queue = jobs.JobQueue()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    dispatcher.start()
+    job_queue.start()
+    scheduler.start_all()
+    yield
+    await scheduler.stop_all()
+    await job_queue.stop()
+    await dispatcher.stop()
+    # 画像処理プロセスプールを停止
+    images.shutdown_pool()
+
+app = FastAPI(title="Asana Clone API", lifespan=lifespan)
+
+async def database_busy_handler(request: Request, exc: Exception):
+    """SQLiteの書き込みを待ちきれなかった場合は、500ではなく再試行を促す503にする"""
+    if not is_lock_error(exc):
+        raise exc
+    metrics.DB_LOCK_ERRORS.inc()
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "データベースが混み合っています。しばらくしてから再試行してください"},
+        headers={"Retry-After": "1"},
+    )
+
+app.add_exception_handler(OperationalError, database_busy_handler)
+app.add_exception_handler(PoolTimeoutError, database_busy_handler)
+
+# 同時実行数の制限(503にもCORSヘッダーが付くよう最も内側に追加)
+app.add_middleware(ratelimit.AdmissionControlMiddleware)
 
 # CORS設定(フロントエンドからのアクセスを許可)
 app.add_middleware(
@@ -34,9 +107,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 一定サイズ以上のJSONレスポンスをgzip/brotliで圧縮
+app.add_middleware(compression.CompressionMiddleware, minimum_size=compression.COMPRESSION_MINIMUM_SIZE)
+
+# ルートごとのレイテンシ・SQL統計を記録
+app.add_middleware(metrics.MetricsMiddleware)
+
+if querylog.QUERY_DEBUG_ENABLED:
+    app.add_middleware(querylog.QueryDebugMiddleware)
+
+# 管理者が指定したリクエストをプロファイリング(無効なら何も登録しない)
+if profiling.PROFILING_ENABLED:
+    for db_engine in ENGINES:
+        profiling.instrument_engine(db_engine)
+    app.add_middleware(profiling.ProfilingMiddleware)
+
 # 画像保存ディレクトリ
 UPLOAD_DIR = "uploads/avatars"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+avatar_storage = storage.create_storage(UPLOAD_DIR)
+
+# 小さなサムネイルはメモリから配信(合計4MBまで)
+avatar_cache = storage.BytesLRU(max_bytes=4 * 1024 * 1024, max_item_bytes=16 * 1024)
+AVATAR_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 # Socket.IOをASGIミドルウェアとして統合
 from socketio import ASGIApp
@@ -45,33 +137,21 @@ socket_app = ASGIApp(sio, other_asgi_app=app)
 # WebSocket イベントハンドラ
 @sio.event
 async def connect(sid, environ):
+    metrics.SOCKETIO_CLIENTS.inc()
     print(f"Client connected: {sid}")
+    # 次に切断されたときのために現在の連番を伝える
+    await sio.emit('replay_position', replay_hub.position(), to=sid)
 
 @sio.event
 async def disconnect(sid):
+    metrics.SOCKETIO_CLIENTS.dec()
     print(f"Client disconnected: {sid}")
 
-# リアルタイム通知関数
-async def broadcast_task_update(event_type: str, task_data: dict):
-    """タスクの変更を全クライアントに通知"""
-    await sio.emit('task_update', {
-        'type': event_type,
-        'data': task_data
-    })
-
-async def broadcast_project_update(event_type: str, project_data: dict):
-    """プロジェクトの変更を全クライアントに通知"""
-    await sio.emit('project_update', {
-        'type': event_type,
-        'data': project_data
-    })
-
-async def broadcast_comment_update(event_type: str, comment_data: dict):
-    """コメントの変更を全クライアントに通知"""
-    await sio.emit('comment_update', {
-        'type': event_type,
-        'data': comment_data
-    })
+@sio.event
+async def resume(sid, data):
+    """再接続時に最後に受け取った連番を受け取り、取りこぼした分を送り直す"""
+    data = data or {}
+    return await replay_hub.resume(sid, data.get('epoch'), data.get('last_seq'), data.get('room'))
 
 # ルートエンドポイント
 @app.get("/")
@@ -79,7 +159,7 @@ def read_root():
     return {"message": "Asana Clone API"}
 
 # 認証エンドポイント
-@app.post("/api/register", response_model=schemas.User)
+@app.post("/api/register", response_model=schemas.User, dependencies=[Depends(rate_limit("register"))])
 def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """新規ユーザー登録"""
     db_user = crud.get_user_by_email(db, email=user.email)
@@ -87,7 +167,7 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="このメールアドレスは既に登録されています")
     return crud.create_user(db=db, user=user)
 
-@app.post("/api/token", response_model=schemas.Token)
+@app.post("/api/token", response_model=schemas.Token, dependencies=[Depends(rate_limit("login"))])
 def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """ログイン"""
     user = auth.authenticate_user(db, form_data.username, form_data.password)
@@ -115,34 +195,54 @@ def read_users(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """ユーザー一覧を取得"""
-    users = db.query(models.User).offset(skip).limit(limit).all()
-    return users
+    """ユーザー一覧を取得(キャッシュ付き)"""
+    def load() -> bytes:
+        rows = db.query(*fastjson.USER_COLUMNS).offset(skip).limit(limit).all()
+        return fastjson.list_response(rows, fastjson.UserListAdapter).body
+    
+    body = cache.CACHES["users"].get_or_load(db, (skip, limit), load)
+    return Response(content=body, media_type="application/json")
 
-@app.delete("/api/users/reset")
+def enqueue_job(db: Session, kind: str, **params) -> dict:
+    """ジョブを登録して状態を返す(同じ内容の未完了ジョブがあればそれを返す)"""
+    existing = db.query(models.Job).filter(
+        models.Job.kind == kind,
+        models.Job.params == json.dumps(params),
+        models.Job.status.in_(("queued", "running"))
+    ).first()
+    if existing is not None:
+        return jobs.job_status(existing)
+    job = jobs.enqueue(db, kind, **params)
+    db.commit()
+    db.refresh(job)
+    job_queue.wake()
+    return jobs.job_status(job)
+
+def reset_all_users(db: Session) -> dict:
+    """現時点の全ユーザーを削除するジョブを登録"""
+    max_user_id = db.query(func.max(models.User.id)).scalar() or 0
+    return enqueue_job(db, "reset_users", max_user_id=max_user_id)
+
+@app.delete("/api/users/reset", status_code=202, response_model=schemas.Job)
 def reset_users(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """ユーザーデータのみをリセット(プロジェクトとタスクは保持)"""
-    db.query(models.User).delete()
-    db.commit()
-    return {"message": "ユーザーデータをリセットしました。プロジェクトとタスクは保持されています。"}
+    """ユーザーデータのみをリセット(プロジェクトとタスクは保持、バックグラウンドで実行)"""
+    return reset_all_users(db)
 
-@app.delete("/api/users/{user_id}")
+@app.delete("/api/users/{user_id}", status_code=202, response_model=schemas.Job)
 def delete_user(
     user_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """特定のユーザーを削除"""
+    """特定のユーザーを削除(関連データの整理はバックグラウンドで実行)"""
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if user is None:
         raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
     
-    db.delete(user)
-    db.commit()
-    return {"message": f"ユーザー {user.name} を削除しました"}
+    return enqueue_job(db, "delete_user", user_id=user_id)
 
 # プロジェクトエンドポイント
 @app.get("/api/projects", response_model=List[schemas.Project])
@@ -152,27 +252,22 @@ def read_projects(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """プロジェクト一覧を取得(全ユーザーで共有)"""
-    projects = db.query(models.Project).offset(skip).limit(limit).all()
-    return projects
+    """プロジェクト一覧を取得(全ユーザーで共有、キャッシュ付き)"""
+    def load() -> bytes:
+        rows = db.query(*fastjson.PROJECT_COLUMNS).offset(skip).limit(limit).all()
+        return fastjson.list_response(rows, fastjson.ProjectListAdapter).body
+    
+    body = cache.CACHES["projects"].get_or_load(db, (skip, limit), load)
+    return Response(content=body, media_type="application/json")
 
 @app.post("/api/projects", response_model=schemas.Project)
-async def create_project(
+def create_project(
     project: schemas.ProjectCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """新規プロジェクトを作成"""
     db_project = crud.create_project(db=db, project=project, user_id=current_user.id)
-    
-    await broadcast_project_update('project_created', {
-        'id': db_project.id,
-        'title': db_project.title,
-        'description': db_project.description,
-        'color': db_project.color,
-        'owner_id': db_project.owner_id
-    })
-    
     return db_project
 
 @app.get("/api/projects/{project_id}", response_model=schemas.Project)
@@ -188,7 +283,7 @@ def read_project(
     return db_project
 
 @app.put("/api/projects/{project_id}", response_model=schemas.Project)
-async def update_project(
+def update_project(
     project_id: int,
     project: schemas.ProjectCreate,
     db: Session = Depends(get_db),
@@ -205,27 +300,20 @@ async def update_project(
     db_project.title = project.title
     db_project.description = project.description
     db_project.color = project.color
+    outbox.enqueue_emit(db, 'project_update', 'project_updated', outbox.project_payload(db_project),
+                        f"project:{project_id}")
     
     db.commit()
     db.refresh(db_project)
-    
-    await broadcast_project_update('project_updated', {
-        'id': db_project.id,
-        'title': db_project.title,
-        'description': db_project.description,
-        'color': db_project.color,
-        'owner_id': db_project.owner_id
-    })
-    
     return db_project
 
-@app.delete("/api/projects/{project_id}")
-async def delete_project(
+@app.delete("/api/projects/{project_id}", status_code=202, response_model=schemas.Job)
+def delete_project(
     project_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """プロジェクトを削除"""
+    """プロジェクトを削除(タスク・コメント・通知ごとバックグラウンドで削除)"""
     db_project = crud.get_project(db, project_id=project_id)
     if db_project is None:
         raise HTTPException(status_code=404, detail="プロジェクトが見つかりません")
@@ -233,139 +321,378 @@ async def delete_project(
     if db_project.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="このプロジェクトを削除する権限がありません")
     
-    db.query(models.Task).filter(models.Task.project_id == project_id).delete()
-    db.delete(db_project)
-    db.commit()
-    
-    await broadcast_project_update('project_deleted', {'id': project_id})
-    
-    return {"message": "プロジェクトを削除しました"}
+    return enqueue_job(db, "delete_project", project_id=project_id)
 
 @app.get("/api/projects/{project_id}/tasks", response_model=List[schemas.Task])
 def read_project_tasks(
     project_id: int,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """プロジェクトのタスク一覧を取得"""
+    """プロジェクトのタスク一覧を取得(fieldsで返す項目を絞り込み可能)"""
+    if fields or fastjson.FAST_JSON_ENABLED:
+        columns = fastjson.select_columns(fields, fastjson.TASK_COLUMNS)
+        rows = crud.get_project_task_rows(db, project_id=project_id, columns=columns)
+        return fastjson.list_response(rows, fastjson.TaskListAdapter, partial=bool(fields))
     tasks = crud.get_project_tasks(db, project_id=project_id)
     return tasks
 
+def hierarchy_columns(fields: Optional[str]) -> List[str]:
+    """階層で返す列(親子を組み立てられるよう id と parent_id は必ず含める)"""
+    columns = fastjson.select_columns(fields, fastjson.TASK_COLUMNS)
+    return list(dict.fromkeys(["id", "parent_id", *(column.key for column in columns)]))
+
+def hierarchy_response(db: Session, rows, task_ids, fields: Optional[str]) -> Response:
+    """階層の行と、その中のタスクの依存関係をまとめて返す"""
+    return fastjson.object_response({
+        "tasks": fastjson.rows_to_dicts(rows),
+        "dependencies": hierarchy.get_dependencies(db, task_ids),
+    }, fastjson.TaskHierarchyAdapter, partial=bool(fields))
+
+@app.get("/api/projects/{project_id}/hierarchy", response_model=schemas.TaskHierarchy)
+def read_project_hierarchy(
+    project_id: int,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """プロジェクトの全タスクを親子の順に、依存関係と一緒に取得(階層の深さによらずクエリ2回)"""
+    rows = hierarchy.load_project(db, project_id, hierarchy_columns(fields))
+    project_task_ids = select(models.Task.id).where(models.Task.project_id == project_id)
+    return hierarchy_response(db, rows, project_task_ids, fields)
+
+# 一括実行エンドポイント
+@app.post("/api/batch", response_model=schemas.BatchResponse)
+async def run_batch(
+    batch_request: schemas.BatchRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """複数のAPI呼び出しを1回のリクエストで実行(認証は一度だけ。結果は呼び出しごとの status と body)"""
+    error = batch.validate(batch_request.requests)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    return {"responses": await batch.run(request, batch_request.requests, current_user, db)}
+
 # タスクエンドポイント
-@app.get("/api/tasks/search", response_model=List[schemas.Task])
+@app.get("/api/tasks/search", response_model=List[schemas.Task], dependencies=[Depends(rate_limit("search"))])
 def search_tasks(
     q: str,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """タスクを検索"""
-    tasks = db.query(models.Task).filter(
+    fast = bool(fields) or fastjson.FAST_JSON_ENABLED
+    columns = fastjson.select_columns(fields, fastjson.TASK_COLUMNS) if fast else (models.Task,)
+    rows = db.query(*columns).filter(
         or_(
             models.Task.title.contains(q),
             models.Task.description.contains(q)
         )
     ).all()
-    return tasks
+    if fast:
+        return fastjson.list_response(rows, fastjson.TaskListAdapter, partial=bool(fields))
+    return rows
+
+# カレンダーで一度に取得できる最大日数
+CALENDAR_MAX_DAYS = 366
+
+@app.get("/api/tasks/calendar", response_model=Union[List[schemas.Task], List[schemas.CalendarDay]])
+def read_calendar_tasks(
+    date_from: date = Query(..., alias="from"),
+    date_to: date = Query(..., alias="to"),
+    project_id: Optional[int] = None,
+    assignee_id: Optional[int] = None,
+    my_tasks: bool = False,
+    aggregate: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """期間内に期限があるタスクを取得(aggregate=dayで日ごとのステータス別件数)"""
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="終了日は開始日以降を指定してください")
+    if (date_to - date_from).days >= CALENDAR_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"期間は{CALENDAR_MAX_DAYS}日以内で指定してください")
+    if my_tasks:
+        assignee_id = current_user.id
+    
+    if aggregate == "day":
+        days = {}
+        for due_date, task_status, count in crud.get_calendar_day_counts(
+            db, date_from.isoformat(), date_to.isoformat(), project_id=project_id, assignee_id=assignee_id
+        ):
+            day = days.setdefault(due_date, schemas.CalendarDay(date=due_date, total=0, counts={}))
+            day.total += count
+            day.counts[task_status] = count
+        return list(days.values())
+    if aggregate is not None:
+        raise HTTPException(status_code=400, detail="aggregateには day のみ指定できます")
+    
+    columns = fastjson.select_columns(fields, fastjson.TASK_COLUMNS)
+    rows = crud.get_calendar_task_rows(
+        db, columns, date_from.isoformat(), date_to.isoformat(), project_id=project_id, assignee_id=assignee_id
+    )
+    return fastjson.list_response(rows, fastjson.TaskListAdapter, partial=bool(fields))
 
 @app.get("/api/tasks", response_model=List[schemas.Task])
 def read_tasks(
     skip: int = 0,
     limit: int = 100,
     my_tasks: bool = False,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """タスク一覧を取得"""
-    if my_tasks:
-        tasks = db.query(models.Task).filter(
-            models.Task.assignee_id == current_user.id
-        ).offset(skip).limit(limit).all()
-    else:
-        tasks = crud.get_tasks(db, skip=skip, limit=limit)
+    """タスク一覧を取得(fieldsで返す項目を絞り込み可能)"""
+    user_id = current_user.id if my_tasks else None
+    if fields or fastjson.FAST_JSON_ENABLED:
+        columns = fastjson.select_columns(fields, fastjson.TASK_COLUMNS)
+        rows = crud.get_task_rows(db, columns, user_id=user_id, skip=skip, limit=limit)
+        return fastjson.list_response(rows, fastjson.TaskListAdapter, partial=bool(fields))
+    tasks = crud.get_tasks(db, user_id=user_id, skip=skip, limit=limit)
     return tasks
 
 @app.post("/api/tasks", response_model=schemas.Task)
-async def create_task(
+def create_task(
     task: schemas.TaskCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """タスクを作成"""
-    db_task = crud.create_task(db=db, task=task, user_id=current_user.id)
-    
-    await broadcast_task_update('task_created', {
-        'id': db_task.id,
-        'title': db_task.title,
-        'description': db_task.description,
-        'status': db_task.status,
-        'priority': db_task.priority,
-        'due_date': db_task.due_date,
-        'start_time': db_task.start_time,
-        'end_time': db_task.end_time,
-        'assignee_id': db_task.assignee_id,
-        'project_id': db_task.project_id,
-        'created_at': db_task.created_at.isoformat() if db_task.created_at else None
-    })
-    
+    try:
+        db_task = crud.create_task(db=db, task=task, user_id=current_user.id)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
     return db_task
 
 @app.put("/api/tasks/{task_id}", response_model=schemas.Task)
-async def update_task(
+def update_task(
     task_id: int,
     task: schemas.TaskUpdate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """タスクを更新"""
-    db_task = db.query(models.Task).filter(models.Task.id == task_id).first()
-    if db_task is None:
+    try:
+        updated_task = crud.update_task(db, task_id=task_id, task=task, actor=current_user)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if updated_task is None:
         raise HTTPException(status_code=404, detail="タスクが見つかりません")
-    
-    old_assignee_id = db_task.assignee_id
-    updated_task = crud.update_task(db, task_id=task_id, task=task)
-    new_assignee_id = updated_task.assignee_id
-    
-    if new_assignee_id and new_assignee_id != old_assignee_id and new_assignee_id != current_user.id:
-        notification = models.Notification(
-            user_id=new_assignee_id,
-            task_id=task_id,
-            type='assigned',
-            message=f'{current_user.name}さんがあなたに「{updated_task.title}」を割り当てました'
-        )
-        db.add(notification)
-        db.commit()
-    
-    await broadcast_task_update('task_updated', {
-        'id': updated_task.id,
-        'title': updated_task.title,
-        'description': updated_task.description,
-        'status': updated_task.status,
-        'priority': updated_task.priority,
-        'due_date': updated_task.due_date,
-        'start_time': updated_task.start_time,
-        'end_time': updated_task.end_time,
-        'assignee_id': updated_task.assignee_id,
-        'project_id': updated_task.project_id,
-        'created_at': updated_task.created_at.isoformat() if updated_task.created_at else None
-    })
-    
     return updated_task
 
+@app.post("/api/tasks/{task_id}/move", response_model=schemas.Task)
+def move_task(
+    task_id: int,
+    move: schemas.TaskMove,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """ボード上でタスクを移動(after_id の直後・before_id の直前へ)"""
+    try:
+        moved_task = crud.move_task(db, task_id=task_id, move=move, actor=current_user)
+    except ValueError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    if moved_task is None:
+        raise HTTPException(status_code=404, detail="タスクが見つかりません")
+    return moved_task
+
 @app.delete("/api/tasks/{task_id}")
-async def delete_task(
+def delete_task(
     task_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """タスクを削除"""
-    db_task = crud.delete_task(db, task_id=task_id)
+    db_task = crud.delete_task(db, task_id=task_id, actor=current_user)
     if db_task is None:
         raise HTTPException(status_code=404, detail="タスクが見つかりません")
-    
-    await broadcast_task_update('task_deleted', {'id': task_id})
-    
     return {"message": "タスクを削除しました"}
 
+@app.get("/api/tasks/{task_id}/subtree", response_model=schemas.TaskHierarchy)
+def read_task_subtree(
+    task_id: int,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """タスクとその全ての子孫を、依存関係と一緒に取得"""
+    rows = hierarchy.load_subtree(db, task_id, hierarchy_columns(fields))
+    if not rows:
+        raise HTTPException(status_code=404, detail="タスクが見つかりません")
+    return hierarchy_response(db, rows, [row.id for row in rows], fields)
+
+@app.post("/api/tasks/{task_id}/dependencies", response_model=schemas.TaskDependency)
+def add_task_dependency(
+    task_id: int,
+    dependency: schemas.TaskDependencyCreate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """task_id が depends_on_id の完了を待つ依存を追加(循環する場合は409)"""
+    try:
+        created = crud.add_dependency(db, task_id, dependency.depends_on_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    if created is None:
+        raise HTTPException(status_code=404, detail="タスクが見つかりません")
+    return {"task_id": task_id, "depends_on_id": dependency.depends_on_id}
+
+@app.delete("/api/tasks/{task_id}/dependencies/{depends_on_id}")
+def remove_task_dependency(
+    task_id: int,
+    depends_on_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """依存を削除"""
+    if not crud.remove_dependency(db, task_id, depends_on_id):
+        raise HTTPException(status_code=404, detail="依存関係が見つかりません")
+    return {"message": "依存関係を削除しました"}
+
+@app.get("/api/tasks/{task_id}/activity", response_model=schemas.TaskTimeline)
+def read_task_activity(
+    task_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """タスクの変更履歴を新しい順に取得(cursorに前のページのnext_cursorを指定)"""
+    try:
+        return activity.get_timeline(db, task_id, cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursorが不正です")
+
+# 添付ファイルAPI
+@app.get("/api/tasks/{task_id}/attachments", response_model=List[schemas.Attachment])
+def read_task_attachments(
+    task_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """タスクの添付ファイル一覧を取得"""
+    return attachments.get_task_attachments(db, task_id)
+
+@app.post("/api/tasks/{task_id}/attachments/uploads", response_model=schemas.AttachmentUploadStatus,
+          dependencies=[Depends(rate_limit("upload_attachment"))])
+def start_attachment_upload(
+    task_id: int,
+    upload: schemas.AttachmentUploadCreate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """添付ファイルのアップロードを開始(以前に自分が同じ内容を送っていれば即座に添付)"""
+    task = db.query(models.Task).filter(models.Task.id == task_id).first()
+    if task is None:
+        raise HTTPException(status_code=404, detail="タスクが見つかりません")
+    try:
+        return attachments.start_upload(db, task, current_user.id, upload.filename, upload.content_type,
+                                        upload.size, upload.sha256)
+    except attachments.UploadTooLarge:
+        raise HTTPException(status_code=413, detail="ファイルサイズが上限を超えています")
+    except attachments.ChecksumMismatch:
+        raise HTTPException(status_code=400, detail="sha256が不正です")
+
+@app.get("/api/attachments/uploads/{upload_id}", response_model=schemas.AttachmentUploadStatus)
+def read_attachment_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """アップロードの受信済みオフセットを取得(再開用)"""
+    upload = attachments.get_upload(db, upload_id, current_user.id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+    return attachments.upload_status(upload)
+
+@app.put("/api/attachments/uploads/{upload_id}", response_model=schemas.AttachmentUploadStatus,
+         dependencies=[Depends(rate_limit("upload_attachment"))])
+async def upload_attachment_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """アップロードの続きを受信(本文はメモリに溜めずにディスクへ書く)"""
+    # 存在しないIDにはロックを作らない
+    upload = await run_in_threadpool(attachments.get_upload, db, upload_id, current_user.id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+    async with attachments.upload_lock(upload.id):
+        # ロックを待つ間に完了・中止されていれば見つからない
+        upload = await run_in_threadpool(attachments.get_upload, db, upload_id, current_user.id)
+        if upload is None:
+            raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+        if upload_offset != upload.received:
+            raise HTTPException(status_code=409, detail="Upload-Offsetが受信済みのサイズと一致しません",
+                                headers={"Upload-Offset": str(upload.received)})
+        try:
+            received, hasher = await attachments.receive(upload.id, upload.received, upload.size, request.stream())
+        except attachments.UploadTooLarge:
+            raise HTTPException(status_code=413, detail="申告したサイズを超えています")
+        try:
+            return await run_in_threadpool(attachments.finish_chunk, db, upload.id, received, hasher)
+        except LookupError:
+            raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+        except attachments.ChecksumMismatch:
+            raise HTTPException(status_code=422, detail="sha256が一致しません")
+
+@app.delete("/api/attachments/uploads/{upload_id}")
+def cancel_attachment_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """アップロードを中止"""
+    upload = attachments.get_upload(db, upload_id, current_user.id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="アップロードが見つかりません")
+    attachments.cancel_upload(db, upload)
+    return {"message": "アップロードを中止しました"}
+
+@app.get("/api/attachments/{attachment_id}")
+def download_attachment(
+    attachment_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """添付ファイルをダウンロード(Rangeで一部だけの取得も可能)"""
+    attachment = db.query(models.Attachment).filter(models.Attachment.id == attachment_id).first()
+    path = attachments.store.blob_path(attachment.sha256) if attachment else None
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="添付ファイルが見つかりません")
+    return FileResponse(
+        path,
+        media_type=attachment.content_type,
+        filename=attachment.filename,
+        content_disposition_type="attachment",
+        headers={
+            # 内容はハッシュで決まるので変わらない(認証が必要なので共有キャッシュには置かせない)
+            "ETag": f'"{attachment.sha256}"',
+            "Cache-Control": "private, max-age=31536000, immutable",
+            "X-Content-Type-Options": "nosniff",
+        },
+    )
+
+@app.delete("/api/attachments/{attachment_id}")
+def delete_attachment(
+    attachment_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """添付ファイルを削除"""
+    attachment = db.query(models.Attachment).filter(models.Attachment.id == attachment_id).first()
+    if attachment is None:
+        raise HTTPException(status_code=404, detail="添付ファイルが見つかりません")
+    attachments.delete_attachment(db, attachment)
+    return {"message": "添付ファイルを削除しました"}
+
 # コメントAPI
 @app.get("/api/tasks/{task_id}/comments", response_model=List[schemas.CommentWithUser])
 def get_task_comments(
@@ -374,20 +701,22 @@ def get_task_comments(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """タスクのコメント一覧を取得"""
-    comments = db.query(models.Comment).filter(
+    comments = db.query(models.Comment).options(
+        joinedload(models.Comment.user)
+    ).filter(
         models.Comment.task_id == task_id
     ).order_by(models.Comment.created_at.desc()).all()
     return comments
 
 @app.post("/api/tasks/{task_id}/comments", response_model=schemas.Comment)
-async def create_comment(
+def create_comment(
     task_id: int,
     comment: schemas.CommentCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """コメントを作成"""
-    task = db.query(models.Task).filter(models.Task.id == task_id).first()
+    task = statements.task_by_id(db, task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="タスクが見つかりません")
     
@@ -397,20 +726,15 @@ async def create_comment(
         user_id=current_user.id
     )
     db.add(db_comment)
+    db.flush()
     
     if task.assignee_id and task.assignee_id != current_user.id:
-        notification = models.Notification(
-            user_id=task.assignee_id,
-            task_id=task_id,
-            type='comment',
-            message=f'{current_user.name}さんが「{task.title}」にコメントしました: {comment.content[:50]}{"..." if len(comment.content) > 50 else ""}'
+        outbox.enqueue_notification(
+            db, task.assignee_id, task_id, 'comment',
+            f'{current_user.name}さんが「{task.title}」にコメントしました: {comment.content[:50]}{"..." if len(comment.content) > 50 else ""}'
         )
-        db.add(notification)
     
-    db.commit()
-    db.refresh(db_comment)
-    
-    await broadcast_comment_update('comment_created', {
+    outbox.enqueue_emit(db, 'comment_update', 'comment_created', {
         'id': db_comment.id,
         'content': db_comment.content,
         'task_id': task_id,
@@ -421,12 +745,14 @@ async def create_comment(
             'email': current_user.email
         },
         'created_at': db_comment.created_at.isoformat() if db_comment.created_at else None
-    })
+    }, f"task:{task_id}")
     
+    db.commit()
+    db.refresh(db_comment)
     return db_comment
 
 @app.delete("/api/tasks/{task_id}/comments/{comment_id}")
-async def delete_comment(
+def delete_comment(
     task_id: int,
     comment_id: int,
     db: Session = Depends(get_db),
@@ -444,13 +770,12 @@ async def delete_comment(
     if comment.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="このコメントを削除する権限がありません")
     
-    db.delete(comment)
-    db.commit()
-    
-    await broadcast_comment_update('comment_deleted', {
+    outbox.enqueue_emit(db, 'comment_update', 'comment_deleted', {
         'id': comment_id,
         'task_id': task_id
-    })
+    }, f"task:{task_id}")
+    db.delete(comment)
+    db.commit()
     
     return {"message": "コメントを削除しました"}
 
@@ -462,15 +787,7 @@ def get_notifications(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """通知一覧を取得"""
-    query = db.query(models.Notification).filter(
-        models.Notification.user_id == current_user.id
-    )
-    
-    if unread_only:
-        query = query.filter(models.Notification.is_read == False)
-    
-    notifications = query.order_by(models.Notification.created_at.desc()).limit(50).all()
-    return notifications
+    return statements.notifications(db, current_user.id, unread_only=unread_only)
 
 @app.get("/api/notifications/unread-count")
 def get_unread_count(
@@ -478,11 +795,7 @@ def get_unread_count(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """未読通知の件数を取得"""
-    count = db.query(models.Notification).filter(
-        models.Notification.user_id == current_user.id,
-        models.Notification.is_read == False
-    ).count()
-    return {"count": count}
+    return {"count": statements.unread_count(db, current_user.id)}
 
 @app.put("/api/notifications/{notification_id}/read")
 def mark_notification_as_read(
@@ -491,10 +804,7 @@ def mark_notification_as_read(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """通知を既読にする"""
-    notification = db.query(models.Notification).filter(
-        models.Notification.id == notification_id,
-        models.Notification.user_id == current_user.id
-    ).first()
+    notification = statements.notification_for_user(db, notification_id, current_user.id)
     
     if notification is None:
         raise HTTPException(status_code=404, detail="通知が見つかりません")
@@ -509,14 +819,11 @@ def mark_all_notifications_as_read(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """すべての通知を既読にする"""
-    db.query(models.Notification).filter(
-        models.Notification.user_id == current_user.id,
-        models.Notification.is_read == False
-    ).update({"is_read": True})
+    statements.mark_all_read(db, current_user.id)
     db.commit()
     return {"message": "すべての通知を既読にしました"}
 
-@app.get("/api/notifications/check-due-dates")
+@app.get("/api/notifications/check-due-dates", dependencies=[Depends(rate_limit("check_due_dates"))])
 def check_due_dates(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
@@ -533,33 +840,112 @@ def check_due_dates(
             models.Task.status != 'done',
             models.Task.assignee_id.isnot(None)
         ).all()
+        if not tasks:
+            continue
         
-        for task in tasks:
-            existing_notification = db.query(models.Notification).filter(
-                models.Notification.task_id == task.id,
+        # 今日すでに通知したタスクは除く(まだ送信前のものは notify.coalesce が1件にまとめる)
+        notified = set(db.execute(
+            select(models.Notification.task_id).where(
+                models.Notification.task_id.in_([task.id for task in tasks]),
                 models.Notification.type == 'due_soon',
                 models.Notification.created_at >= today
-            ).first()
-            
-            if not existing_notification:
-                if days_before == 0:
-                    message = f'「{task.title}」の期限は今日です!'
-                elif days_before == 1:
-                    message = f'「{task.title}」の期限は明日です'
-                else:
-                    message = f'「{task.title}」の期限まであと{days_before}日です'
-                
-                notification = models.Notification(
-                    user_id=task.assignee_id,
-                    task_id=task.id,
-                    type='due_soon',
-                    message=message
-                )
-                db.add(notification)
+            )
+        ).scalars())
+        
+        for task in tasks:
+            if task.id in notified:
+                continue
+            if days_before == 0:
+                message = f'「{task.title}」の期限は今日です!'
+            elif days_before == 1:
+                message = f'「{task.title}」の期限は明日です'
+            else:
+                message = f'「{task.title}」の期限まであと{days_before}日です'
+            outbox.enqueue_notification(db, task.assignee_id, task.id, 'due_soon', message)
     
     db.commit()
     return {"message": "期限通知をチェックしました", "checked_dates": [str(today + timedelta(days=d)) for d in [3, 1, 0]]}
 
+# アーカイブAPI
+@app.get("/api/archive/tasks", response_model=List[schemas.ArchivedTask])
+def read_archived_tasks(
+    project_id: Optional[int] = None,
+    my_tasks: bool = False,
+    skip: int = 0,
+    limit: int = Query(100, le=500),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """アーカイブ済みの完了タスクを取得"""
+    assignee_id = current_user.id if my_tasks else None
+    return archive.get_archived_tasks(db, project_id=project_id, assignee_id=assignee_id, skip=skip, limit=limit)
+
+@app.post("/api/archive/tasks/{task_id}/restore", response_model=schemas.Task)
+def restore_archived_task(
+    task_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """アーカイブ済みのタスクを元に戻す"""
+    db_task = archive.restore_task(db, task_id, user_id=current_user.id)
+    if db_task is None:
+        raise HTTPException(status_code=404, detail="アーカイブ済みのタスクが見つかりません")
+    return db_task
+
+@app.get("/api/archive/notifications", response_model=List[schemas.ArchivedNotification])
+def read_archived_notifications(
+    skip: int = 0,
+    limit: int = Query(50, le=500),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """アーカイブ済みの通知を取得"""
+    return archive.get_archived_notifications(db, current_user.id, skip=skip, limit=limit)
+
+# ジョブAPI
+@app.get("/api/jobs/{job_id}", response_model=schemas.Job)
+def read_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """バックグラウンドジョブの進捗を取得"""
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return jobs.job_status(job)
+
+# ダッシュボード集計API
+@app.get("/api/stats/projects/{project_id}", response_model=schemas.TaskStats)
+def read_project_stats(
+    project_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """プロジェクトのステータス・優先度別件数と期限切れ件数を取得"""
+    if crud.get_project(db, project_id=project_id) is None:
+        raise HTTPException(status_code=404, detail="プロジェクトが見つかりません")
+    return stats.get_summary(db, "project", project_id)
+
+@app.get("/api/stats/me", response_model=schemas.TaskStats)
+def read_my_stats(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """自分が担当するタスクの集計を取得"""
+    return stats.get_summary(db, "user", current_user.id)
+
+@app.get("/api/stats/users/{user_id}", response_model=schemas.TaskStats)
+def read_user_stats(
+    user_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """ユーザーが担当するタスクの集計を取得"""
+    if crud.get_user(db, user_id=user_id) is None:
+        raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
+    return stats.get_summary(db, "user", user_id)
+
 # プロフィールAPI
 @app.get("/api/profile", response_model=schemas.User)
 def get_profile(current_user: models.User = Depends(auth.get_current_user)):
@@ -599,8 +985,46 @@ def health_check():
     """Health check endpoint for keeping the service alive"""
     return {"status": "ok", "time": datetime.now().isoformat()}
 
-@app.post("/api/profile/avatar")
-def upload_avatar(
+@app.get("/health/live")
+async def liveness_check():
+    """プロセスが応答できるか確認(DBには接続しない)"""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def readiness_check():
+    """DB接続プールからSQLを実行できるか確認"""
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "detail": type(e).__name__})
+    return {"status": "ok", "pool": engine.pool.status()}
+
+def require_profile_admin(current_user: models.User = Depends(auth.get_current_user)) -> models.User:
+    if not profiling.is_admin(current_user):
+        raise HTTPException(status_code=403, detail="プロファイルを参照する権限がありません")
+    return current_user
+
+@app.get("/api/admin/profiles")
+def read_profiles(admin: models.User = Depends(require_profile_admin)):
+    """保存してあるプロファイルの一覧(新しい順)"""
+    return profiling.list_reports()
+
+@app.get("/api/admin/profiles/{report_id}")
+def download_profile(report_id: str, admin: models.User = Depends(require_profile_admin)):
+    """プロファイルのレポート(JSON)をダウンロード"""
+    path = profiling.report_path(report_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="プロファイルが見つかりません")
+    return FileResponse(path, media_type="application/json", filename=f"profile-{report_id}.json")
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus形式のメトリクスを取得"""
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/profile/avatar", dependencies=[Depends(rate_limit("upload_avatar"))])
+async def upload_avatar(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
@@ -609,45 +1033,87 @@ def upload_avatar(
     if file.content_type not in ["image/jpeg", "image/png", "image/gif", "image/webp"]:
         raise HTTPException(status_code=400, detail="画像ファイル(JPEG, PNG, GIF, WEBP)のみアップロード可能です")
     
-    contents = file.file.read()
-    if len(contents) > 5 * 1024 * 1024:
+    contents = await file.read(images.MAX_UPLOAD_BYTES + 1)
+    if len(contents) > images.MAX_UPLOAD_BYTES:
         raise HTTPException(status_code=400, detail="ファイルサイズは5MB以下にしてください")
     
-    file_extension = file.filename.split(".")[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    # 同じ内容の画像が保存済みなら変換をスキップ
+    digest = images.content_hash(contents)
+    avatar_filename = images.variant_filename(digest)
+    filenames = images.all_variant_filenames(digest)
+    stored = await run_in_threadpool(lambda: all(avatar_storage.exists(name) for name in filenames))
+    if not stored:
+        # 画像の検証・縮小はプロセスプールで実行(イベントループを塞がない)
+        loop = asyncio.get_running_loop()
+        try:
+            variants = await loop.run_in_executor(images.get_pool(), images.process_avatar, contents)
+        except images.ImageRejected as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        for name, data in variants.items():
+            await run_in_threadpool(avatar_storage.save, name, data)
     
-    with open(file_path, "wb") as buffer:
-        buffer.write(contents)
-    
-    try:
-        img = Image.open(file_path)
-        img = img.convert("RGB")
-        img.thumbnail((200, 200), Image.Resampling.LANCZOS)
-        img.save(file_path, "JPEG", quality=85)
-    except Exception as e:
-        os.remove(file_path)
-        raise HTTPException(status_code=400, detail="画像の処理に失敗しました")
+    # セッションは同期APIなので、更新と古い画像の削除はまとめてスレッドで行う
+    await run_in_threadpool(replace_avatar, db, current_user.id, avatar_filename)
     
-    user = db.query(models.User).filter(models.User.id == current_user.id).first()
-    if user.avatar:
-        old_file_path = os.path.join(UPLOAD_DIR, user.avatar)
-        if os.path.exists(old_file_path):
-            os.remove(old_file_path)
+    return {"avatar": avatar_filename, "message": "プロフィール画像をアップロードしました"}
+
+def replace_avatar(db: Session, user_id: int, avatar: str):
+    """ユーザーのアバターを差し替え、使われなくなった古い画像を削除"""
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    old_avatar = user.avatar
     
-    user.avatar = unique_filename
+    user.avatar = avatar
     db.commit()
-    db.refresh(user)
     
-    return {"avatar": unique_filename, "message": "プロフィール画像をアップロードしました"}
+    if old_avatar and old_avatar != avatar:
+        remove_avatar_files(db, old_avatar)
+
+def remove_avatar_files(db: Session, avatar: str):
+    """他のユーザーが使っていなければアバター画像の全バリアントを削除"""
+    in_use = db.query(models.User).filter(models.User.avatar == avatar).first()
+    if in_use:
+        return
+    for filename in images.variant_filenames(avatar):
+        avatar_cache.discard(filename)
+        avatar_storage.delete(filename)
 
 @app.get("/api/avatars/{filename}")
-def get_avatar(filename: str):
+async def get_avatar(filename: str, request: Request):
     """プロフィール画像を取得"""
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
+    name = storage.safe_filename(filename)
+    if name is None:
         raise HTTPException(status_code=404, detail="画像が見つかりません")
-    return FileResponse(file_path)
+    
+    # ハッシュ付きのファイル名は内容が変わらないので長期キャッシュ可能
+    immutable = images.AVATAR_NAME_PATTERN.match(name) is not None
+    etag = f'"{os.path.splitext(name)[0]}"'
+    headers = {"ETag": etag}
+    headers["Cache-Control"] = AVATAR_CACHE_CONTROL if immutable else "no-cache"
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    
+    if request.headers.get("if-none-match") == etag:
+        if immutable or await run_in_threadpool(avatar_storage.exists, name):
+            return Response(status_code=304, headers=headers)
+    
+    data = avatar_cache.get(name)
+    if data is not None:
+        return Response(content=data, media_type=media_type, headers=headers)
+    
+    file_path = await run_in_threadpool(avatar_storage.local_path, name)
+    if file_path is not None:
+        try:
+            size = await run_in_threadpool(os.path.getsize, file_path)
+        except FileNotFoundError:
+            # local_path の確認の後に削除された
+            raise HTTPException(status_code=404, detail="画像が見つかりません")
+        if size > avatar_cache.max_item_bytes:
+            return FileResponse(file_path, media_type=media_type, headers=headers)
+    
+    data = await run_in_threadpool(avatar_storage.load, name)
+    if data is None:
+        raise HTTPException(status_code=404, detail="画像が見つかりません")
+    avatar_cache.put(name, data)
+    return Response(content=data, media_type=media_type, headers=headers)
 
 @app.delete("/api/profile/avatar")
 def delete_avatar(
@@ -660,24 +1126,22 @@ def delete_avatar(
     if not user.avatar:
         raise HTTPException(status_code=404, detail="プロフィール画像が設定されていません")
     
-    file_path = os.path.join(UPLOAD_DIR, user.avatar)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    
+    old_avatar = user.avatar
     user.avatar = None
     db.commit()
     
+    remove_avatar_files(db, old_avatar)
+    
     return {"message": "プロフィール画像を削除しました"}
 
 # 緊急用リセットエンドポイント
-@app.get("/reset-users")
+@app.get("/reset-users", status_code=202)
 def reset_users_endpoint():
-    """緊急用: ユーザーテーブルをリセットする"""
+    """緊急用: ユーザーテーブルをリセットする(バックグラウンドで実行)"""
     db = SessionLocal()
     try:
-        db.query(models.User).delete()
-        db.commit()
-        return {"message": "ユーザーテーブルをリセットしました"}
+        job = reset_all_users(db)
+        return {"message": "ユーザーテーブルのリセットを開始しました", "job_id": job["id"]}
     except Exception as e:
         return {"error": str(e)}
     finally:
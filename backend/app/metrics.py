@@ -0,0 +1,240 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine.interfaces import CacheStats
+
+# レイテンシのバケット(秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """単調増加するカウンター"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge(Counter):
+    """増減する値"""
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    """固定バケットのヒストグラム"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # ラベルごとに [バケット毎の件数..., +Inf, 合計値]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *label_values, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, counts in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), label_values + (str(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {counts[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+# アプリケーション全体のメトリクス
+HTTP_REQUESTS = Counter("http_requests_total", "HTTPリクエスト数", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTPリクエストの処理時間", ("method", "route"))
+DB_QUERIES = Histogram(
+    "db_queries_per_request", "リクエストあたりのSQL発行数", ("method", "route"), buckets=QUERY_COUNT_BUCKETS
+)
+DB_TIME = Histogram("db_time_per_request_seconds", "リクエストあたりのSQL実行時間", ("method", "route"))
+SOCKETIO_EMITS = Counter("socketio_emits_total", "Socket.IOの送信回数", ("event",))
+SOCKETIO_CLIENTS = Gauge("socketio_connected_clients", "Socket.IOの接続クライアント数")
+SOCKETIO_CLIENTS.set(value=0)
+RATE_LIMITED = Counter("rate_limited_total", "レート制限で拒否したリクエスト数", ("budget",))
+REQUESTS_SHED = Counter("requests_shed_total", "同時実行数の上限で拒否したリクエスト数")
+REQUESTS_IN_FLIGHT = Gauge("requests_in_flight", "処理中のリクエスト数")
+REQUESTS_IN_FLIGHT.set(value=0)
+CACHE_REQUESTS = Counter("cache_requests_total", "一覧キャッシュの参照回数", ("cache", "result"))
+CACHE_ENTRIES = Gauge("cache_entries", "一覧キャッシュの保持件数", ("cache",))
+JOB_RUNS = Counter("background_job_runs_total", "バックグラウンドジョブの実行回数", ("job", "result"))
+JOB_DURATION = Histogram("background_job_duration_seconds", "バックグラウンドジョブの実行時間", ("job",))
+ARCHIVED_ROWS = Counter("archived_rows_total", "アーカイブに移した行数", ("table",))
+OUTBOX_EVENTS = Counter("outbox_events_total", "アウトボックスのイベント処理数", ("kind", "result"))
+OUTBOX_LAG = Histogram("outbox_lag_seconds", "アウトボックスに書いてから処理するまでの時間", ("kind",))
+REPLAY_BUFFERED_EVENTS = Gauge("socketio_replay_buffer_events", "リプレイ用バッファの保持件数", ("room",))
+REPLAY_BUFFERED_BYTES = Gauge("socketio_replay_buffer_bytes", "リプレイ用バッファの保持バイト数", ("room",))
+REPLAY_REQUESTS = Counter("socketio_replay_requests_total", "再接続時のリプレイ要求数", ("result",))
+REPLAY_EVENTS = Counter("socketio_replayed_events_total", "リプレイで送り直したイベント数")
+JOB_ROWS = Counter("job_rows_processed_total", "ジョブが処理した行数", ("kind",))
+NOTIFICATIONS = Counter("notifications_total", "作成した通知・既存の通知にまとめた数", ("result",))
+ATTACHMENTS = Counter("attachments_total", "作成した添付ファイル(新規保存・重複)", ("result",))
+ATTACHMENT_BYTES = Counter("attachment_upload_bytes_total", "アップロードで受信したバイト数")
+DB_COMPILE_CACHE = Counter("db_compile_cache_total", "SQLのコンパイルキャッシュの参照結果", ("result",))
+DB_LOCK_ERRORS = Counter("db_lock_errors_total", "SQLiteの書き込みロックを待ちきれずに失敗したリクエスト数")
+BATCH_REQUESTS = Counter("batch_subrequests_total", "バッチで実行した呼び出し数", ("method", "status"))
+ACTIVITY_ROWS_REMOVED = Counter("task_activity_rows_removed_total", "圧縮・保持期限で削除した変更履歴の行数", ("reason",))
+REGISTRY = [
+    HTTP_REQUESTS, HTTP_LATENCY, DB_QUERIES, DB_TIME, SOCKETIO_EMITS, SOCKETIO_CLIENTS,
+    RATE_LIMITED, REQUESTS_SHED, REQUESTS_IN_FLIGHT, CACHE_REQUESTS, CACHE_ENTRIES,
+    JOB_RUNS, JOB_DURATION, ARCHIVED_ROWS, OUTBOX_EVENTS, OUTBOX_LAG,
+    REPLAY_BUFFERED_EVENTS, REPLAY_BUFFERED_BYTES, REPLAY_REQUESTS, REPLAY_EVENTS, JOB_ROWS,
+    ACTIVITY_ROWS_REMOVED, NOTIFICATIONS, ATTACHMENTS, ATTACHMENT_BYTES, BATCH_REQUESTS,
+    DB_LOCK_ERRORS, DB_COMPILE_CACHE,
+]
+
+
+class RequestStats:
+    """1リクエスト中のSQL統計"""
+
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    """実行中のリクエストのSQL統計を取得"""
+    return _request_stats.get()
+
+
+# ExecutionContext.cache_hit のラベル
+_CACHE_RESULTS = {
+    CacheStats.CACHE_HIT: "hit",
+    CacheStats.CACHE_MISS: "miss",
+    CacheStats.CACHING_DISABLED: "disabled",
+    CacheStats.NO_CACHE_KEY: "no_key",
+    CacheStats.NO_DIALECT_SUPPORT: "unsupported",
+}
+
+
+def instrument_engine(engine):
+    """SQLの発行回数と実行時間を計測するイベントを登録"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        if context is not None:
+            DB_COMPILE_CACHE.inc(_CACHE_RESULTS.get(context.cache_hit, "unknown"))
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        # 失敗したSQLでは after_cursor_execute が呼ばれないので、開始時刻を捨てておく
+        conn = context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+
+class MetricsMiddleware:
+    """ルートごとのレイテンシ・ステータス・SQL統計を記録"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stats.reset(token)
+            # パスパラメータでラベルが増えないようにルートのテンプレートを使う
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method, route_path, str(status_code))
+            HTTP_LATENCY.observe(method, route_path, value=elapsed)
+            DB_QUERIES.observe(method, route_path, value=stats.queries)
+            DB_TIME.observe(method, route_path, value=stats.db_time)
+
+
+def render_metrics() -> str:
+    """Prometheusのテキスト形式で出力"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,122 @@
+"""スキーマのマイグレーション(デプロイ時に明示的に実行)
+
+    python -m app.migrate
+
+アプリ起動時にはテーブル作成を行わないので、新しいテーブルや列を追加したら
+MIGRATIONS に手順を追加する。
+"""
+import time
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+
+from . import models, ranking, stats
+from .database import write_engine
+
+# 適用済みのマイグレーションを記録するテーブル
+migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+
+def add_column_if_missing(conn, table: str, column: str, ddl: str):
+    """列が無ければ追加(create_allで作成済みの新規DBでは何もしない)"""
+    columns = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def create_index_if_missing(conn, name: str, table: str, columns: str):
+    """インデックスが無ければ作成"""
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def seed_cache_versions(conn):
+    """一覧キャッシュのバージョン行を作成"""
+    for name in ("projects", "users"):
+        exists = conn.execute(text("SELECT 1 FROM cache_versions WHERE name = :name"), {"name": name}).first()
+        if exists is None:
+            conn.execute(text("INSERT INTO cache_versions (name, version) VALUES (:name, 0)"), {"name": name})
+
+
+def add_calendar_indexes(conn):
+    """カレンダーの期間検索用インデックスを作成"""
+    create_index_if_missing(conn, "ix_tasks_due_date", "tasks", "due_date")
+    create_index_if_missing(conn, "ix_tasks_project_due_date", "tasks", "project_id, due_date")
+    create_index_if_missing(conn, "ix_tasks_assignee_due_date", "tasks", "assignee_id, due_date")
+
+
+def backfill_task_stats(conn):
+    """既存タスクから期限切れフラグと集計を作成"""
+    stats.refresh_overdue(conn)
+    stats.rebuild(conn)
+
+
+def add_archive_columns(conn):
+    """アーカイブ判定用の完了日時と通知一覧用インデックスを追加"""
+    add_column_if_missing(conn, "tasks", "completed_at", "TIMESTAMP")
+    create_index_if_missing(conn, "ix_notifications_user_created_at", "notifications", "user_id, created_at")
+
+
+def add_task_ranks(conn):
+    """ボードの並び順の列とインデックスを追加し、既存タスクにランクを振る"""
+    add_column_if_missing(conn, "tasks", "rank", "VARCHAR")
+    create_index_if_missing(conn, "ix_tasks_project_status_rank", "tasks", "project_id, status, rank")
+    ranking.rebalance_all(conn)
+
+
+def add_notification_counts(conn):
+    """まとめた通知の件数と最初の日時の列を追加"""
+    for table in ("notifications", "notifications_archive"):
+        add_column_if_missing(conn, table, "event_count", "INTEGER NOT NULL DEFAULT 1")
+        add_column_if_missing(conn, table, "first_created_at", "TIMESTAMP")
+        conn.execute(text(f"UPDATE {table} SET first_created_at = created_at WHERE first_created_at IS NULL"))
+
+
+def add_task_hierarchy(conn):
+    """サブタスクの親と子孫の集計の列を追加(依存関係のテーブルはモデルから作成)"""
+    add_column_if_missing(conn, "tasks", "parent_id", "INTEGER")
+    add_column_if_missing(conn, "tasks", "subtasks_total", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(conn, "tasks", "subtasks_done", "INTEGER NOT NULL DEFAULT 0")
+    create_index_if_missing(conn, "ix_tasks_parent_id", "tasks", "parent_id")
+
+
+# (バージョン, 名前, 手順) の一覧。バージョンは増やす一方で、適用済みの手順は変更しない
+MIGRATIONS = [
+    (1, "seed_cache_versions", seed_cache_versions),
+    (2, "add_calendar_indexes", add_calendar_indexes),
+    (3, "backfill_task_stats", backfill_task_stats),
+    (4, "add_archive_columns", add_archive_columns),
+    (5, "add_task_ranks", add_task_ranks),
+    (6, "add_notification_counts", add_notification_counts),
+    (7, "add_task_hierarchy", add_task_hierarchy),
+]
+
+
+def run_migrations(bind=write_engine) -> list:
+    """未適用のマイグレーションを順に適用し、適用したバージョンを返す"""
+    # 新しいテーブルはモデル定義から作成
+    models.Base.metadata.create_all(bind=bind)
+    migration_metadata.create_all(bind=bind)
+
+    applied = []
+    with bind.begin() as conn:
+        done = {row.version for row in conn.execute(schema_migrations.select())}
+        for version, name, step in MIGRATIONS:
+            if version in done:
+                continue
+            step(conn)
+            conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+            applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    versions = run_migrations()
+    print(f"Applied migrations: {versions or 'none'} ({time.perf_counter() - start:.2f}s)")
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Enum
+from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Enum, Float, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -61,12 +61,36 @@ class Task(Base):
     attachments = Column(Integer, default=0)
     is_overdue = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime)  # doneになった日時(アーカイブの判定に使う)
+    rank = Column(String)  # ボードの列内の並び順(ranking.py)
+    # サブタスクの親(hierarchy.py)。アーカイブ・削除で親が消えたら子は一つ上の親へ付け替える
+    parent_id = Column(Integer, index=True)
+    # 子孫タスクの数と完了数(ステータス変更のたびに祖先へ差分を足す)
+    subtasks_total = Column(Integer, nullable=False, default=0)
+    subtasks_done = Column(Integer, nullable=False, default=0)
     
     # リレーション
     assignee = relationship("User", back_populates="tasks")
     project = relationship("Project", back_populates="tasks")
     comments = relationship("Comment", back_populates="task", cascade="all, delete-orphan")
 
+    # カレンダーの期間検索用(due_dateは YYYY-MM-DD の文字列なので辞書順で範囲比較できる)
+    __table_args__ = (
+        Index("ix_tasks_due_date", "due_date"),
+        Index("ix_tasks_project_due_date", "project_id", "due_date"),
+        Index("ix_tasks_assignee_due_date", "assignee_id", "due_date"),
+        # ボードの列(プロジェクト・ステータス)内の並び替え用
+        Index("ix_tasks_project_status_rank", "project_id", "status", "rank"),
+    )
+
+class TaskDependency(Base):
+    """タスク間の依存(task_id は depends_on_id が終わるまで進められない)"""
+    __tablename__ = "task_dependencies"
+
+    task_id = Column(Integer, primary_key=True)
+    depends_on_id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Comment(Base):
     __tablename__ = "comments"
 
@@ -87,11 +111,186 @@ class Notification(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     task_id = Column(Integer, ForeignKey("tasks.id"), nullable=True)
-    type = Column(String, nullable=False)  # 'due_soon', 'assigned', 'comment'
-    message = Column(Text, nullable=False)
+    type = Column(String, nullable=False)  # 'due_soon', 'assigned', 'comment', 'digest'
+    message = Column(Text, nullable=False)  # まとめた場合は最新のメッセージ
     is_read = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)  # まとめた場合は最新の日時
+    event_count = Column(Integer, nullable=False, default=1)  # まとめた通知の数(notify.py)
+    first_created_at = Column(DateTime, default=datetime.utcnow)
 
     # リレーション
     user = relationship("User")
     task = relationship("Task")
+
+    # ユーザーごとの新しい順の一覧用
+    __table_args__ = (
+        Index("ix_notifications_user_created_at", "user_id", "created_at"),
+    )
+
+class RateLimitBucket(Base):
+    """複数ワーカーで共有するレート制限のトークンバケット(RATE_LIMIT_STORE=postgres)"""
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)  # UNIX時刻(秒)
+
+class CacheVersion(Base):
+    """一覧キャッシュのバージョン(更新のたびに増やし、全ワーカーのキャッシュを無効化)"""
+    __tablename__ = "cache_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class TaskStat(Base):
+    """プロジェクト・担当者ごとのタスク集計(タスクの書き込み時に差分で更新)"""
+    __tablename__ = "task_stats"
+
+    scope = Column(String, primary_key=True)      # 'project' / 'user'
+    scope_id = Column(Integer, primary_key=True)
+    status = Column(String, primary_key=True)
+    priority = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    overdue = Column(Integer, nullable=False, default=0)
+
+class OutboxEvent(Base):
+    """変更と同じトランザクションで書く送信予定のイベント(ディスパッチャーが処理後に削除)"""
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)      # 'emit' / 'notification'
+    name = Column(String, nullable=False)      # Socket.IOのイベント名 / 通知の種類
+    entity = Column(String, nullable=False)    # 順序を守る単位('task:1' など)
+    payload = Column(Text, nullable=False)     # JSON
+    status = Column(String, nullable=False, default="pending")  # 'pending' / 'inflight' / 'dead'
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    created_at = Column(Float, nullable=False)    # UNIX時刻(秒)
+    available_at = Column(Float, nullable=False)  # 再試行を待つ間は未来の時刻。処理中はリースの期限
+
+    __table_args__ = (
+        Index("ix_outbox_events_status_available_at", "status", "available_at"),
+        Index("ix_outbox_events_entity_id", "entity", "id"),
+    )
+
+class Job(Base):
+    """バックグラウンドで実行する重い処理(一括削除など)"""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)       # 'delete_project' / 'delete_user' / 'reset_users'
+    params = Column(Text, nullable=False)       # JSON
+    status = Column(String, nullable=False, default="queued")  # queued / running / done / failed
+    step = Column(Integer, nullable=False, default=0)          # 完了した手順の数(再開位置)
+    progress = Column(Text, nullable=False, default="{}")      # JSON: 手順ごとの処理件数
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    locked_by = Column(String)
+    locked_until = Column(Float)   # UNIX時刻(秒)。過ぎたら他のワーカーが引き継ぐ
+    available_at = Column(Float, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_jobs_status_available_at", "status", "available_at"),
+    )
+
+class TaskActivity(Base):
+    """タスクの変更履歴(変わった項目だけをJSONで持つ。タスクを削除しても残すので外部キーは張らない)"""
+    __tablename__ = "task_activities"
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, nullable=False)
+    user_id = Column(Integer)                   # 変更したユーザー(ジョブなどによる変更はNULL)
+    action = Column(String, nullable=False)     # created / updated / deleted / restored
+    changes = Column(Text, nullable=False)      # JSON: {"項目": [変更前, 変更後]}
+    edits = Column(Integer, nullable=False, default=1)  # まとめた変更の数
+    compacted = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_task_activities_task_created_at", "task_id", "created_at"),
+        Index("ix_task_activities_compacted_created_at", "compacted", "created_at"),
+    )
+
+class Attachment(Base):
+    """タスクの添付ファイル(本体は sha256 の名前で保存し、同じ内容のファイルは共有する)
+
+    アーカイブ中のタスクの添付も残すので外部キーは張らない(どちらにも無いタスクの行は定期ジョブで削除)。
+    """
+    __tablename__ = "task_attachments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(Integer)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class AttachmentUpload(Base):
+    """再開可能なアップロード(受信済みのバイト数まで partial/ に書いてある)"""
+    __tablename__ = "attachment_uploads"
+
+    id = Column(String(32), primary_key=True)  # UUID(hex)
+    task_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    received = Column(BigInteger, nullable=False, default=0)
+    sha256 = Column(String(64))  # 申告されたハッシュ(あれば完了時に検証)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+# アーカイブ(元のIDを保ったまま移動する。外部キーは張らない)
+class ArchivedTask(Base):
+    """完了から一定期間たったタスク"""
+    __tablename__ = "tasks_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    title = Column(String, nullable=False)
+    description = Column(Text)
+    status = Column(String)
+    priority = Column(String)
+    due_date = Column(String)
+    start_time = Column(String)
+    end_time = Column(String)
+    assignee_id = Column(Integer, index=True)
+    project_id = Column(Integer, index=True)
+    is_overdue = Column(Boolean, default=False)
+    created_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class ArchivedComment(Base):
+    """アーカイブしたタスクのコメント"""
+    __tablename__ = "comments_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    content = Column(Text, nullable=False)
+    task_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class ArchivedNotification(Base):
+    """保持期間を過ぎた既読の通知"""
+    __tablename__ = "notifications_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False)
+    task_id = Column(Integer)
+    type = Column(String, nullable=False)
+    message = Column(Text, nullable=False)
+    is_read = Column(Boolean, default=True)
+    created_at = Column(DateTime)
+    event_count = Column(Integer, nullable=False, default=1)
+    first_created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_notifications_archive_user_created_at", "user_id", "created_at"),
+    )
@@ -0,0 +1,155 @@
+"""通知のまとめ(コアレッシング)とダイジェスト
+
+同じ受信者・タスク・種類の未読通知が NOTIFICATION_COALESCE_WINDOW 秒以内にあれば、新しい行は作らずに
+その行の件数を増やし、メッセージと日時を最新のものにする(一覧の先頭に上がる)。
+NOTIFICATION_DIGEST_INTERVAL を設定すると、未読がたまったユーザーごとに1件のダイジェストを作り、
+まとめた通知を既読にする。どちらも通知の行数がイベント数ではなくタスク数に比例するようにするため。
+
+    python -m app.notify digest      # 今すぐダイジェストを作成
+"""
+import os
+import sys
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, distinct, func, insert, select, update
+
+from . import metrics, models
+
+# 0ならまとめない
+NOTIFICATION_COALESCE_WINDOW = float(os.getenv("NOTIFICATION_COALESCE_WINDOW", "900"))
+# 0ならダイジェストを作らない
+NOTIFICATION_DIGEST_INTERVAL = float(os.getenv("NOTIFICATION_DIGEST_INTERVAL", "0"))
+# 未読がこの件数以上たまったユーザーにだけダイジェストを作る
+NOTIFICATION_DIGEST_MIN_EVENTS = int(os.getenv("NOTIFICATION_DIGEST_MIN_EVENTS", "10"))
+
+DIGEST_TYPE = "digest"
+
+Notification = models.Notification
+notifications = Notification.__table__
+
+Key = Tuple[int, int, str]
+
+
+def coalesce(db, items: List[dict], window: float = NOTIFICATION_COALESCE_WINDOW) -> int:
+    """通知(user_id, task_id, type, message の辞書)を作成し、既存の行にまとめた数を返す(コミットは呼び出し側)"""
+    now = datetime.utcnow()
+    fresh: List[dict] = []
+    merged: "OrderedDict[Key, dict]" = OrderedDict()
+    for item in items:
+        row = dict(item, event_count=1, first_created_at=now, created_at=now)
+        if window <= 0 or item["task_id"] is None:
+            fresh.append(row)
+            continue
+        # 同じバッチ内の同じ通知を先にまとめる
+        key = (item["user_id"], item["task_id"], item["type"])
+        if key in merged:
+            merged[key]["message"] = item["message"]
+            merged[key]["event_count"] += 1
+        else:
+            merged[key] = row
+
+    existing: Dict[Key, int] = {}
+    if merged:
+        # (user_id, created_at) のインデックスで直近の未読だけを見る
+        rows = db.execute(
+            select(notifications.c.id, notifications.c.user_id, notifications.c.task_id, notifications.c.type)
+            .where(
+                notifications.c.user_id.in_({key[0] for key in merged}),
+                notifications.c.created_at >= now - timedelta(seconds=window),
+                notifications.c.is_read == False,  # noqa: E712
+                notifications.c.task_id.in_({key[1] for key in merged}),
+            )
+            .order_by(notifications.c.created_at)
+            .with_for_update()
+        ).all()
+        for row in rows:
+            existing[(row.user_id, row.task_id, row.type)] = row.id
+
+    updates = []
+    for key, row in merged.items():
+        if key in existing:
+            updates.append({
+                "target_id": existing[key],
+                "new_message": row["message"],
+                "added": row["event_count"],
+                "updated_at": now,
+            })
+        else:
+            fresh.append(row)
+    if updates:
+        db.execute(
+            update(notifications)
+            .where(notifications.c.id == bindparam("target_id"))
+            .values(
+                message=bindparam("new_message"),
+                event_count=notifications.c.event_count + bindparam("added"),
+                created_at=bindparam("updated_at"),
+            ),
+            updates,
+        )
+    if fresh:
+        db.execute(insert(Notification), fresh)
+
+    coalesced = len(items) - len(fresh)
+    metrics.NOTIFICATIONS.inc("created", amount=len(fresh))
+    metrics.NOTIFICATIONS.inc("coalesced", amount=coalesced)
+    return coalesced
+
+
+def build_digests(db, min_events: int = NOTIFICATION_DIGEST_MIN_EVENTS, now: Optional[datetime] = None) -> int:
+    """未読がたまったユーザーごとにダイジェストを1件作ってまとめた通知を既読にし、作成数を返す"""
+    now = now or datetime.utcnow()
+    unread = (notifications.c.is_read == False, notifications.c.created_at <= now)  # noqa: E712
+    totals = db.execute(
+        select(
+            notifications.c.user_id,
+            func.sum(notifications.c.event_count).label("events"),
+            func.count(distinct(notifications.c.task_id)).label("tasks"),
+            func.min(func.coalesce(notifications.c.first_created_at, notifications.c.created_at)).label("first"),
+        )
+        .where(*unread)
+        .group_by(notifications.c.user_id)
+        .having(func.sum(notifications.c.event_count) >= min_events)
+    ).all()
+    if not totals:
+        return 0
+    db.execute(
+        update(notifications)
+        .where(notifications.c.user_id.in_([row.user_id for row in totals]), *unread)
+        .values(is_read=True)
+    )
+    db.execute(insert(Notification), [
+        {
+            "user_id": row.user_id,
+            "task_id": None,
+            "type": DIGEST_TYPE,
+            "message": f"未読の通知が{row.events}件あります({row.tasks}件のタスク)",
+            "event_count": row.events,
+            "first_created_at": row.first,
+            "created_at": now,
+        }
+        for row in totals
+    ])
+    db.commit()
+    metrics.NOTIFICATIONS.inc("digest", amount=len(totals))
+    return len(totals)
+
+
+def run_digest_job(db) -> int:
+    """定期実行用: ダイジェストを作成"""
+    return build_digests(db)
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    if sys.argv[1:] != ["digest"]:
+        print("usage: python -m app.notify digest")
+        sys.exit(2)
+    session = SessionLocal()
+    try:
+        print(f"Digests: {build_digests(session)}")
+    finally:
+        session.close()
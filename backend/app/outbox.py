@@ -0,0 +1,318 @@
+"""トランザクショナル・アウトボックス
+
+変更と同じトランザクションで outbox_events に「送るべきもの」(Socket.IOの送信・通知の作成)を書き、
+バックグラウンドのディスパッチャーがまとめて処理する。HTTPレスポンスは送信を待たない。
+
+- 同じエンティティ(task:1 など)のイベントはID順に1件ずつ処理し、失敗したらそこで止めて再試行する
+- 取得した行は短いトランザクションで status='inflight'(リース付き)にしてコミットし、
+  送信中はトランザクションも行ロックも持たない。結果は別のトランザクションで記録する。
+  ワーカーが落ちてリースが切れた行は、他のワーカーが引き継ぐ
+- 成功した行は削除し、OUTBOX_MAX_ATTEMPTS 回失敗した行は status='dead' で残す
+- 送信は少なくとも1回(プロセスが落ちると再送されうる)、通知の作成は行の削除と同じトランザクション
+- 通知は notify.coalesce で直近の同じ未読通知にまとめる
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, event, select, update
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics, models, notify
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "60"))
+# 取得した行を処理中として押さえておく時間(過ぎたら他のワーカーが引き継ぐ)
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "30"))
+
+KIND_EMIT = "emit"
+KIND_NOTIFICATION = "notification"
+
+OutboxEvent = models.OutboxEvent
+
+# 未処理の行(処理中で期限切れのものは取得し直せる)
+UNFINISHED = ("pending", "inflight")
+
+
+def task_payload(task) -> dict:
+    """task_update で送るタスクの内容"""
+    return {
+        'id': task.id,
+        'title': task.title,
+        'description': task.description,
+        'status': task.status,
+        'priority': task.priority,
+        'due_date': task.due_date,
+        'start_time': task.start_time,
+        'end_time': task.end_time,
+        'assignee_id': task.assignee_id,
+        'project_id': task.project_id,
+        'parent_id': task.parent_id,
+        'created_at': task.created_at.isoformat() if task.created_at else None,
+        'rank': task.rank,
+        'attachments': task.attachments,
+        'subtasks_total': task.subtasks_total,
+        'subtasks_done': task.subtasks_done
+    }
+
+
+def project_payload(project) -> dict:
+    """project_update で送るプロジェクトの内容"""
+    return {
+        'id': project.id,
+        'title': project.title,
+        'description': project.description,
+        'color': project.color,
+        'owner_id': project.owner_id
+    }
+
+
+def _add(db, kind: str, name: str, entity: str, payload: dict):
+    now = time.time()
+    db.add(OutboxEvent(
+        kind=kind,
+        name=name,
+        entity=entity,
+        payload=json.dumps(payload, ensure_ascii=False),
+        created_at=now,
+        available_at=now,
+    ))
+    db.info["outbox_enqueued"] = True
+
+
+def enqueue_emit(db, event_name: str, event_type: str, data: dict, entity: str):
+    """全クライアントへの送信を予約(コミットされたら送る)"""
+    _add(db, KIND_EMIT, event_name, entity, {'type': event_type, 'data': data})
+
+
+def enqueue_notification(db, user_id: int, task_id: Optional[int], notification_type: str, message: str):
+    """通知の作成を予約(コミットされたらまとめて作成)"""
+    _add(db, KIND_NOTIFICATION, notification_type, f"user:{user_id}", {
+        'user_id': user_id,
+        'task_id': task_id,
+        'type': notification_type,
+        'message': message,
+    })
+
+
+def _claim(db, batch_size: int) -> Tuple[List[OutboxEvent], float]:
+    """送信できるイベント(エンティティごとの順序を守れるものだけ)を処理中にしてコミットし、
+    イベントとリースの期限を返す"""
+    now = time.time()
+    events = db.execute(
+        select(OutboxEvent)
+        .where(OutboxEvent.status.in_(UNFINISHED), OutboxEvent.available_at <= now)
+        .order_by(OutboxEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not events:
+        db.rollback()
+        return [], 0.0
+
+    # 各エンティティの未処理イベント(再試行待ち・他ワーカー処理中も含む)を古い順に並べ、
+    # 先頭から途切れずに取得できている分だけを処理する
+    claimed = {e.id: e for e in events}
+    pending = db.execute(
+        select(OutboxEvent.entity, OutboxEvent.id)
+        .where(
+            OutboxEvent.status.in_(UNFINISHED),
+            OutboxEvent.entity.in_({e.entity for e in events}),
+            OutboxEvent.id <= events[-1].id,
+        )
+        .order_by(OutboxEvent.id)
+    ).all()
+    blocked = set()
+    ready = []
+    for entity, event_id in pending:
+        if entity in blocked:
+            continue
+        if event_id in claimed:
+            ready.append(claimed[event_id])
+        else:
+            blocked.add(entity)
+    if not ready:
+        db.rollback()
+        return [], 0.0
+
+    lease_until = now + OUTBOX_LEASE_SECONDS
+    db.execute(
+        update(OutboxEvent)
+        .where(OutboxEvent.id.in_([e.id for e in ready]))
+        .values(status="inflight", available_at=lease_until)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return ready, lease_until
+
+
+def _finish(db, events: List[OutboxEvent], lease_until: float, done: List[OutboxEvent], failed: Dict[int, str]):
+    """通知をまとめて作成し、処理済みの行を削除、失敗した行は再試行を予約、
+    送らなかった行は待機中に戻してコミット
+
+    リースが切れて他のワーカーに引き継がれた行には触らない(通知を二重に作らないため)。
+    """
+    owned = set(db.execute(
+        select(OutboxEvent.id)
+        .where(
+            OutboxEvent.id.in_([e.id for e in events]),
+            OutboxEvent.status == "inflight",
+            OutboxEvent.available_at == lease_until,
+        )
+        .with_for_update()
+    ).scalars())
+    done = [e for e in done if e.id in owned]
+    failed = {event_id: error for event_id, error in failed.items() if event_id in owned}
+
+    notifications = [json.loads(e.payload) for e in done if e.kind == KIND_NOTIFICATION]
+    if notifications:
+        # 予約後にユーザーやタスクが削除されていたら、通知を捨てるかタスクへの参照を外す
+        user_ids = set(db.execute(
+            select(models.User.id).where(models.User.id.in_({n['user_id'] for n in notifications}))
+        ).scalars())
+        task_ids = set(db.execute(
+            select(models.Task.id).where(models.Task.id.in_({n['task_id'] for n in notifications if n['task_id']}))
+        ).scalars())
+        notifications = [
+            dict(n, task_id=n['task_id'] if n['task_id'] in task_ids else None)
+            for n in notifications if n['user_id'] in user_ids
+        ]
+    if notifications:
+        notify.coalesce(db, notifications)
+        metrics.OUTBOX_EVENTS.inc(KIND_NOTIFICATION, "sent", amount=len(notifications))
+    if done:
+        db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_([e.id for e in done])))
+
+    now = time.time()
+    for e in done:
+        metrics.OUTBOX_LAG.observe(e.kind, value=now - e.created_at)
+    for event_id, error in failed.items():
+        attempts = db.execute(select(OutboxEvent.attempts).where(OutboxEvent.id == event_id)).scalar() + 1
+        values = {"attempts": attempts, "last_error": error[:500]}
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            values["status"] = "dead"
+        else:
+            values["status"] = "pending"
+            values["available_at"] = now + min(OUTBOX_MAX_BACKOFF, 2 ** attempts)
+        db.execute(update(OutboxEvent).where(OutboxEvent.id == event_id).values(**values))
+    # 同じエンティティの前のイベントが失敗した、または停止で送れなかった行
+    unsent = owned - {e.id for e in done} - set(failed)
+    if unsent:
+        db.execute(
+            update(OutboxEvent).where(OutboxEvent.id.in_(unsent)).values(status="pending", available_at=now)
+        )
+    db.commit()
+
+
+class OutboxDispatcher:
+    """アウトボックスを読み出して送信するバックグラウンドタスク"""
+
+    def __init__(self, emit: Callable[..., Awaitable], batch_size: int = OUTBOX_BATCH_SIZE,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.emit = emit
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        """新しいイベントがコミットされたことを知らせる(どのスレッドからでも呼べる)"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _emit_entity(self, events: List[OutboxEvent], done: List[OutboxEvent], failed: Dict[int, str]):
+        # 同じエンティティのイベントは順番に送り、失敗したら以降は次回に回す
+        for e in events:
+            try:
+                await self.emit(e.name, json.loads(e.payload))
+            except Exception as exc:
+                failed[e.id] = repr(exc)
+                metrics.OUTBOX_EVENTS.inc(e.kind, "retry")
+                return
+            metrics.SOCKETIO_EMITS.inc(e.name)
+            metrics.OUTBOX_EVENTS.inc(e.kind, "sent")
+            done.append(e)
+
+    async def dispatch_once(self) -> int:
+        """1バッチ分を処理し、取得した件数を返す"""
+        # 取得した行の値はコミット後も(送信中にDBを読まずに)使う
+        db = SessionLocal(expire_on_commit=False)
+        try:
+            events, lease_until = await run_in_threadpool(_claim, db, self.batch_size)
+            if not events:
+                return 0
+            done = [e for e in events if e.kind == KIND_NOTIFICATION]
+            failed: Dict[int, str] = {}
+            by_entity: "OrderedDict[str, List[OutboxEvent]]" = OrderedDict()
+            for e in events:
+                if e.kind == KIND_EMIT:
+                    by_entity.setdefault(e.entity, []).append(e)
+            try:
+                # 送信中はトランザクションを開いていない
+                await asyncio.gather(*(self._emit_entity(group, done, failed) for group in by_entity.values()))
+            finally:
+                # 停止で中断された場合も、送った分を記録し残りは待機中に戻す
+                await run_in_threadpool(_finish, db, events, lease_until, done, failed)
+            return len(events)
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            try:
+                claimed = await self.dispatch_once()
+            except Exception:
+                logger.exception("アウトボックスの処理に失敗しました")
+                claimed = 0
+            if claimed >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="outbox-dispatcher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # 停止前にコミットされた分は送っておく
+            try:
+                while await self.dispatch_once() >= self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("アウトボックスの処理に失敗しました")
+        self._loop = None
+
+
+def install(session_factory, dispatcher: OutboxDispatcher):
+    """アウトボックスに書いたトランザクションがコミットされたらディスパッチャーを起こす"""
+    def after_commit(session):
+        if session.info.pop("outbox_enqueued", False):
+            dispatcher.wake()
+
+    def after_rollback(session):
+        session.info.pop("outbox_enqueued", None)
+
+    event.listen(session_factory, "after_commit", after_commit)
+    event.listen(session_factory, "after_rollback", after_rollback)
@@ -0,0 +1,333 @@
+"""本番環境での1リクエスト単位のプロファイリング(管理者のみ・オプトイン)
+
+PROFILING=1 のときだけミドルウェアとSQLのイベントを登録するので、無効なら何も計測しない。
+有効なときは次のリクエストを計測する:
+
+- PROFILE_ADMIN_EMAILS のユーザーが X-Profile: 1 ヘッダーを付けたリクエスト
+- PROFILE_SAMPLE_RATE の割合で無作為に選んだリクエスト
+
+計測するのは、発行したSQL(文・時間)、tracemalloc のスナップショットの差分(確保したメモリの多い行)、
+実時間とCPU時間・SQL時間の内訳、スタックのサンプリング(イベントループのスレッドと、
+このリクエストのSQLを実行したスレッドが対象)。
+レポートは PROFILE_DIR にJSONで保存し、新しい PROFILE_MAX_REPORTS 件だけを残す。
+計測したリクエストのレスポンスには X-Profile-Id ヘッダーを付ける(/api/admin/profiles/{id} で取得)。
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from jose import JWTError, jwt
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+
+from . import querylog
+from .auth import ALGORITHM, SECRET_KEY
+
+PROFILING_ENABLED = os.getenv("PROFILING", "").lower() in ("1", "true", "yes")
+# ヘッダーで計測を指定できる・レポートを取得できるユーザー
+PROFILE_ADMIN_EMAILS = {email.strip() for email in os.getenv("PROFILE_ADMIN_EMAILS", "").split(",") if email.strip()}
+# 無作為に計測するリクエストの割合(0〜1)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# 保存しておくレポートの数(古いものから削除)
+PROFILE_MAX_REPORTS = int(os.getenv("PROFILE_MAX_REPORTS", "50"))
+# スタックをサンプリングする間隔(ミリ秒)
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+# レポートに載せるSQL・メモリ確保・スタックの件数
+PROFILE_MAX_STATEMENTS = int(os.getenv("PROFILE_MAX_STATEMENTS", "200"))
+PROFILE_TOP_ALLOCATIONS = int(os.getenv("PROFILE_TOP_ALLOCATIONS", "25"))
+PROFILE_TOP_STACKS = int(os.getenv("PROFILE_TOP_STACKS", "30"))
+PROFILE_STACK_DEPTH = 40
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]{19}-[0-9a-f]{8}$")
+
+
+def is_admin(user) -> bool:
+    return user is not None and user.email in PROFILE_ADMIN_EMAILS
+
+
+def _token_email(headers) -> Optional[str]:
+    """Authorization ヘッダーのトークンのユーザー(DBは読まない)"""
+    for name, value in headers:
+        if name == b"authorization":
+            authorization = value.decode("latin-1")
+            if authorization.lower().startswith("bearer "):
+                try:
+                    return jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+                except JWTError:
+                    return None
+    return None
+
+
+def should_profile(scope) -> Optional[str]:
+    """計測するリクエストなら計測のきっかけ('header' / 'sample')"""
+    headers = scope.get("headers", [])
+    if any(name == PROFILE_HEADER and value in (b"1", b"true") for name, value in headers):
+        if _token_email(headers) in PROFILE_ADMIN_EMAILS:
+            return "header"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+class Profile:
+    """1リクエスト分の計測結果"""
+
+    def __init__(self, scope, trigger: str):
+        self.id = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        self.scope = scope
+        self.trigger = trigger
+        self.status: Optional[int] = None
+        self.statements: List[Dict] = []
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.shapes: Counter = Counter()
+        self.threads = {threading.get_ident()}
+        self.stacks: Counter = Counter()
+        self.sample_count = 0
+        self._lock = threading.Lock()
+
+    def record_sql(self, statement: str, elapsed: float):
+        with self._lock:
+            self.sql_count += 1
+            self.sql_time += elapsed
+            self.shapes[querylog.normalize_statement(statement)] += 1
+            if len(self.statements) < PROFILE_MAX_STATEMENTS:
+                self.statements.append({"statement": statement, "elapsed_ms": round(elapsed * 1000, 3)})
+            # 同期のエンドポイントはスレッドプールで動くので、SQLを実行したスレッドもサンプリングする
+            self.threads.add(threading.get_ident())
+
+
+_current: ContextVar[Optional[Profile]] = ContextVar("profile", default=None)
+
+
+def instrument_engine(engine):
+    """計測中のリクエストが発行したSQLを記録するイベントを登録"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _current.get()
+        if profile is not None and conn.info.get("profile_start"):
+            profile.record_sql(statement, time.perf_counter() - conn.info["profile_start"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        conn = context.connection
+        if conn is not None and conn.info.get("profile_start"):
+            conn.info["profile_start"].pop()
+
+
+class _Sampler(threading.Thread):
+    """計測中のリクエストのスレッドのスタックを一定間隔で集計"""
+
+    def __init__(self, profile: Profile):
+        super().__init__(name=f"profile-{profile.id}", daemon=True)
+        self.profile = profile
+        self.stopped = threading.Event()
+
+    def run(self):
+        interval = PROFILE_SAMPLE_INTERVAL_MS / 1000
+        while not self.stopped.wait(interval):
+            frames = sys._current_frames()
+            for ident in list(self.profile.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.profile.stacks[_stack(frame)] += 1
+                    self.profile.sample_count += 1
+
+
+def _stack(frame) -> str:
+    """外側から内側へ 'ファイル:関数:行' を ; でつないだスタック"""
+    names = []
+    while frame is not None and len(names) < PROFILE_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# tracemalloc は計測中のリクエストがある間だけ動かす
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False  # 起動時から(PYTHONTRACEMALLOC で)動いている場合は止めない
+
+
+def _start_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_users += 1
+    return tracemalloc.take_snapshot()
+
+
+def _stop_tracing(before):
+    global _tracing_users, _tracing_started
+    after = tracemalloc.take_snapshot()
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+    # 計測用のモジュール自身の確保は除く
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    diff = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    return [
+        {
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_diff_kb": round(stat.size_diff / 1024, 1),
+            "count_diff": stat.count_diff,
+        }
+        for stat in diff[:PROFILE_TOP_ALLOCATIONS]
+    ]
+
+
+def build_report(profile: Profile, wall: float, cpu: float, allocations: List[dict]) -> dict:
+    scope = profile.scope
+    return {
+        "id": profile.id,
+        "created_at": datetime.utcnow().isoformat(),
+        "trigger": profile.trigger,
+        "method": scope["method"],
+        "path": scope["path"],
+        "query": scope.get("query_string", b"").decode("latin-1"),
+        "status": profile.status,
+        "timing": {
+            "wall_ms": round(wall * 1000, 3),
+            # プロセス全体のCPU時間(同時に処理していた他のリクエストの分も含む)
+            "process_cpu_ms": round(cpu * 1000, 3),
+            "sql_ms": round(profile.sql_time * 1000, 3),
+            "other_ms": round(max(wall - profile.sql_time, 0) * 1000, 3),
+        },
+        "sql": {
+            "count": profile.sql_count,
+            "shapes": [{"shape": shape, "count": count} for shape, count in profile.shapes.most_common(20)],
+            "statements": profile.statements,
+        },
+        "allocations": allocations,
+        "samples": {
+            "interval_ms": PROFILE_SAMPLE_INTERVAL_MS,
+            "count": profile.sample_count,
+            "stacks": [{"stack": stack, "count": count}
+                       for stack, count in profile.stacks.most_common(PROFILE_TOP_STACKS)],
+        },
+    }
+
+
+def save_report(report: dict, directory: str = PROFILE_DIR, max_reports: int = PROFILE_MAX_REPORTS):
+    """レポートを保存し、古いものを消して max_reports 件に保つ"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{report['id']}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+    # IDは時刻から始まるので名前順が古い順
+    for name in sorted(list_report_ids(directory))[:-max_reports or None]:
+        try:
+            os.remove(os.path.join(directory, f"{name}.json"))
+        except FileNotFoundError:
+            pass
+
+
+def list_report_ids(directory: str = PROFILE_DIR) -> List[str]:
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [name[:-5] for name in names if name.endswith(".json") and PROFILE_ID_PATTERN.match(name[:-5])]
+
+
+def list_reports(directory: str = PROFILE_DIR) -> List[dict]:
+    """保存してあるレポートの概要(新しい順)"""
+    summaries = []
+    for report_id in sorted(list_report_ids(directory), reverse=True):
+        report = load_report(report_id, directory)
+        if report is not None:
+            summaries.append({
+                "id": report["id"],
+                "created_at": report["created_at"],
+                "trigger": report["trigger"],
+                "method": report["method"],
+                "path": report["path"],
+                "status": report["status"],
+                "wall_ms": report["timing"]["wall_ms"],
+                "sql_count": report["sql"]["count"],
+            })
+    return summaries
+
+
+def report_path(report_id: str, directory: str = PROFILE_DIR) -> Optional[str]:
+    if not PROFILE_ID_PATTERN.match(report_id):
+        return None
+    path = os.path.join(directory, f"{report_id}.json")
+    return path if os.path.exists(path) else None
+
+
+def load_report(report_id: str, directory: str = PROFILE_DIR) -> Optional[dict]:
+    path = report_path(report_id, directory)
+    if path is None:
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class ProfilingMiddleware:
+    """計測対象のリクエストだけを計測してレポートを保存(PROFILING=1 のときだけ追加する)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        trigger = should_profile(scope) if scope["type"] == "http" else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope, trigger)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile.id.encode())
+                ]
+            await send(message)
+
+        token = _current.set(profile)
+        sampler = _Sampler(profile)
+        # スナップショットの取得・比較は重いので、イベントループを止めないようスレッドで行う
+        before = await run_in_threadpool(_start_tracing)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            _current.reset(token)
+            # サンプラーが stacks を書き終えてからレポートを作る
+            sampler.stopped.set()
+            await run_in_threadpool(sampler.join)
+            allocations = await run_in_threadpool(_stop_tracing, before)
+            report = build_report(profile, wall, cpu, allocations)
+            await run_in_threadpool(save_report, report)
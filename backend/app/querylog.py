@@ -0,0 +1,141 @@
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# 開発・ステージング用の設定(環境変数で有効化)
+QUERY_DEBUG_ENABLED = os.getenv("QUERY_DEBUG", "").lower() in ("1", "true", "yes")
+NPLUSONE_THRESHOLD = int(os.getenv("NPLUSONE_THRESHOLD", "5"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+RAISE_ON_NPLUSONE = os.getenv("NPLUSONE_RAISE", "").lower() in ("1", "true", "yes")
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_LIST = re.compile(r"\(\s*(?:\?|%\([^)]+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\([^)]+\)s|%s|:\w+))*\s*\)")
+
+
+class NPlusOneDetected(AssertionError):
+    """同じ形のSQLが閾値を超えて発行された場合の例外"""
+
+
+def normalize_statement(statement: str) -> str:
+    """リテラルやINリストの長さの違いを除いたSQLの形を求める"""
+    shape = _STRING_LITERAL.sub("?", statement)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _PARAM_LIST.sub("(...)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+class QueryTracker:
+    """1リクエスト(またはテスト)中に発行されたSQLを形ごとに集計"""
+
+    def __init__(self, threshold: int = NPLUSONE_THRESHOLD):
+        self.threshold = threshold
+        self.shapes: Counter = Counter()
+        self.slow: List[Dict] = []
+
+    def record(self, statement: str):
+        self.shapes[normalize_statement(statement)] += 1
+
+    def repeated(self) -> Dict[str, int]:
+        """閾値を超えて繰り返された形(N+1の疑い)"""
+        return {shape: count for shape, count in self.shapes.items() if count > self.threshold}
+
+    def assert_no_n_plus_one(self):
+        repeated = self.repeated()
+        if repeated:
+            details = "; ".join(f"{count}x {shape}" for shape, count in repeated.items())
+            raise NPlusOneDetected(f"N+1の疑いがあるSQLを検出しました: {details}")
+
+
+_tracker: ContextVar[Optional[QueryTracker]] = ContextVar("query_tracker", default=None)
+
+
+@contextmanager
+def track_queries(threshold: int = NPLUSONE_THRESHOLD):
+    """ブロック内のSQLを集計(テストで assert_no_n_plus_one と組み合わせて使う)"""
+    tracker = QueryTracker(threshold)
+    token = _tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _tracker.reset(token)
+
+
+def _explain(conn, statement: str, parameters) -> str:
+    """SELECT文の実行計画を取得"""
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return "\n".join(" ".join(str(col) for col in row) for row in cursor.fetchall())
+    except Exception as e:
+        return f"(EXPLAINに失敗しました: {e})"
+    finally:
+        cursor.close()
+
+
+def instrument_engine(engine):
+    """SQLの形の集計と遅いSQLのログ出力を行うイベントを登録"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("querylog_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["querylog_start"].pop()) * 1000
+        tracker = _tracker.get()
+        if tracker is not None:
+            tracker.record(statement)
+        if elapsed_ms < SLOW_QUERY_MS:
+            return
+        plan = ""
+        if not executemany and statement.lstrip().upper().startswith("SELECT"):
+            plan = _explain(conn, statement, parameters)
+        logger.warning("遅いSQL (%.1f ms): %s\n%s", elapsed_ms, _WHITESPACE.sub(" ", statement), plan)
+        if tracker is not None:
+            tracker.slow.append({"statement": statement, "elapsed_ms": elapsed_ms})
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        # 失敗したSQLでは after_cursor_execute が呼ばれないので、開始時刻を捨てておく
+        conn = context.connection
+        if conn is not None and conn.info.get("querylog_start"):
+            conn.info["querylog_start"].pop()
+
+
+class QueryDebugMiddleware:
+    """リクエストごとにN+1の疑いを検出してログ出力(設定により例外)"""
+
+    def __init__(self, app, raise_on_detect: bool = RAISE_ON_NPLUSONE):
+        self.app = app
+        self.raise_on_detect = raise_on_detect
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as tracker:
+
+            async def send_wrapper(message):
+                # レスポンスを送り始める前なら例外にできる(送信後に発行されたSQLはログだけ)
+                if message["type"] == "http.response.start" and self.raise_on_detect:
+                    tracker.assert_no_n_plus_one()
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                for shape, count in tracker.repeated().items():
+                    logger.warning("N+1の疑い %s %s: %d回 %s", scope["method"], scope["path"], count, shape)
@@ -0,0 +1,176 @@
+"""ボードの列内の並び順(辞書順で比較できる文字列のランク)
+
+ランクは 0-9a-z の文字列で、2つのランクの間には必ず別のランクを作れる(末尾を 0 にしない)。
+タスクを移動するときは前後のタスクのランクの間を取るので、更新するのは移動したタスクの1行だけ。
+列の末尾・先頭に置くときは最後の桁を1つ進める(戻す)だけなので、追加を繰り返してもほとんど伸びない。
+同じ位置への挿入を繰り返すとランクが長くなるので、RANK_MAX_LENGTH を超えた列は
+定期ジョブで均等な間隔に振り直す。
+
+並び替えは (project_id, status, rank) のインデックスで行う。
+"""
+import os
+from typing import List, Optional
+
+from sqlalchemy import bindparam, func, select, update
+
+from . import models, outbox
+
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+
+# これより長いランクがある列を振り直す
+RANK_MAX_LENGTH = int(os.getenv("RANK_MAX_LENGTH", "16"))
+RANK_REBALANCE_INTERVAL = float(os.getenv("RANK_REBALANCE_INTERVAL", "300"))
+# 1回のジョブで振り直す列数の上限(残りは次回に回す)
+RANK_REBALANCE_MAX_COLUMNS = int(os.getenv("RANK_REBALANCE_MAX_COLUMNS", "50"))
+
+tasks = models.Task.__table__
+
+
+def _midpoint(a: str, b: Optional[str]) -> str:
+    """a < b となる2つのランク(末尾は0でない)の間のランク。a="" は先頭、b=None は末尾"""
+    if b is not None:
+        # 共通の接頭辞はそのまま使う
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else "0") == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+    digit_a = DIGITS.index(a[0]) if a else 0
+    digit_b = DIGITS.index(b[0]) if b is not None else BASE
+    if digit_b - digit_a > 1:
+        return DIGITS[(digit_a + digit_b) // 2]
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[digit_a] + _midpoint(a[1:], None)
+
+
+def _encode(value: int, width: int) -> str:
+    digits = []
+    for _ in range(width):
+        value, digit = divmod(value, BASE)
+        digits.append(DIGITS[digit])
+    return "".join(reversed(digits))
+
+
+def rank_after(rank: str) -> str:
+    """rank の直後のランク(列の末尾への追加用)。最後の桁を進め、全桁が z のときだけ桁を足す"""
+    width = len(rank)
+    value = int(rank, BASE) + 1
+    if value % BASE == 0:
+        # 末尾が 0 のランクは作らない
+        value += 1
+    if value >= BASE ** width:
+        # 2桁足して、次に桁が足りなくなるまでの余裕を BASE**2 回分にする
+        return rank + "01"
+    return _encode(value, width)
+
+
+def rank_before(rank: str) -> str:
+    """rank の直前のランク(列の先頭への追加用)。最後の桁を戻し、それ以上戻せないときだけ桁を足す"""
+    width = len(rank)
+    value = int(rank, BASE) - 1
+    if value % BASE == 0:
+        value -= 1
+    if value <= 0:
+        return "0" * width + "zz"
+    return _encode(value, width)
+
+
+def rank_between(before: Optional[str], after: Optional[str]) -> str:
+    """before と after の間のランク(None はそれぞれ列の先頭・末尾)"""
+    if before is not None and after is not None and before >= after:
+        raise ValueError(f"rank {before!r} is not before {after!r}")
+    if before is not None and after is None:
+        return rank_after(before)
+    if before is None and after is not None:
+        return rank_before(after)
+    return _midpoint(before or "", after)
+
+
+def spread_ranks(count: int) -> List[str]:
+    """count 件分の等間隔なランク(同じ長さなので前後にも間にも挿入しやすい)"""
+    width = 1
+    while BASE ** width < (count + 1) * BASE:
+        width += 1
+    step = BASE ** width // (count + 1)
+    ranks = []
+    for i in range(1, count + 1):
+        rank = _encode(i * step, width)
+        ranks.append(rank + "i" if rank.endswith("0") else rank)
+    return ranks
+
+
+def _column(project_id: Optional[int], status: Optional[str]):
+    return (
+        tasks.c.project_id.is_(None) if project_id is None else tasks.c.project_id == project_id,
+        tasks.c.status.is_(None) if status is None else tasks.c.status == status,
+    )
+
+
+def last_rank(db, project_id: Optional[int], status: Optional[str]) -> Optional[str]:
+    """列の末尾のランク"""
+    return db.execute(select(func.max(tasks.c.rank)).where(*_column(project_id, status))).scalar()
+
+
+def append_rank(db, project_id: Optional[int], status: Optional[str]) -> str:
+    """列の末尾に追加するときのランク"""
+    return rank_between(last_rank(db, project_id, status), None)
+
+
+def neighbor_rank(db, project_id: Optional[int], status: Optional[str], rank: Optional[str],
+                  exclude_id: int, after: bool) -> Optional[str]:
+    """rank の直後(after=True)または直前のランク(rank=None なら列の先頭・末尾)"""
+    query = select(tasks.c.rank).where(
+        *_column(project_id, status), tasks.c.id != exclude_id, tasks.c.rank.isnot(None)
+    )
+    if after:
+        if rank is not None:
+            query = query.where(tasks.c.rank > rank)
+        query = query.order_by(tasks.c.rank)
+    else:
+        if rank is not None:
+            query = query.where(tasks.c.rank < rank)
+        query = query.order_by(tasks.c.rank.desc())
+    return db.execute(query.limit(1)).scalar()
+
+
+def rebalance_column(db, project_id: Optional[int], status: Optional[str], notify: bool = True) -> int:
+    """列のランクを現在の並び順のまま等間隔に振り直し、件数を返す(コミットは呼び出し側)"""
+    ids = list(db.execute(
+        select(tasks.c.id).where(*_column(project_id, status))
+        .order_by(tasks.c.rank, tasks.c.id).with_for_update()
+    ).scalars())
+    if ids:
+        db.execute(
+            update(tasks).where(tasks.c.id == bindparam("task_id")).values(rank=bindparam("new_rank")),
+            [{"task_id": task_id, "new_rank": rank} for task_id, rank in zip(ids, spread_ranks(len(ids)))],
+        )
+        if notify:
+            # クライアントが持っているランクが古くなるので列ごと取り直してもらう
+            outbox.enqueue_emit(db, 'task_update', 'column_rebalanced',
+                                {'project_id': project_id, 'status': status}, f"project:{project_id}")
+    return len(ids)
+
+
+def rebalance_dense_columns(db, max_length: int = RANK_MAX_LENGTH,
+                            max_columns: int = RANK_REBALANCE_MAX_COLUMNS) -> int:
+    """ランクが長くなりすぎた列(とランクの無いタスクがある列)を振り直し、列数を返す"""
+    columns = db.execute(
+        select(tasks.c.project_id, tasks.c.status)
+        .where((func.length(tasks.c.rank) > max_length) | tasks.c.rank.is_(None))
+        .group_by(tasks.c.project_id, tasks.c.status)
+        .limit(max_columns)
+    ).all()
+    for project_id, status in columns:
+        rebalance_column(db, project_id, status)
+        db.commit()
+    return len(columns)
+
+
+def rebalance_all(db) -> int:
+    """全ての列を振り直す(マイグレーションでの初期値の設定用)"""
+    columns = db.execute(select(tasks.c.project_id, tasks.c.status).distinct()).all()
+    for project_id, status in columns:
+        rebalance_column(db, project_id, status, notify=False)
+    return len(columns)
@@ -0,0 +1,214 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from jose import JWTError, jwt
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics
+from .auth import ALGORITHM, SECRET_KEY
+
+# レート制限の設定
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")  # memory / postgres
+# X-Forwarded-For を信用するのは、アプリの前に自前のリバースプロキシがある場合だけ
+# (先頭の要素はクライアントが自由に書けるので、信用すると制限を回避される)
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() in ("1", "true", "yes")
+# 前段にある信用するプロキシの数。X-Forwarded-For の右からこの番目をクライアントのアドレスとみなす
+TRUSTED_PROXY_HOPS = max(1, int(os.getenv("TRUSTED_PROXY_HOPS", "1")))
+
+# 同時実行数の上限(超えた分は待たせ、待ちきれなければ503)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "32"))
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", "64"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUEUE_TIMEOUT_SECONDS", "5"))
+ADMISSION_EXEMPT_PATHS = ("/health", "/metrics")
+
+# ルートごとの予算: 名前 -> (バケット容量, 1秒あたりの補充量)
+ROUTE_BUDGETS: Dict[str, Tuple[float, float]] = {
+    "login": (10, 10 / 60),
+    "register": (5, 5 / 60),
+    "search": (30, 30 / 60),
+    "check_due_dates": (6, 6 / 60),
+    "upload_avatar": (10, 10 / 60),
+    # 分割アップロードは1ファイルで何度も呼ばれる
+    "upload_attachment": (120, 2),
+}
+
+
+class MemoryStore:
+    """プロセス内のトークンバケット(単一ワーカー向け)"""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        """トークンを1つ消費し、足りなければ再試行までの秒数を返す(0なら許可)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._evict()
+        return 0.0 if allowed else (1 - tokens) / rate
+
+    def _evict(self):
+        # 長く使われていないバケットから捨てる(満タンに戻っているはずのもの)
+        for key, _ in sorted(self._buckets.items(), key=lambda item: item[1][1])[: self.max_keys // 10]:
+            del self._buckets[key]
+
+
+class PostgresStore:
+    """複数ワーカーで共有するPostgres上のトークンバケット"""
+
+    TAKE_SQL = text("""
+        INSERT INTO rate_limit_buckets (key, tokens, updated_at)
+        VALUES (:key, :capacity - 1, :now)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = GREATEST(
+                LEAST(:capacity, rate_limit_buckets.tokens + (:now - rate_limit_buckets.updated_at) * :rate) - 1,
+                -1
+            ),
+            updated_at = :now
+        RETURNING tokens
+    """)
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        with self.engine.begin() as conn:
+            tokens = conn.execute(
+                self.TAKE_SQL, {"key": key, "capacity": capacity, "rate": rate, "now": time.time()}
+            ).scalar()
+        if tokens >= 0:
+            return 0.0
+        return -tokens / rate
+
+
+_store = None
+
+
+def get_store():
+    """設定に応じたバケットの保存先を取得"""
+    global _store
+    if _store is None:
+        if RATE_LIMIT_STORE == "postgres":
+            from .database import engine
+            _store = PostgresStore(engine)
+        else:
+            _store = MemoryStore()
+    return _store
+
+
+def client_address(request: Request) -> str:
+    """クライアントのIPアドレス(信用するプロキシが付けた X-Forwarded-For の要素だけを使う)"""
+    peer = request.client.host if request.client else "unknown"
+    if TRUST_PROXY_HEADERS:
+        forwarded = [entry.strip() for entry in request.headers.get("x-forwarded-for", "").split(",")]
+        forwarded = [entry for entry in forwarded if entry]
+        # 各プロキシは右端に追加するので、右から数えた要素だけがプロキシの書いた値
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+    return peer
+
+
+def client_key(request: Request) -> str:
+    """ログイン済みならユーザー、そうでなければIPアドレスをキーにする"""
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}"
+        except JWTError:
+            pass
+    return f"ip:{client_address(request)}"
+
+
+def rate_limit(budget: str):
+    """ルートに予算を割り当てる依存関数を作成"""
+    capacity, rate = ROUTE_BUDGETS[budget]
+
+    async def dependency(request: Request):
+        if not RATE_LIMIT_ENABLED:
+            return
+        store = get_store()
+        key = f"{budget}:{client_key(request)}"
+        if isinstance(store, MemoryStore):
+            retry_after = store.take(key, capacity, rate)
+        else:
+            retry_after = await run_in_threadpool(store.take, key, capacity, rate)
+        if retry_after > 0:
+            metrics.RATE_LIMITED.inc(budget)
+            raise HTTPException(
+                status_code=429,
+                detail="リクエストが多すぎます。しばらくしてから再試行してください",
+                headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+            )
+
+    return dependency
+
+
+class AdmissionControlMiddleware:
+    """同時実行数を制限し、溢れたリクエストは待ち行列が一杯または待ち時間切れで503を返す"""
+
+    def __init__(
+        self,
+        app,
+        max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+        max_queued: int = MAX_QUEUED_REQUESTS,
+        queue_timeout: float = QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.app = app
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._max_concurrent = max_concurrent
+        self._queued = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(ADMISSION_EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrent)
+
+        if self._semaphore.locked():
+            if self._queued >= self.max_queued:
+                await self._shed(scope, receive, send)
+                return
+            self._queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                await self._shed(scope, receive, send)
+                return
+            finally:
+                self._queued -= 1
+        else:
+            await self._semaphore.acquire()
+
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec()
+            self._semaphore.release()
+
+    async def _shed(self, scope, receive, send):
+        metrics.REQUESTS_SHED.inc()
+        response = JSONResponse(
+            status_code=503,
+            content={"detail": "サーバーが混み合っています。しばらくしてから再試行してください"},
+            headers={"Retry-After": "1"},
+        )
+        await response(scope, receive, send)
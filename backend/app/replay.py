@@ -0,0 +1,105 @@
+"""Socket.IO の再接続時リプレイ
+
+ルームごとに直近のイベントを連番付きでリングバッファに残し、再接続したクライアントが
+最後に受け取った連番を送ると、取りこぼした分だけを送り直す。バッファから溢れていれば
+(またはサーバーが再起動して epoch が変わっていれば)全件の再取得を指示する。
+
+今のアプリはルームを使わず全クライアントへ送っている(アウトボックスからの送信も room=None)ので、
+バッファは BROADCAST_ROOM の1つだけになる。ルームを指定して送ればルームごとのバッファを使う。
+"""
+import json
+import os
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from . import metrics
+
+# ルームごとのバッファ上限(件数とバイト数の両方)
+REPLAY_BUFFER_EVENTS = int(os.getenv("REPLAY_BUFFER_EVENTS", "500"))
+REPLAY_BUFFER_BYTES = int(os.getenv("REPLAY_BUFFER_BYTES", str(256 * 1024)))
+
+# 全クライアントへの送信を入れるルーム名
+BROADCAST_ROOM = "*"
+
+
+class RoomBuffer:
+    """1ルーム分のリングバッファ: (連番, イベント名, シリアライズ済みペイロード)"""
+
+    def __init__(self, max_events: int = REPLAY_BUFFER_EVENTS, max_bytes: int = REPLAY_BUFFER_BYTES):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.seq = 0
+        self.bytes = 0
+        self._events: Deque[Tuple[int, str, str]] = deque()
+
+    def append(self, event: str, body: str) -> int:
+        self.seq += 1
+        self._events.append((self.seq, event, body))
+        self.bytes += len(body)
+        while self._events and (len(self._events) > self.max_events or self.bytes > self.max_bytes):
+            _, _, dropped = self._events.popleft()
+            self.bytes -= len(dropped)
+        return self.seq
+
+    def since(self, last_seq: int) -> Optional[List[Tuple[int, str, str]]]:
+        """last_seqより後のイベント(取りこぼしがバッファより多ければNone)"""
+        if last_seq > self.seq:
+            return None
+        oldest = self._events[0][0] if self._events else self.seq + 1
+        if last_seq + 1 < oldest:
+            return None
+        return [item for item in self._events if item[0] > last_seq]
+
+    def __len__(self):
+        return len(self._events)
+
+
+class ReplayHub:
+    """送信をバッファに記録しつつ行い、再接続時に取りこぼし分を送り直す"""
+
+    def __init__(self, sio, max_events: int = REPLAY_BUFFER_EVENTS, max_bytes: int = REPLAY_BUFFER_BYTES):
+        self.sio = sio
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        # プロセスごとの識別子(再起動で連番がリセットされたことをクライアントが判別する)
+        self.epoch = uuid.uuid4().hex[:12]
+        self.rooms: Dict[str, RoomBuffer] = {}
+
+    def _buffer(self, room: str) -> RoomBuffer:
+        buffer = self.rooms.get(room)
+        if buffer is None:
+            buffer = self.rooms[room] = RoomBuffer(self.max_events, self.max_bytes)
+        return buffer
+
+    async def emit(self, event: str, data: dict, room: Optional[str] = None):
+        """連番を付けて送信(room=Noneは全クライアント)"""
+        name = room or BROADCAST_ROOM
+        buffer = self._buffer(name)
+        data = dict(data, room=name, epoch=self.epoch, seq=buffer.seq + 1)
+        body = json.dumps(data, ensure_ascii=False)
+        buffer.append(event, body)
+        metrics.REPLAY_BUFFERED_EVENTS.set(name, value=len(buffer))
+        metrics.REPLAY_BUFFERED_BYTES.set(name, value=buffer.bytes)
+        await self.sio.emit(event, data, room=room)
+
+    def position(self, room: Optional[str] = None) -> dict:
+        """現在の epoch と最新の連番"""
+        buffer = self.rooms.get(room or BROADCAST_ROOM)
+        return {"epoch": self.epoch, "seq": buffer.seq if buffer else 0}
+
+    async def resume(self, sid: str, epoch: Optional[str], last_seq: Optional[int], room: Optional[str] = None) -> dict:
+        """取りこぼしたイベントをsidにだけ順に送り直す"""
+        # クライアントが指定したルーム名でバッファを作らない
+        buffer = self.rooms.get(room or BROADCAST_ROOM) or RoomBuffer(self.max_events, self.max_bytes)
+        missed = None
+        if epoch == self.epoch and isinstance(last_seq, int):
+            missed = buffer.since(last_seq)
+        if missed is None:
+            metrics.REPLAY_REQUESTS.inc("resync")
+            return dict(self.position(room), status="resync")
+        for _, event, body in missed:
+            await self.sio.emit(event, json.loads(body), to=sid)
+        metrics.REPLAY_REQUESTS.inc("replayed" if missed else "up_to_date")
+        metrics.REPLAY_EVENTS.inc(amount=len(missed))
+        return dict(self.position(room), status="ok", replayed=len(missed))
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# バックグラウンドジョブを動かすか(複数ワーカーでも冪等なジョブのみ登録する)
+BACKGROUND_JOBS_ENABLED = os.getenv("BACKGROUND_JOBS", "true").lower() in ("1", "true", "yes")
+
+
+class PeriodicJob:
+    """一定間隔で実行するジョブ(関数は新しいDBセッションを受け取り、スレッドプールで実行)"""
+
+    def __init__(self, name: str, interval: float, func: Callable, initial_delay: float = 0):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.initial_delay = initial_delay
+        self._task: Optional[asyncio.Task] = None
+
+    def run_once(self):
+        db = SessionLocal()
+        try:
+            return self.func(db)
+        finally:
+            db.close()
+
+    async def _loop(self):
+        await asyncio.sleep(self.initial_delay)
+        while True:
+            start = time.perf_counter()
+            try:
+                await run_in_threadpool(self.run_once)
+                metrics.JOB_RUNS.inc(self.name, "ok")
+            except Exception:
+                metrics.JOB_RUNS.inc(self.name, "error")
+                logger.exception("バックグラウンドジョブ %s が失敗しました", self.name)
+            metrics.JOB_DURATION.observe(self.name, value=time.perf_counter() - start)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name=f"job:{self.name}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+JOBS: List[PeriodicJob] = []
+
+
+def register(name: str, interval: float, func: Callable, initial_delay: float = 0) -> PeriodicJob:
+    """定期ジョブを登録"""
+    job = PeriodicJob(name, interval, func, initial_delay)
+    JOBS.append(job)
+    return job
+
+
+def start_all():
+    """登録済みのジョブを開始"""
+    if not BACKGROUND_JOBS_ENABLED:
+        return
+    for job in JOBS:
+        job.start()
+
+
+async def stop_all():
+    """登録済みのジョブを停止"""
+    for job in JOBS:
+        await job.stop()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 # ユーザー関連
@@ -64,6 +64,7 @@ class TaskBase(BaseModel):
     start_time: Optional[str] = None
     end_time: Optional[str] = None
     project_id: Optional[int] = None
+    parent_id: Optional[int] = None
 
 class TaskCreate(TaskBase):
     assignee_id: Optional[int] = None
@@ -78,15 +79,42 @@ class TaskUpdate(BaseModel):
     end_time: Optional[str] = None
     assignee_id: Optional[int] = None
     project_id: Optional[int] = None
+    parent_id: Optional[int] = None  # null で親から外す
+
+class TaskMove(BaseModel):
+    """ボード上の移動先(after_id の直後・before_id の直前。どちらも無ければ列の末尾)"""
+    status: Optional[str] = None
+    after_id: Optional[int] = None
+    before_id: Optional[int] = None
 
 class Task(TaskBase):
     id: int
     assignee_id: Optional[int] = None
     created_at: datetime
+    rank: Optional[str] = None
+    attachments: Optional[int] = None
+    subtasks_total: Optional[int] = None
+    subtasks_done: Optional[int] = None
 
     class Config:
         from_attributes = True
 
+class TaskNode(Task):
+    """階層の中のタスク(depth は起点からの深さ)"""
+    depth: int
+
+class TaskDependencyCreate(BaseModel):
+    depends_on_id: int
+
+class TaskDependency(BaseModel):
+    task_id: int
+    depends_on_id: int
+
+class TaskHierarchy(BaseModel):
+    """親が子より先に並んだタスクと、その間の依存関係"""
+    tasks: List[TaskNode]
+    dependencies: List[TaskDependency]
+
 # コメント
 class CommentBase(BaseModel):
     content: str
@@ -118,7 +146,113 @@ class Notification(NotificationBase):
     user_id: int
     task_id: Optional[int] = None
     is_read: bool
+    event_count: int = 1
+    first_created_at: Optional[datetime] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+# アーカイブ
+class ArchivedTask(TaskBase):
+    id: int
+    assignee_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    archived_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class ArchivedNotification(Notification):
+    archived_at: datetime
+
+# カレンダー(日ごとの集計)
+class CalendarDay(BaseModel):
+    date: str
+    total: int
+    counts: Dict[str, int]
+
+# バックグラウンドジョブ
+class Job(BaseModel):
+    id: int
+    kind: str
+    status: str
+    step: Optional[str] = None
+    steps_done: int
+    steps_total: int
+    progress: Dict[str, int]
+    attempts: int
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+# タスクの変更履歴
+class TaskActivity(BaseModel):
+    id: int
+    task_id: int
+    user_id: Optional[int] = None
+    action: str
+    changes: Dict[str, List[Any]]
+    edits: int
     created_at: datetime
 
+class TaskTimeline(BaseModel):
+    items: List[TaskActivity]
+    next_cursor: Optional[str] = None
+
+# 一括実行
+class BatchRequestItem(BaseModel):
+    id: Optional[str] = None  # 結果との対応付け用(任意)
+    method: str = "GET"
+    path: str                 # /api/ から始まるパス(クエリ文字列を含めてもよい)
+    params: Optional[Dict[str, Any]] = None
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchRequestItem]
+
+class BatchResponseItem(BaseModel):
+    id: Optional[str] = None
+    status: int
+    body: Optional[Any] = None
+
+class BatchResponse(BaseModel):
+    responses: List[BatchResponseItem]
+
+# 添付ファイル
+class AttachmentUploadCreate(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None
+    sha256: Optional[str] = None
+
+class Attachment(BaseModel):
+    id: int
+    task_id: int
+    user_id: Optional[int] = None
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+    created_at: Optional[datetime] = None
+
     class Config:
         from_attributes = True
+
+class AttachmentUploadStatus(BaseModel):
+    upload_id: Optional[str] = None
+    offset: int
+    size: int
+    chunk_size: int
+    complete: bool
+    attachment: Optional[Attachment] = None
+
+# ダッシュボード集計
+class TaskStats(BaseModel):
+    scope: str
+    id: int
+    total: int
+    overdue: int
+    by_status: Dict[str, int]
+    by_priority: Dict[str, int]
@@ -0,0 +1,218 @@
+"""タスク集計(ダッシュボード用)
+
+task_stats にプロジェクト・担当者ごとの (ステータス, 優先度) 別件数と期限切れ件数を持ち、
+タスクの書き込みと同じトランザクションで差分を反映する。ずれた場合は作り直す。
+
+    python -m app.stats rebuild          # 集計を作り直す
+    python -m app.stats refresh-overdue  # is_overdue を一括で再計算
+"""
+import os
+import sys
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import and_, case, delete, func, insert, literal, not_, or_, select, update
+
+from . import models
+
+# 期限切れフラグを再計算する間隔(秒)
+OVERDUE_REFRESH_INTERVAL = float(os.getenv("OVERDUE_REFRESH_INTERVAL", "300"))
+
+SCOPES = ("project", "user")
+
+# (project_id, assignee_id, status, priority, is_overdue)
+TaskKey = Tuple[Optional[int], Optional[int], str, str, bool]
+
+task_stats = models.TaskStat.__table__
+Task = models.Task
+
+
+def compute_overdue(due_date: Optional[str], status: Optional[str], today: Optional[str] = None) -> bool:
+    """期限日が過ぎていて未完了なら期限切れ"""
+    if not due_date or status == models.TaskStatus.DONE.value:
+        return False
+    return due_date < (today or date.today().isoformat())
+
+
+def overdue_condition(today: str):
+    """compute_overdue と同じ条件のSQL式"""
+    return and_(
+        Task.due_date.isnot(None),
+        Task.due_date != "",
+        Task.due_date < today,
+        or_(Task.status.is_(None), Task.status != models.TaskStatus.DONE.value),
+    )
+
+
+def task_key(task) -> TaskKey:
+    """集計に効くタスクの属性"""
+    return (task.project_id, task.assignee_id, task.status or "", task.priority or "", bool(task.is_overdue))
+
+
+def _upsert(db, scope: str, scope_id: int, status: str, priority: str, count: int, overdue: int):
+    values = {"scope": scope, "scope_id": scope_id, "status": status, "priority": priority,
+              "count": count, "overdue": overdue}
+    # Session でも(マイグレーションの)Connection でも使えるようにする
+    dialect = (db.get_bind() if hasattr(db, "get_bind") else db).dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(task_stats).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["scope", "scope_id", "status", "priority"],
+            set_={"count": task_stats.c.count + stmt.excluded.count,
+                  "overdue": task_stats.c.overdue + stmt.excluded.overdue},
+        )
+        db.execute(stmt)
+        return
+
+    result = db.execute(
+        update(task_stats)
+        .where(task_stats.c.scope == scope, task_stats.c.scope_id == scope_id,
+               task_stats.c.status == status, task_stats.c.priority == priority)
+        .values(count=task_stats.c.count + count, overdue=task_stats.c.overdue + overdue)
+    )
+    if result.rowcount == 0:
+        db.execute(insert(task_stats).values(**values))
+
+
+def apply_delta(db, key: TaskKey, count: int, overdue: Optional[int] = None):
+    """集計にタスクcount件分の増減を反映"""
+    project_id, assignee_id, status, priority, is_overdue = key
+    if overdue is None:
+        overdue = count if is_overdue else 0
+    for scope, scope_id in zip(SCOPES, (project_id, assignee_id)):
+        if scope_id is not None:
+            _upsert(db, scope, scope_id, status, priority, count, overdue)
+
+
+def record_change(db, old: Optional[TaskKey], new: Optional[TaskKey]):
+    """タスクの作成(old=None)・更新・削除(new=None)を集計に反映"""
+    if old == new:
+        return
+    if old is not None:
+        apply_delta(db, old, -1)
+    if new is not None:
+        apply_delta(db, new, 1)
+
+
+def _group_columns():
+    return (Task.project_id, Task.assignee_id,
+            func.coalesce(Task.status, ""), func.coalesce(Task.priority, ""))
+
+
+def _apply_tasks(db, sign: int, criteria):
+    overdue_count = func.sum(case((Task.is_overdue == True, 1), else_=0))  # noqa: E712
+    rows = db.execute(
+        select(*_group_columns(), func.count(Task.id), overdue_count)
+        .where(*criteria)
+        .group_by(*_group_columns())
+    ).all()
+    for project_id, assignee_id, status, priority, count, overdue in rows:
+        apply_delta(db, (project_id, assignee_id, status, priority, False), sign * count, sign * int(overdue or 0))
+
+
+def remove_tasks(db, *criteria):
+    """一括削除・一括更新の前に、条件に合うタスクの分を集計から差し引く"""
+    _apply_tasks(db, -1, criteria)
+
+
+def add_tasks(db, *criteria):
+    """一括更新の後に、条件に合うタスクの分を集計に足す"""
+    _apply_tasks(db, 1, criteria)
+
+
+def refresh_overdue(db, today: Optional[str] = None) -> int:
+    """is_overdue を一括で再計算し、変わった分を集計に反映(変更件数を返す)"""
+    today = today or date.today().isoformat()
+    should_be = overdue_condition(today)
+    is_flagged = Task.is_overdue == True  # noqa: E712
+    changed = 0
+    for flag, condition in ((True, and_(should_be, or_(Task.is_overdue.is_(None), not_(is_flagged)))),
+                            (False, and_(is_flagged, not_(should_be)))):
+        # 行ごとに変更前の集計キーを取り、同時更新とずれないようにする
+        rows = db.execute(
+            update(Task).where(condition).values(is_overdue=flag)
+            .returning(*_group_columns())
+            .execution_options(synchronize_session=False)
+        ).all()
+        deltas: Dict[tuple, int] = {}
+        for row in rows:
+            deltas[tuple(row)] = deltas.get(tuple(row), 0) + 1
+        for (project_id, assignee_id, status, priority), count in deltas.items():
+            apply_delta(db, (project_id, assignee_id, status, priority, flag), 0, count if flag else -count)
+        changed += len(rows)
+    return changed
+
+
+def rebuild(db):
+    """tasks から集計を作り直す"""
+    db.execute(delete(task_stats))
+    overdue_count = func.sum(case((Task.is_overdue == True, 1), else_=0))  # noqa: E712
+    status, priority = func.coalesce(Task.status, ""), func.coalesce(Task.priority, "")
+    for scope, scope_column in zip(SCOPES, (Task.project_id, Task.assignee_id)):
+        db.execute(
+            insert(task_stats).from_select(
+                ["scope", "scope_id", "status", "priority", "count", "overdue"],
+                select(literal(scope), scope_column, status, priority, func.count(Task.id), overdue_count)
+                .where(scope_column.isnot(None))
+                .group_by(scope_column, status, priority),
+            )
+        )
+
+
+def refresh_overdue_job(db):
+    """定期実行用: 期限切れフラグを更新してコミット"""
+    refresh_overdue(db)
+    db.commit()
+
+
+def get_summary(db, scope: str, scope_id: int) -> dict:
+    """集計行(ステータス×優先度の数行)からダッシュボード用の数値を作成"""
+    rows = db.execute(
+        select(task_stats.c.status, task_stats.c.priority, task_stats.c.count, task_stats.c.overdue)
+        .where(task_stats.c.scope == scope, task_stats.c.scope_id == scope_id)
+    ).all()
+    by_status: Dict[str, int] = {}
+    by_priority: Dict[str, int] = {}
+    total = overdue = 0
+    for status, priority, count, overdue_count in rows:
+        if count == 0:
+            continue
+        by_status[status] = by_status.get(status, 0) + count
+        by_priority[priority] = by_priority.get(priority, 0) + count
+        total += count
+        overdue += overdue_count
+    return {
+        "scope": scope,
+        "id": scope_id,
+        "total": total,
+        "overdue": overdue,
+        "by_status": by_status,
+        "by_priority": by_priority,
+    }
+
+
+def _run(commands: Iterable[str]):
+    from .database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        for command in commands:
+            if command == "rebuild":
+                refresh_overdue(db)
+                rebuild(db)
+                print("Rebuilt task_stats")
+            elif command == "refresh-overdue":
+                print(f"Updated is_overdue on {refresh_overdue(db)} tasks")
+            else:
+                raise SystemExit(f"unknown command: {command} (rebuild / refresh-overdue)")
+        db.commit()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    _run(sys.argv[1:] or ["rebuild"])
@@ -0,0 +1,277 @@
+import hashlib
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+# 旧形式(UUID)とハッシュ形式のファイル名のみ許可
+SAFE_NAME_PATTERN = re.compile(r"^(?:[0-9a-f]{32}_\d+\.(?:jpg|webp)|[0-9a-f\-]{36}\.[A-Za-z0-9]{1,5})$")
+# 添付ファイルの保存名(sha256)と受信中のファイル名(UUID)
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# 画像の保存先("local": ローカルディスク / "memory": プロセス内のオブジェクトストア)
+AVATAR_STORAGE = os.getenv("AVATAR_STORAGE", "local").lower()
+
+
+def safe_filename(filename: str) -> Optional[str]:
+    """パストラバーサルを防ぐためファイル名を検証(不正ならNone)"""
+    if not filename or os.path.basename(filename) != filename:
+        return None
+    if not SAFE_NAME_PATTERN.match(filename):
+        return None
+    return filename
+
+
+class Storage(ABC):
+    """画像保存先のインターフェース"""
+
+    @abstractmethod
+    def save(self, name: str, data: bytes):
+        ...
+
+    @abstractmethod
+    def load(self, name: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def exists(self, name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, name: str):
+        ...
+
+    def local_path(self, name: str) -> Optional[str]:
+        """ローカルファイルとして配信できる場合はそのパスを返す"""
+        return None
+
+
+class LocalStorage(Storage):
+    """ローカルディスクへの保存"""
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        path = os.path.realpath(os.path.join(self.root, name))
+        if os.path.dirname(path) != self.root:
+            raise ValueError(f"不正なファイル名です: {name}")
+        return path
+
+    def save(self, name: str, data: bytes):
+        path = self._path(name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def delete(self, name: str):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, name: str) -> Optional[str]:
+        path = self._path(name)
+        return path if os.path.exists(path) else None
+
+
+class MemoryObjectStorage(Storage):
+    """S3と同じ形(バケット内のキー、ETag、put/get/head)のプロセス内オブジェクトストア
+
+    外部のサービスを使わずにオブジェクトストア経由の配信(local_path を持たない保存先)を確認するためのもの。
+    キーは "<prefix>/<ファイル名>"、ETag は内容のMD5(S3の単一パートのアップロードと同じ)。
+    """
+
+    def __init__(self, bucket: str = "avatars", prefix: str = "avatars"):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._objects: Dict[str, Tuple[bytes, str, datetime]] = {}
+        self._lock = threading.Lock()
+
+    def key(self, name: str) -> str:
+        if not name or os.path.basename(name) != name:
+            raise ValueError(f"不正なファイル名です: {name}")
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def put_object(self, key: str, data: bytes) -> str:
+        """オブジェクトを保存して ETag を返す"""
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        with self._lock:
+            self._objects[key] = (bytes(data), etag, datetime.utcnow())
+        return etag
+
+    def get_object(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._objects.get(key)
+        if item is None:
+            return None
+        data, etag, last_modified = item
+        return {"Body": data, "ETag": etag, "ContentLength": len(data), "LastModified": last_modified}
+
+    def head_object(self, key: str) -> Optional[dict]:
+        """本体を除いたメタデータ(無ければNone)"""
+        item = self.get_object(key)
+        if item is not None:
+            del item["Body"]
+        return item
+
+    def delete_object(self, key: str):
+        with self._lock:
+            self._objects.pop(key, None)
+
+    def save(self, name: str, data: bytes):
+        self.put_object(self.key(name), data)
+
+    def load(self, name: str) -> Optional[bytes]:
+        item = self.get_object(self.key(name))
+        return item["Body"] if item else None
+
+    def exists(self, name: str) -> bool:
+        return self.head_object(self.key(name)) is not None
+
+    def delete(self, name: str):
+        self.delete_object(self.key(name))
+
+
+class LocalBlobStore:
+    """大きなファイルを少しずつ書き込むローカルディスクの保存先(添付ファイル用)
+
+    完成したファイルは blobs/<sha256の先頭2文字>/<sha256>、受信中のファイルは partial/<アップロードID> に置く。
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+        self.blob_root = os.path.join(self.root, "blobs")
+        self.partial_root = os.path.join(self.root, "partial")
+        os.makedirs(self.blob_root, exist_ok=True)
+        os.makedirs(self.partial_root, exist_ok=True)
+
+    def blob_path(self, digest: str) -> str:
+        if not HASH_PATTERN.match(digest):
+            raise ValueError(f"不正なハッシュです: {digest}")
+        return os.path.join(self.blob_root, digest[:2], digest)
+
+    def partial_path(self, upload_id: str) -> str:
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            raise ValueError(f"不正なアップロードIDです: {upload_id}")
+        return os.path.join(self.partial_root, upload_id)
+
+    def has_blob(self, digest: str) -> bool:
+        return os.path.exists(self.blob_path(digest))
+
+    def open_partial(self, upload_id: str, offset: int):
+        """受信中のファイルを offset の位置から書き込めるように開く(それより後ろは切り捨てる)"""
+        path = self.partial_path(upload_id)
+        f = open(path, "r+b" if os.path.exists(path) else "wb")
+        f.truncate(offset)
+        f.seek(offset)
+        return f
+
+    def read_partial(self, upload_id: str, length: int, chunk_size: int = 1024 * 1024):
+        """受信中のファイルの先頭 length バイトを少しずつ読む"""
+        with open(self.partial_path(upload_id), "rb") as f:
+            while length > 0:
+                chunk = f.read(min(chunk_size, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
+
+    def commit_partial(self, upload_id: str, digest: str) -> bool:
+        """受信したファイルをハッシュの名前で保存(同じ内容が保存済みなら捨ててFalseを返す)"""
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            self.delete_partial(upload_id)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.partial_path(upload_id), path)
+        return True
+
+    def delete_partial(self, upload_id: str):
+        try:
+            os.remove(self.partial_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+    def delete_blob(self, digest: str):
+        try:
+            os.remove(self.blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def iter_blobs(self):
+        """保存済みのファイルの (ハッシュ, 更新日時)"""
+        for prefix in os.listdir(self.blob_root):
+            directory = os.path.join(self.blob_root, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if HASH_PATTERN.match(name):
+                    yield name, os.path.getmtime(os.path.join(directory, name))
+
+
+class BytesLRU:
+    """小さな画像をメモリに保持するLRUキャッシュ(合計バイト数で上限)"""
+
+    def __init__(self, max_bytes: int, max_item_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_item_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old)
+            self._items[key] = data
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def discard(self, key: str):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old)
+
+
+def create_storage(root: str, backend: str = AVATAR_STORAGE) -> Storage:
+    """画像の保存先を作成(AVATAR_STORAGE で選択)"""
+    if backend == "local":
+        return LocalStorage(root)
+    if backend == "memory":
+        return MemoryObjectStorage()
+    raise ValueError(f"不明な AVATAR_STORAGE です: {backend}")
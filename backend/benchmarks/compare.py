@@ -0,0 +1,41 @@
+"""保存したベンチマーク結果を比較
+
+    python -m benchmarks.compare results/before.json results/after.json
+"""
+import argparse
+import json
+from pathlib import Path
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request")
+
+
+def change(before, after) -> str:
+    if before is None or after is None:
+        return "-"
+    if before == 0:
+        return f"{after:.1f}"
+    return f"{before:.1f}->{after:.1f} ({(after - before) / before * 100:+.0f}%)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    args = parser.parse_args()
+
+    before = json.loads(args.before.read_text(encoding="utf-8"))
+    after = json.loads(args.after.read_text(encoding="utf-8"))
+    print(f"before={before['commit']} ({before['mode']})  after={after['commit']} ({after['mode']})")
+
+    rows = [("overall", before["overall"], after["overall"])]
+    for name, stats in after["operations"].items():
+        rows.append((name, before["operations"].get(name, {}), stats))
+    for name, old, new in rows:
+        print(name)
+        for metric in METRICS:
+            if metric in old or metric in new:
+                print(f"  {metric:<20}{change(old.get(metric), new.get(metric))}")
+
+
+if __name__ == "__main__":
+    main()
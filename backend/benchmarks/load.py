@@ -0,0 +1,320 @@
+"""APIとSocket.IOの負荷試験
+
+    python -m benchmarks.load --mode asgi --duration 20 --concurrency 16
+    python -m benchmarks.load --mode uvicorn --socket-clients 50
+
+結果は benchmarks/results/ にJSONで保存され、benchmarks.compare で比較できる。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./bench.db")
+# 少数のユーザーで大量に叩くのでレート制限は無効にして計測する
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import httpx
+
+from benchmarks import seed as seeding
+
+RESULTS_DIR = Path(__file__).parent / "results"
+_METRIC_LINE = re.compile(r'^(db_queries_per_request_(?:sum|count))\{method="(\w+)",route="([^"]+)"\} ([0-9.e+-]+)$')
+
+
+@dataclass
+class Operation:
+    """負荷試験で実行するリクエストの種類"""
+    name: str
+    method: str
+    route: str
+    weight: int
+    params: Dict = field(default_factory=dict)
+    body: Optional[Dict] = None
+
+
+# ボード・カレンダー表示を中心とした読み取り主体の構成
+WORKLOAD = [
+    Operation("current_user", "GET", "/api/users/me", 10),
+    Operation("list_projects", "GET", "/api/projects", 10),
+    Operation("list_users", "GET", "/api/users", 8),
+    Operation("list_tasks", "GET", "/api/tasks", 15, params={"limit": 500}),
+    Operation("project_tasks", "GET", "/api/projects/{project_id}/tasks", 20),
+    Operation("task_comments", "GET", "/api/tasks/{task_id}/comments", 8),
+    Operation("unread_count", "GET", "/api/notifications/unread-count", 10),
+    Operation("notifications", "GET", "/api/notifications", 5),
+    Operation("search_tasks", "GET", "/api/tasks/search", 3, params={"q": "タスク1"}),
+    Operation("update_task", "PUT", "/api/tasks/{task_id}", 6, body={"status": None}),
+    Operation("create_comment", "POST", "/api/tasks/{task_id}/comments", 5, body={"content": "ベンチマーク"}),
+]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """ソート済みの値から最近傍順位法でパーセンタイルを求める"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] * 1000) if values else 0.0,
+    }
+
+
+def parse_query_metrics(text: str) -> Dict[str, Dict[str, float]]:
+    """/metrics からルートごとのSQL発行数(合計・件数)を取り出す"""
+    result: Dict[str, Dict[str, float]] = defaultdict(dict)
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if match:
+            name, method, route, value = match.groups()
+            result[f"{method} {route}"][name.rsplit("_", 1)[1]] = float(value)
+    return result
+
+
+def queries_per_request(before: dict, after: dict) -> Dict[str, float]:
+    """計測期間中のリクエストあたりSQL発行数"""
+    result = {}
+    for key, values in after.items():
+        count = values.get("count", 0) - before.get(key, {}).get("count", 0)
+        total = values.get("sum", 0) - before.get(key, {}).get("sum", 0)
+        if count > 0:
+            result[key] = total / count
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def render_request(op: Operation, rng: random.Random, seeded: dict):
+    """操作のテンプレートから実際のパス・パラメータ・本文を作る"""
+    path = op.route.format(
+        project_id=rng.choice(seeded["project_ids"]),
+        task_id=rng.choice(seeded["task_ids"]),
+    )
+    body = None
+    if op.body is not None:
+        body = dict(op.body)
+        if "status" in body:
+            body["status"] = rng.choice(seeding.STATUSES)
+    return path, op.params or None, body
+
+
+async def login(client: httpx.AsyncClient, email: str) -> str:
+    response = await client.post("/api/token", data={"username": email, "password": seeding.BENCH_PASSWORD})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def run_workers(client, tokens, seeded, duration, concurrency, rng_seed):
+    """指定時間、重み付きの操作をランダムに実行"""
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    weights = [op.weight for op in WORKLOAD]
+    deadline = time.perf_counter() + duration
+
+    async def worker(index: int):
+        rng = random.Random(rng_seed + index)
+        headers = {"Authorization": f"Bearer {tokens[index % len(tokens)]}"}
+        while time.perf_counter() < deadline:
+            op = rng.choices(WORKLOAD, weights=weights)[0]
+            path, params, body = render_request(op, rng, seeded)
+            start = time.perf_counter()
+            try:
+                response = await client.request(op.method, path, params=params, json=body, headers=headers)
+                ok = response.status_code < 500
+            except httpx.HTTPError:
+                ok = False
+            elapsed = time.perf_counter() - start
+            if ok:
+                latencies[op.name].append(elapsed)
+            else:
+                errors[op.name] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def connect_socket_clients(base_url: str, count: int):
+    """ブロードキャストを受信するSocket.IOクライアントを接続"""
+    import socketio
+
+    received: Dict[str, int] = defaultdict(int)
+    clients = []
+    for _ in range(count):
+        client = socketio.AsyncClient(reconnection=False)
+        for event in ("task_update", "comment_update", "project_update"):
+            client.on(event, lambda data, event=event: received.__setitem__(event, received[event] + 1))
+        await client.connect(base_url, transports=["websocket"])
+        clients.append(client)
+    return clients, received
+
+
+def start_uvicorn(port: int) -> subprocess.Popen:
+    """ローカルでuvicornを起動(相対パスのSQLiteを共有するため作業ディレクトリはそのまま)"""
+    env = dict(os.environ)
+    backend_dir = str(Path(__file__).resolve().parent.parent)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [backend_dir, env.get("PYTHONPATH")]))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:socket_app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("サーバーが起動しませんでした")
+
+
+async def run(args) -> dict:
+    from app.database import SessionLocal
+    from app.migrate import run_migrations
+
+    run_migrations()
+    db = SessionLocal()
+    try:
+        seeded = seeding.seed(db, seeding.config_from_args(args))
+    finally:
+        db.close()
+
+    server = None
+    lifespan = None
+    if args.mode == "uvicorn":
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = start_uvicorn(args.port)
+        client = httpx.AsyncClient(base_url=base_url, timeout=30)
+    else:
+        from app.main import app, socket_app
+        base_url = "http://bench"
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=socket_app), base_url=base_url, timeout=30)
+
+    socket_clients = []
+    received: Dict[str, int] = {}
+    try:
+        await wait_until_ready(client)
+        tokens = [await login(client, email) for email in seeded["emails"][:args.concurrency]]
+
+        if args.socket_clients:
+            if args.mode != "uvicorn":
+                print("socket clients need --mode uvicorn; skipping")
+            else:
+                socket_clients, received = await connect_socket_clients(base_url, args.socket_clients)
+
+        metrics_before = parse_query_metrics((await client.get("/metrics")).text)
+        latencies, errors, elapsed = await run_workers(
+            client, tokens, seeded, args.duration, args.concurrency, args.seed
+        )
+        # 送信済みのブロードキャストが届くのを少し待つ
+        await asyncio.sleep(0.5)
+        metrics_after = parse_query_metrics((await client.get("/metrics")).text)
+    finally:
+        for socket_client in socket_clients:
+            await socket_client.disconnect()
+        await client.aclose()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    qpr = queries_per_request(metrics_before, metrics_after)
+    operations = {}
+    for op in WORKLOAD:
+        summary = summarize(latencies.get(op.name, []), errors.get(op.name, 0), elapsed)
+        summary["queries_per_request"] = qpr.get(f"{op.method} {op.route}")
+        operations[op.name] = summary
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "mode": args.mode,
+        "config": {
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "socket_clients": args.socket_clients,
+            "seed": asdict(seeding.config_from_args(args)),
+            "database": os.environ["DATABASE_URL"].split("://", 1)[0],
+        },
+        "overall": summarize(all_latencies, sum(errors.values()), elapsed),
+        "operations": operations,
+        "socketio": {
+            "clients": len(socket_clients),
+            "events_received": dict(received),
+        },
+    }
+
+
+def print_report(result: dict):
+    overall = result["overall"]
+    print(f"mode={result['mode']} commit={result['commit']} "
+          f"throughput={overall['throughput_rps']:.1f} req/s errors={overall['errors']}")
+    print(f"{'operation':<16}{'count':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'q/req':>7}")
+    for name, stats in list(result["operations"].items()) + [("overall", overall)]:
+        qpr = stats.get("queries_per_request")
+        print(f"{name:<16}{stats['count']:>8}{stats['throughput_rps']:>9.1f}{stats['p50_ms']:>9.1f}"
+              f"{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{'' if qpr is None else f'{qpr:.1f}':>7}")
+    if result["socketio"]["clients"]:
+        print(f"socket.io clients={result['socketio']['clients']} events={result['socketio']['events_received']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--socket-clients", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", type=Path, default=None)
+    seeding.add_arguments(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = RESULTS_DIR / f"{stamp}-{result['commit'] or 'nogit'}-{result['mode']}.json"
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""ベンチマーク用の合成データを投入
+
+    python -m benchmarks.seed --users 50 --projects 20 --tasks-per-project 200
+"""
+import argparse
+import os
+import random
+import time
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./bench.db")
+
+from sqlalchemy import func
+
+from app import models
+from app.auth import get_password_hash
+
+BENCH_PASSWORD = "benchmark"
+STATUSES = ["todo", "inProgress", "review", "done"]
+PRIORITIES = ["low", "medium", "high"]
+NOTIFICATION_TYPES = ["due_soon", "assigned", "comment"]
+
+
+@dataclass
+class SeedConfig:
+    users: int = 20
+    projects: int = 10
+    tasks_per_project: int = 100
+    comments_per_task: int = 2
+    notifications_per_user: int = 50
+    seed: int = 42
+
+
+def user_email(index: int) -> str:
+    """合成ユーザーのメールアドレス"""
+    return f"bench{index}@example.com"
+
+
+def _insert(db, model, rows, batch_size: int = 5000):
+    """行をまとめて挿入し、採番されたIDを返す(シーケンスを進めるためIDは指定しない)"""
+    max_before = db.query(func.max(model.id)).scalar() or 0
+    for start in range(0, len(rows), batch_size):
+        db.bulk_insert_mappings(model, rows[start:start + batch_size])
+    db.commit()
+    return [row_id for (row_id,) in db.query(model.id).filter(model.id > max_before).order_by(model.id)]
+
+
+def seed(db, config: SeedConfig) -> dict:
+    """ユーザー・プロジェクト・タスク・コメント・通知を作成して件数を返す"""
+    rng = random.Random(config.seed)
+    now = datetime.utcnow()
+    today = date.today()
+
+    # argon2は遅いのでハッシュは1回だけ計算して使い回す
+    hashed_password = get_password_hash(BENCH_PASSWORD)
+    offset = (db.query(func.max(models.User.id)).scalar() or 0) + 1
+    emails = [user_email(offset + i) for i in range(config.users)]
+    user_ids = _insert(db, models.User, [
+        {
+            "email": email,
+            "name": f"ベンチユーザー{offset + i}",
+            "hashed_password": hashed_password,
+            "is_active": True,
+            "created_at": now,
+        }
+        for i, email in enumerate(emails)
+    ])
+
+    project_ids = _insert(db, models.Project, [
+        {
+            "title": f"ベンチプロジェクト{i}",
+            "description": "ベンチマーク用のプロジェクト",
+            "color": "aqua",
+            "owner_id": rng.choice(user_ids),
+            "created_at": now,
+        }
+        for i in range(config.projects)
+    ])
+
+    tasks = []
+    for project_id in project_ids:
+        for _ in range(config.tasks_per_project):
+            due = today + timedelta(days=rng.randint(-60, 60))
+            tasks.append({
+                "title": f"タスク{len(tasks)}",
+                "description": "ベンチマーク用の説明文です。" * rng.randint(1, 20),
+                "status": rng.choice(STATUSES),
+                "priority": rng.choice(PRIORITIES),
+                "due_date": due.isoformat(),
+                "assignee_id": rng.choice(user_ids),
+                "project_id": project_id,
+                "attachments": 0,
+                "is_overdue": False,
+                "created_at": now,
+            })
+    task_ids = _insert(db, models.Task, tasks)
+
+    _insert(db, models.Comment, [
+        {
+            "content": f"コメント{i}",
+            "task_id": task_id,
+            "user_id": rng.choice(user_ids),
+            "created_at": now,
+            "updated_at": now,
+        }
+        for task_id in task_ids
+        for i in range(config.comments_per_task)
+    ])
+
+    _insert(db, models.Notification, [
+        {
+            "user_id": user_id,
+            "task_id": rng.choice(task_ids) if task_ids else None,
+            "type": rng.choice(NOTIFICATION_TYPES),
+            "message": "ベンチマーク用の通知",
+            "is_read": rng.random() < 0.7,
+            "created_at": now - timedelta(minutes=rng.randint(0, 60 * 24 * 90)),
+        }
+        for user_id in user_ids
+        for _ in range(config.notifications_per_user)
+    ])
+
+    return {
+        "emails": emails,
+        "user_ids": user_ids,
+        "project_ids": project_ids,
+        "task_ids": task_ids,
+        "counts": {
+            "users": len(user_ids),
+            "projects": len(project_ids),
+            "tasks": len(task_ids),
+            "comments": len(task_ids) * config.comments_per_task,
+            "notifications": len(user_ids) * config.notifications_per_user,
+        },
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """シード設定のコマンドライン引数を追加"""
+    defaults = SeedConfig()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=value)
+
+
+def config_from_args(args) -> SeedConfig:
+    return SeedConfig(**{name: getattr(args, name) for name in asdict(SeedConfig())})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    from app.database import SessionLocal
+    from app.migrate import run_migrations
+
+    run_migrations()
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        result = seed(db, config_from_args(args))
+        print(f"seeded {result['counts']} in {time.perf_counter() - start:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""タスク一覧のシリアライズ方式を比較するベンチマーク
+
+    python -m benchmarks.serialization --tasks 10000
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import fastjson, models
+from app.migrate import run_migrations
+
+
+def seed(db, count: int):
+    """ベンチマーク用のタスクを作成"""
+    db.add(models.User(id=1, email="bench@example.com", name="bench", hashed_password="x"))
+    db.add(models.Project(id=1, title="bench", owner_id=1))
+    db.bulk_insert_mappings(models.Task, [
+        {
+            "title": f"タスク {i}",
+            "description": "説明文 " * 20,
+            "status": "todo",
+            "priority": "medium",
+            "due_date": "2026-01-01",
+            "assignee_id": 1,
+            "project_id": 1,
+            "created_at": datetime(2026, 1, 1),
+        }
+        for i in range(count)
+    ])
+    db.commit()
+
+
+def orm_stdlib(db) -> bytes:
+    """従来の経路: ORMオブジェクト → from_attributes検証 → 標準json"""
+    tasks = db.query(models.Task).all()
+    adapter = fastjson.TaskListAdapter
+    content = adapter.dump_python(adapter.validate_python(tasks, from_attributes=True), mode="json")
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def rows_adapter(db) -> bytes:
+    """列タプル → TypeAdapter(orjson が無い環境の経路)"""
+    rows = db.query(*fastjson.TASK_COLUMNS).all()
+    adapter = fastjson.TaskListAdapter
+    return adapter.dump_json(adapter.validate_python(fastjson.rows_to_dicts(rows)))
+
+
+def rows_orjson(db) -> bytes:
+    """列タプル → orjson(list_response の経路)"""
+    rows = db.query(*fastjson.TASK_COLUMNS).all()
+    return fastjson.list_response(rows, fastjson.TaskListAdapter).body
+
+
+def measure(func, session_factory, repeat: int):
+    """関数の実行時間を計測(毎回新しいセッションを使う)"""
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        db = session_factory()
+        try:
+            start = time.perf_counter()
+            size = len(func(db))
+            timings.append(time.perf_counter() - start)
+        finally:
+            db.close()
+    return timings, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    run_migrations(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    db = session_factory()
+    seed(db, args.tasks)
+    db.close()
+
+    cases = [("orm + stdlib json", orm_stdlib), ("rows + TypeAdapter", rows_adapter)]
+    if fastjson.orjson is not None:
+        cases.append(("rows + orjson", rows_orjson))
+    else:
+        print("orjson is not installed; skipping the orjson case")
+
+    print(f"tasks={args.tasks} repeat={args.repeat}")
+    baseline = None
+    for name, func in cases:
+        timings, size = measure(func, session_factory, args.repeat)
+        median = statistics.median(timings)
+        baseline = baseline or median
+        print(f"{name:<22} median={median * 1000:8.1f} ms  min={min(timings) * 1000:8.1f} ms  "
+              f"bytes={size}  speedup={baseline / median:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
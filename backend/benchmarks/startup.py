@@ -0,0 +1,97 @@
+"""インポート時間と起動から最初の応答までの時間を計測
+
+    python -m benchmarks.startup --runs 5
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./bench.db")
+
+BACKEND_DIR = str(Path(__file__).resolve().parent.parent)
+IMPORT_SNIPPET = "import time; s = time.perf_counter(); import app.main; print(time.perf_counter() - s)"
+MIGRATE_SNIPPET = (
+    "import time; from app.migrate import run_migrations; "
+    "s = time.perf_counter(); run_migrations(); print(time.perf_counter() - s)"
+)
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [BACKEND_DIR, env.get("PYTHONPATH")]))
+    return env
+
+
+def run_snippet(snippet: str) -> float:
+    """新しいプロセスでコードを実行し、出力された秒数を返す"""
+    output = subprocess.check_output([sys.executable, "-c", snippet], env=_env(), text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, deadline: float) -> float:
+    """URLが200を返すまで待ち、その時刻を返す"""
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter()
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} が応答しませんでした")
+
+
+def time_to_first_response(timeout: float = 60):
+    """uvicornを起動してからlive/readyが応答するまでの秒数"""
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:socket_app", "--port", str(port), "--log-level", "warning"],
+        env=_env(),
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        live = wait_for(f"{base}/health/live", start + timeout) - start
+        ready = wait_for(f"{base}/health/ready", start + timeout) - start
+    finally:
+        server.terminate()
+        server.wait()
+    return live, ready
+
+
+def report(name: str, values):
+    print(f"{name:<26} median={statistics.median(values) * 1000:8.1f} ms  "
+          f"min={min(values) * 1000:8.1f} ms  max={max(values) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    # スキーマを用意してから計測(マイグレーション自体の時間も参考に出す)
+    migrate_times = [run_snippet(MIGRATE_SNIPPET) for _ in range(args.runs)]
+    import_times = [run_snippet(IMPORT_SNIPPET) for _ in range(args.runs)]
+    first_responses = [time_to_first_response() for _ in range(args.runs)]
+
+    print(f"runs={args.runs} database={os.environ['DATABASE_URL'].split('://', 1)[0]}")
+    report("migrate (deploy step)", migrate_times)
+    report("import app.main", import_times)
+    report("first /health/live", [live for live, _ in first_responses])
+    report("first /health/ready", [ready for _, ready in first_responses])
+
+
+if __name__ == "__main__":
+    main()
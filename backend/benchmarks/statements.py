@@ -0,0 +1,116 @@
+"""ホットパスのクエリを db.query(...) で毎回組み立てる場合と、作り置きの文(app.statements)で比較
+
+    python -m benchmarks.statements --iterations 5000
+
+1回あたりのCPU時間(time.process_time)と、SQLのコンパイルキャッシュのヒット・ミス数を表示する。
+1リクエストで実行するクエリ(ユーザー・タスク・通知)の合計の差が、リクエストあたりの節約分の目安になる。
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics, models, statements
+from app.migrate import run_migrations
+
+EMAIL = "bench@example.com"
+
+
+def seed(db, notifications: int):
+    """ベンチマーク用のユーザー・タスク・通知を作成"""
+    db.add(models.User(id=1, email=EMAIL, name="bench", hashed_password="x"))
+    db.add(models.Project(id=1, title="bench", owner_id=1))
+    db.add(models.Task(id=1, title="bench", project_id=1, assignee_id=1))
+    db.bulk_insert_mappings(models.Notification, [
+        {
+            "user_id": 1,
+            "task_id": 1,
+            "type": "comment",
+            "message": f"通知 {i}",
+            "is_read": i % 2 == 0,
+            "created_at": datetime(2026, 1, 1, 0, 0, i % 60),
+        }
+        for i in range(notifications)
+    ])
+    db.commit()
+
+
+def query_cases():
+    """従来の経路: リクエストごとに db.query(...) で式を組み立てる"""
+    Notification = models.Notification
+    return {
+        "user_by_email": lambda db: db.query(models.User).filter(models.User.email == EMAIL).first(),
+        "task_by_id": lambda db: db.query(models.Task).filter(models.Task.id == 1).first(),
+        "notifications": lambda db: db.query(Notification).filter(
+            Notification.user_id == 1
+        ).order_by(Notification.created_at.desc()).limit(50).all(),
+        "unread_count": lambda db: db.query(Notification).filter(
+            Notification.user_id == 1, Notification.is_read == False
+        ).count(),
+    }
+
+
+def statement_cases():
+    """作り置きの文"""
+    return {
+        "user_by_email": lambda db: statements.user_by_email(db, EMAIL),
+        "task_by_id": lambda db: statements.task_by_id(db, 1),
+        "notifications": lambda db: statements.notifications(db, 1),
+        "unread_count": lambda db: statements.unread_count(db, 1),
+    }
+
+
+def cache_counts():
+    return {result: metrics.DB_COMPILE_CACHE.value(result) for result in ("hit", "miss")}
+
+
+def measure(func, db, iterations: int):
+    """1回あたりのCPU時間(マイクロ秒)と、その間のコンパイルキャッシュのヒット・ミス数"""
+    for _ in range(min(100, iterations)):
+        func(db)
+    before = cache_counts()
+    start = time.process_time()
+    for _ in range(iterations):
+        func(db)
+    elapsed = time.process_time() - start
+    after = cache_counts()
+    return elapsed / iterations * 1e6, {key: int(after[key] - before[key]) for key in after}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--notifications", type=int, default=100)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    run_migrations(bind=engine)
+    metrics.instrument_engine(engine)
+    session_factory = sessionmaker(bind=engine)
+    db = session_factory()
+    seed(db, args.notifications)
+
+    print(f"iterations={args.iterations}")
+    print(f"{'query':<16}{'db.query us':>13}{'statement us':>14}{'saved us':>10}  cache hit/miss (statement)")
+    totals = [0.0, 0.0]
+    statement_funcs = statement_cases()
+    try:
+        for name, query_func in query_cases().items():
+            query_us, _ = measure(query_func, db, args.iterations)
+            statement_us, cache = measure(statement_funcs[name], db, args.iterations)
+            totals[0] += query_us
+            totals[1] += statement_us
+            print(f"{name:<16}{query_us:>13.1f}{statement_us:>14.1f}{query_us - statement_us:>10.1f}  "
+                  f"{cache['hit']}/{cache['miss']}")
+    finally:
+        db.close()
+    print(f"{'per request':<16}{totals[0]:>13.1f}{totals[1]:>14.1f}{totals[0] - totals[1]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
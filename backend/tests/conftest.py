@@ -0,0 +1,84 @@
+import os
+import tempfile
+
+# app は読み込み時に DATABASE_URL からエンジンを作るので、テスト用のDBを先に決めておく
+_TEST_DIR = tempfile.mkdtemp(prefix="task-tool-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TEST_DIR, 'test.db')}")
+os.environ.setdefault("ATTACHMENT_DIR", os.path.join(_TEST_DIR, "attachments"))
+os.environ.setdefault("PROFILE_DIR", os.path.join(_TEST_DIR, "profiles"))
+# レート制限のテストは個別に有効にする
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """テストごとの空のSQLiteファイル(マイグレーション済み)"""
+    from app.migrate import run_migrations
+
+    db_engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    run_migrations(bind=db_engine)
+    yield db_engine
+    db_engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine, autocommit=False, autoflush=False)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def user(db):
+    from app import models
+
+    db_user = models.User(email="owner@example.com", name="owner", hashed_password="x")
+    db.add(db_user)
+    db.commit()
+    return db_user
+
+
+@pytest.fixture
+def project(db, user):
+    from app import models
+
+    db_project = models.Project(title="project", owner_id=user.id)
+    db.add(db_project)
+    db.commit()
+    return db_project
+
+
+@pytest.fixture(scope="session")
+def api_app():
+    """アプリ本体(DATABASE_URL のDBをマイグレーションして使う)"""
+    from app.migrate import run_migrations
+
+    run_migrations()
+    from app.main import app
+
+    return app
+
+
+@pytest.fixture
+def client(api_app):
+    return TestClient(api_app)
+
+
+def register(client, name: str = "tester") -> dict:
+    """ユーザーを登録してログインし、Authorization ヘッダーを返す"""
+    email = f"{name}-{uuid.uuid4().hex[:8]}@example.com"
+    assert client.post("/api/register", json={"email": email, "name": name, "password": "password"}).status_code == 200
+    token = client.post("/api/token", data={"username": email, "password": "password"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def auth_headers(client):
+    return register(client)
@@ -0,0 +1,84 @@
+import json
+from datetime import datetime, timedelta
+
+from app import activity, models
+
+START = datetime.utcnow() - timedelta(days=30)
+
+
+def add(db, task_id, user_id, minutes, changes, action="updated"):
+    db.add(models.TaskActivity(task_id=task_id, user_id=user_id, action=action,
+                               changes=json.dumps(changes), created_at=START + timedelta(minutes=minutes)))
+
+
+def timeline(db, task_id, limit=50, cursor=None):
+    db.expire_all()
+    return activity.get_timeline(db, task_id, cursor=cursor, limit=limit)
+
+
+def test_consecutive_updates_by_one_user_are_merged(db):
+    add(db, 1, 10, 0, {}, action="created")
+    add(db, 1, 10, 1, {"title": ["a", "b"]})
+    add(db, 1, 10, 2, {"title": ["b", "c"], "status": ["todo", "in_progress"]})
+    # 元に戻した変更は消える
+    add(db, 1, 10, 3, {"status": ["in_progress", "todo"]})
+    # 別のユーザーの更新で区切られる
+    add(db, 1, 20, 4, {"priority": ["medium", "high"]})
+    add(db, 1, 10, 5, {"due_date": [None, "2030-01-01"]})
+    # 窓の外
+    add(db, 1, 10, 200, {"due_date": ["2030-01-01", "2030-02-01"]})
+    db.commit()
+
+    assert activity.compact_activity(db, older_than_days=7, window=3600) == 2
+    items = list(reversed(timeline(db, 1)["items"]))
+    assert [(item["action"], item["user_id"], item["changes"], item["edits"]) for item in items] == [
+        ("created", 10, {}, 1),
+        ("updated", 10, {"title": ["a", "c"]}, 3),
+        ("updated", 20, {"priority": ["medium", "high"]}, 1),
+        ("updated", 10, {"due_date": [None, "2030-01-01"]}, 1),
+        ("updated", 10, {"due_date": ["2030-01-01", "2030-02-01"]}, 1),
+    ]
+    assert activity.compact_activity(db, older_than_days=7, window=3600) == 0
+
+
+def test_edits_accumulate_across_compactions(db):
+    add(db, 2, 10, 0, {"title": ["a", "b"]})
+    add(db, 2, 10, 1, {"title": ["b", "c"]})
+    db.commit()
+    activity.compact_activity(db, older_than_days=7, window=3600)
+    add(db, 2, 10, 2, {"title": ["c", "d"]})
+    db.commit()
+    assert activity.compact_activity(db, older_than_days=7, window=3600) == 1
+    items = timeline(db, 2)["items"]
+    assert [(item["changes"], item["edits"]) for item in items] == [({"title": ["a", "d"]}, 3)]
+
+
+def test_recent_activity_is_left_alone(db):
+    for minutes in range(3):
+        db.add(models.TaskActivity(task_id=3, user_id=10, action="updated",
+                                   changes=json.dumps({"title": [str(minutes), str(minutes + 1)]}),
+                                   created_at=datetime.utcnow()))
+    db.commit()
+    assert activity.compact_activity(db, older_than_days=7, window=3600) == 0
+    assert len(timeline(db, 3)["items"]) == 3
+
+
+def test_keyset_pagination_is_stable_across_compaction(db):
+    # 新しい行(圧縮しない)の後ろに古い行(圧縮する)が続く
+    for minutes in range(4):
+        add(db, 4, 10, minutes, {"title": [str(minutes), str(minutes + 1)]})
+    for minutes in range(3):
+        db.add(models.TaskActivity(task_id=4, user_id=10 + minutes, action="updated",
+                                   changes=json.dumps({"status": ["todo", "done"]}),
+                                   created_at=datetime.utcnow() - timedelta(minutes=minutes)))
+    db.commit()
+
+    first = timeline(db, 4, limit=3)
+    assert len(first["items"]) == 3 and first["next_cursor"]
+    activity.compact_activity(db, older_than_days=7, window=3600)
+    rest = timeline(db, 4, limit=3, cursor=first["next_cursor"])
+    # 1ページ目の続きから、圧縮後の1行だけが返る
+    assert [(item["changes"], item["edits"]) for item in rest["items"]] == [({"title": ["0", "4"]}, 4)]
+    assert rest["next_cursor"] is None
+    seen = {item["id"] for item in first["items"]}
+    assert not seen & {item["id"] for item in rest["items"]}
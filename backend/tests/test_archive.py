@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from app import archive, hierarchy, models
+
+
+def test_restore_recounts_attachments(db, user, project):
+    task = models.Task(title="done", project_id=project.id, status=models.TaskStatus.DONE.value,
+                       completed_at=datetime.utcnow() - timedelta(days=60), attachments=2)
+    db.add(task)
+    db.commit()
+    for name in ("a.txt", "b.txt"):
+        db.add(models.Attachment(task_id=task.id, user_id=user.id, filename=name, content_type="text/plain",
+                                 size=1, sha256="0" * 64))
+    db.commit()
+    task_id = task.id
+
+    assert archive.archive_done_tasks(db, older_than_days=30) == 1
+    assert db.get(models.Task, task_id) is None
+
+    restored = archive.restore_task(db, task_id, user.id)
+    assert restored.attachments == 2
+    assert restored.status == models.TaskStatus.DONE.value
+    assert archive.restore_task(db, task_id) is None
+
+
+def test_restored_task_is_not_archived_again(db, user, project):
+    parent = models.Task(title="parent", project_id=project.id)
+    db.add(parent)
+    db.flush()
+    task = models.Task(title="done", project_id=project.id, status=models.TaskStatus.DONE.value,
+                       completed_at=datetime.utcnow() - timedelta(days=60))
+    db.add(task)
+    db.flush()
+    hierarchy.set_parent(db, task, parent.id)
+    db.commit()
+    task_id = task.id
+
+    assert archive.archive_done_tasks(db, older_than_days=30) == 1
+    restored = archive.restore_task(db, task_id, user.id)
+    assert restored.completed_at > datetime.utcnow() - timedelta(minutes=1)
+    # 階層から外した状態で戻る
+    assert restored.parent_id is None
+    db.refresh(parent)
+    assert (parent.subtasks_total, parent.subtasks_done) == (0, 0)
+
+    assert archive.archive_done_tasks(db, older_than_days=30) == 0
+    assert db.get(models.Task, task_id) is not None
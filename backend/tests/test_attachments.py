@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+
+from app import attachments
+
+
+def start_upload(client, headers, data: bytes, **extra):
+    project = client.post("/api/projects", json={"title": "p"}, headers=headers).json()
+    task = client.post("/api/tasks", json={"title": "t", "project_id": project["id"]}, headers=headers).json()
+    response = client.post(f"/api/tasks/{task['id']}/attachments/uploads",
+                           json={"filename": "a.bin", "size": len(data), **extra}, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+def put_chunk(client, headers, upload_id, offset, data):
+    return client.put(f"/api/attachments/uploads/{upload_id}", content=data,
+                      headers={**headers, "Upload-Offset": str(offset)})
+
+
+def test_upload_lock_is_removed_when_unused():
+    order = []
+
+    async def worker(name):
+        async with attachments.upload_lock("u1"):
+            order.append(f"{name}:start")
+            await asyncio.sleep(0.01)
+            order.append(f"{name}:end")
+
+    async def main():
+        await asyncio.gather(worker("a"), worker("b"))
+
+    asyncio.run(main())
+    assert order == ["a:start", "a:end", "b:start", "b:end"]
+    assert "u1" not in attachments._locks
+
+
+def test_unknown_upload_does_not_create_a_lock(client, auth_headers):
+    for i in range(20):
+        assert put_chunk(client, auth_headers, f"missing-{i}", 0, b"x").status_code == 404
+    assert attachments._locks == {}
+
+
+def test_chunked_upload_and_range_download(client, auth_headers):
+    data = bytes(range(256)) * 40
+    upload = start_upload(client, auth_headers, data, sha256=hashlib.sha256(data).hexdigest())
+    upload_id = upload["upload_id"]
+
+    assert put_chunk(client, auth_headers, upload_id, 0, data[:4000]).json()["offset"] == 4000
+    # オフセットが合わなければ受け取らない
+    conflict = put_chunk(client, auth_headers, upload_id, 0, data[:10])
+    assert conflict.status_code == 409
+    assert conflict.headers["Upload-Offset"] == "4000"
+    done = put_chunk(client, auth_headers, upload_id, 4000, data[4000:]).json()
+    assert done["complete"] is True
+    assert attachments._locks == {}
+    # 完了したアップロードには書き込めない
+    assert put_chunk(client, auth_headers, upload_id, len(data), b"x").status_code == 404
+
+    url = f"/api/attachments/{done['attachment']['id']}"
+    full = client.get(url, headers=auth_headers)
+    assert full.status_code == 200
+    assert full.content == data
+    partial = client.get(url, headers={**auth_headers, "Range": "bytes=100-199"})
+    assert partial.status_code == 206
+    assert partial.headers["content-range"] == f"bytes 100-199/{len(data)}"
+    assert partial.content == data[100:200]
+
+
+def test_rejected_chunk_does_not_keep_a_lock(client, auth_headers):
+    upload = start_upload(client, auth_headers, b"abc")
+    assert put_chunk(client, auth_headers, upload["upload_id"], 0, b"abcdef").status_code == 413
+    assert attachments._locks == {}
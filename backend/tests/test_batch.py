@@ -0,0 +1,21 @@
+def test_runs_calls_in_order_with_per_call_status(client, auth_headers):
+    response = client.post("/api/batch", headers=auth_headers, json={"requests": [
+        {"id": "create", "method": "POST", "path": "/api/projects", "body": {"title": "batch"}},
+        {"id": "me", "path": "/api/users/me"},
+        {"id": "missing", "path": "/api/projects/999999"},
+        {"id": "list", "path": "/api/projects", "params": {"limit": 100}},
+    ]})
+    assert response.status_code == 200
+    results = {result["id"]: result for result in response.json()["responses"]}
+    assert [result["id"] for result in response.json()["responses"]] == ["create", "me", "missing", "list"]
+    assert results["create"]["status"] == 200
+    assert results["me"]["status"] == 200
+    assert results["missing"]["status"] == 404
+    project_id = results["create"]["body"]["id"]
+    assert project_id in [project["id"] for project in results["list"]["body"]]
+
+
+def test_rejects_nested_batches_and_requires_auth(client, auth_headers):
+    nested = {"requests": [{"method": "POST", "path": "/api/batch", "body": {"requests": []}}]}
+    assert client.post("/api/batch", headers=auth_headers, json=nested).status_code == 400
+    assert client.post("/api/batch", json={"requests": [{"path": "/api/users/me"}]}).status_code == 401
@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app import cache, models
+
+
+@pytest.fixture
+def session(engine):
+    factory = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    cache.install(factory)
+    db = factory()
+    yield db
+    db.close()
+
+
+def loader(calls, body):
+    def load():
+        calls.append(body)
+        return body
+    return load
+
+
+def test_hit_until_a_write_bumps_the_version(session):
+    projects = cache.CollectionCache("projects", version_ttl=0)
+    calls = []
+    assert projects.get_or_load(session, "all", loader(calls, b"v1")) == b"v1"
+    assert projects.get_or_load(session, "all", loader(calls, b"v2")) == b"v1"
+    assert calls == [b"v1"]
+
+    owner = models.User(email="cache@example.com", name="cache", hashed_password="x")
+    session.add(owner)
+    session.commit()
+    # users の更新では projects は無効にならない
+    assert projects.get_or_load(session, "all", loader(calls, b"v2")) == b"v1"
+
+    session.add(models.Project(title="new", owner_id=owner.id))
+    session.rollback()
+    assert projects.get_or_load(session, "all", loader(calls, b"v2")) == b"v1"
+
+    session.add(models.Project(title="new", owner_id=owner.id))
+    session.commit()
+    assert projects.get_or_load(session, "all", loader(calls, b"v2")) == b"v2"
+    assert calls == [b"v1", b"v2"]
+
+
+def test_bulk_delete_bumps_the_version(session):
+    projects = cache.CollectionCache("projects", version_ttl=0)
+    projects.get_or_load(session, "all", lambda: b"v1")
+    session.query(models.Project).filter(models.Project.id == -1).delete()
+    session.commit()
+    assert projects.get_or_load(session, "all", lambda: b"v2") == b"v2"
+
+
+def test_evicts_least_recently_used(session):
+    projects = cache.CollectionCache("projects", max_entries=2, version_ttl=0)
+    for key in ("a", "b"):
+        projects.get_or_load(session, key, lambda: key.encode())
+    projects.get_or_load(session, "a", lambda: b"reloaded")
+    projects.get_or_load(session, "c", lambda: b"c")
+    assert projects.get_or_load(session, "a", lambda: b"reloaded") == b"a"
+    assert projects.get_or_load(session, "b", lambda: b"reloaded") == b"reloaded"
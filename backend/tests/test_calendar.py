@@ -0,0 +1,75 @@
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import register
+
+URL = "/api/tasks/calendar"
+
+
+@pytest.fixture
+def calendar(client, auth_headers):
+    """2つのプロジェクトに期限の違うタスクを作成"""
+    other = register(client, "other")
+    other_id = client.get("/api/users/me", headers=other).json()["id"]
+    projects = [client.post("/api/projects", headers=auth_headers, json={"title": f"cal {i}"}).json()["id"]
+                for i in range(2)]
+    tasks = [
+        ("a", projects[0], "2030-01-01", "todo", None),
+        ("b", projects[0], "2030-01-01", "done", None),
+        ("c", projects[0], "2030-01-02", "todo", other_id),
+        ("d", projects[1], "2030-01-02", "in_progress", None),
+        ("e", projects[1], "2030-01-05", "todo", None),
+        ("outside", projects[0], "2030-02-01", "todo", None),
+    ]
+    for title, project_id, due_date, status, assignee_id in tasks:
+        response = client.post("/api/tasks", headers=auth_headers, json={
+            "title": title, "project_id": project_id, "due_date": due_date, "status": status,
+            "assignee_id": assignee_id,
+        })
+        assert response.status_code == 200
+    return {"projects": projects, "other_id": other_id}
+
+
+def titles(client, headers, **params):
+    response = client.get(URL, headers=headers, params={"from": "2030-01-01", "to": "2030-01-31", **params})
+    assert response.status_code == 200
+    return [task["title"] for task in response.json()]
+
+
+def test_window_and_filters(client, auth_headers, calendar):
+    project_ids = calendar["projects"]
+    assert titles(client, auth_headers, project_id=project_ids[0]) == ["a", "b", "c"]
+    assert titles(client, auth_headers, project_id=project_ids[1]) == ["d", "e"]
+    assert titles(client, auth_headers, project_id=project_ids[0], assignee_id=calendar["other_id"]) == ["c"]
+    mine = titles(client, auth_headers, my_tasks=True)
+    assert {"a", "b", "d", "e"} <= set(mine) and "c" not in mine and "outside" not in mine
+    response = client.get(URL, headers=auth_headers, params={
+        "from": "2030-01-02", "to": "2030-01-02", "project_id": project_ids[1], "fields": "title,due_date",
+    })
+    assert response.json() == [{"title": "d", "due_date": "2030-01-02"}]
+
+
+def test_day_aggregate_counts(client, auth_headers, calendar):
+    response = client.get(URL, headers=auth_headers, params={
+        "from": "2030-01-01", "to": "2030-01-31", "project_id": calendar["projects"][0], "aggregate": "day",
+    })
+    assert response.status_code == 200
+    assert response.json() == [
+        {"date": "2030-01-01", "total": 2, "counts": {"todo": 1, "done": 1}},
+        {"date": "2030-01-02", "total": 1, "counts": {"todo": 1}},
+    ]
+
+
+@pytest.mark.parametrize("params", [
+    {"from": "2030-01-02", "to": "2030-01-01"},
+    {"from": "2030-01-01", "to": (date(2030, 1, 1) + timedelta(days=366)).isoformat()},
+    {"from": "2030-01-01", "to": "2030-01-31", "aggregate": "week"},
+])
+def test_invalid_ranges_are_rejected(client, auth_headers, params):
+    assert client.get(URL, headers=auth_headers, params=params).status_code == 400
+
+
+def test_a_full_year_is_allowed(client, auth_headers):
+    to = (date(2030, 1, 1) + timedelta(days=365)).isoformat()
+    assert client.get(URL, headers=auth_headers, params={"from": "2030-01-01", "to": to}).status_code == 200
@@ -0,0 +1,115 @@
+import gzip
+
+import brotli
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app import compression
+
+BIG = "x" * (compression.COMPRESSION_MINIMUM_SIZE + 100)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate, br", "br"),
+    ("gzip", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("br;q=0.5, gzip;q=0.8", "gzip"),
+    ("*", "br"),
+    ("*;q=0, gzip", "gzip"),
+    ("identity", None),
+    ("gzip;q=abc", None),
+    ("", None),
+])
+def test_choose_encoding_honours_q_values(header, expected):
+    assert compression.choose_encoding(header) == expected
+
+
+async def small(request):
+    return PlainTextResponse("small")
+
+
+async def big(request):
+    return PlainTextResponse(BIG)
+
+
+async def stream(request):
+    async def chunks():
+        for _ in range(3):
+            yield BIG.encode()
+    return StreamingResponse(chunks(), media_type="application/json")
+
+
+async def encoded(request):
+    return Response(gzip.compress(BIG.encode()), media_type="application/json",
+                    headers={"Content-Encoding": "gzip"})
+
+
+async def image(request):
+    return Response(BIG.encode(), media_type="image/png")
+
+
+@pytest.fixture
+def compressed_client():
+    routes = [Route(f"/{endpoint.__name__}", endpoint) for endpoint in (small, big, stream, encoded, image)]
+    app = Starlette(routes=routes)
+    app.add_middleware(compression.CompressionMiddleware)
+    return TestClient(app)
+
+
+def test_small_responses_are_not_compressed(compressed_client):
+    response = compressed_client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text == "small"
+    assert "vary" not in response.headers
+
+
+@pytest.mark.parametrize("accept, expected", [("gzip", "gzip"), ("br", "br"), ("br;q=0, gzip", "gzip")])
+def test_large_responses_are_compressed_with_vary(compressed_client, accept, expected):
+    with compressed_client.stream("GET", "/big", headers={"Accept-Encoding": accept}) as response:
+        body = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == expected
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) == len(body)
+    decoded = gzip.decompress(body) if expected == "gzip" else brotli.decompress(body)
+    assert decoded.decode() == BIG
+
+
+def test_streaming_responses_are_compressed_incrementally(compressed_client):
+    with compressed_client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        body = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(body).decode() == BIG * 3
+
+
+@pytest.mark.parametrize("path", ["/encoded", "/image"])
+def test_encoded_or_binary_responses_pass_through(compressed_client, path):
+    with compressed_client.stream("GET", path, headers={"Accept-Encoding": "br"}) as response:
+        body = b"".join(response.iter_raw())
+    assert response.headers.get("content-encoding") in (None, "gzip")
+    assert "vary" not in response.headers
+    expected = gzip.compress(BIG.encode()) if path == "/encoded" else BIG.encode()
+    assert len(body) == len(expected)
+
+
+def test_no_accept_encoding_is_untouched(compressed_client):
+    response = compressed_client.get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.text == BIG
+
+
+def test_fields_selects_columns(client, auth_headers):
+    project = client.post("/api/projects", headers=auth_headers, json={"title": "fields"}).json()
+    client.post("/api/tasks", headers=auth_headers, json={"title": "task", "project_id": project["id"]})
+    url = f"/api/projects/{project['id']}/tasks"
+    response = client.get(url, params={"fields": "id,title"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert [sorted(task) for task in response.json()] == [["id", "title"]]
+    full = client.get(url, headers=auth_headers).json()
+    assert full[0]["title"] == "task" and "created_at" in full[0]
+    assert client.get(url, params={"fields": "id,hashed_password"}, headers=auth_headers).status_code == 400
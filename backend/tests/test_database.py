@@ -0,0 +1,72 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import insert, select, text
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+
+from app import database, models
+
+pytestmark = pytest.mark.skipif(not database.SQLITE_TUNED, reason="SQLiteの調整モードでのみ")
+
+
+@pytest.fixture
+def session(api_app):
+    db = database.SessionLocal()
+    yield db
+    db.rollback()
+    db.close()
+
+
+@pytest.mark.parametrize("engine_name", ["engine", "write_engine"])
+def test_pragmas_are_applied(api_app, engine_name):
+    with getattr(database, engine_name).connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == database.SQLITE_BUSY_TIMEOUT_MS
+        assert conn.exec_driver_sql("PRAGMA temp_store").scalar() == 2  # MEMORY
+        assert conn.exec_driver_sql("PRAGMA cache_size").scalar() == -database.SQLITE_CACHE_SIZE_KB
+
+
+def test_reads_and_writes_are_routed(session):
+    users = models.User.__table__
+    assert session.get_bind(clause=select(users)) is database.engine
+    assert session.get_bind(clause=text("SELECT 1")) is database.engine
+    assert session.get_bind(clause=text("  with x as (select 1) select * from x")) is database.engine
+    assert session.get_bind(clause=select(users).with_for_update()) is database.write_engine
+    assert session.get_bind(clause=text("UPDATE users SET name = name")) is database.write_engine
+    assert session.get_bind() is database.write_engine
+
+
+def test_transaction_stays_on_the_writer_until_commit(session):
+    users = models.User.__table__
+    session.execute(select(users).limit(1))
+    assert "use_writer" not in session.info
+    session.execute(insert(users).values(email="routing@example.com", name="routing", hashed_password="x"))
+    # 自分の書いた行が見えるよう、読み込みも書き込み用の接続で行う
+    assert session.get_bind(clause=select(users)) is database.write_engine
+    assert session.execute(select(users.c.id).where(users.c.email == "routing@example.com")).first()
+    session.rollback()
+    assert session.get_bind(clause=select(users)) is database.engine
+
+
+def test_writer_takes_the_write_lock_at_begin(api_app):
+    path = database.make_url(database.SQLALCHEMY_DATABASE_URL).database
+    with database.write_engine.begin() as conn:
+        conn.execute(select(models.User.id).limit(1))
+        other = sqlite3.connect(path, timeout=0, isolation_level=None)
+        try:
+            with pytest.raises(sqlite3.OperationalError, match="locked"):
+                other.execute("BEGIN IMMEDIATE")
+        finally:
+            other.close()
+
+
+def test_is_lock_error(monkeypatch):
+    locked = OperationalError("INSERT ...", {}, sqlite3.OperationalError("database is locked"))
+    other = OperationalError("SELECT ...", {}, sqlite3.OperationalError("no such table: x"))
+    assert database.is_lock_error(locked)
+    assert database.is_lock_error(PoolTimeoutError("QueuePool limit reached"))
+    assert not database.is_lock_error(other)
+    assert not database.is_lock_error(ValueError("database"))
+    monkeypatch.setattr(database, "IS_SQLITE", False)
+    assert not database.is_lock_error(locked)
@@ -0,0 +1,59 @@
+import json
+from collections import namedtuple
+from datetime import datetime
+
+import pytest
+
+from app import fastjson, schemas
+
+UserRow = namedtuple("UserRow", [column.key for column in fastjson.USER_COLUMNS])
+
+
+def user_row(**overrides):
+    values = dict(id=1, email="a@example.com", name="a", is_active=True, avatar=None,
+                  created_at=datetime(2026, 1, 1, 9, 30, 0, 123456))
+    values.update(overrides)
+    return UserRow(**values)
+
+
+@pytest.mark.parametrize("columns, schema", [
+    (fastjson.TASK_COLUMNS, schemas.Task),
+    (fastjson.PROJECT_COLUMNS, schemas.Project),
+    (fastjson.USER_COLUMNS, schemas.User),
+])
+def test_columns_match_the_response_schema(columns, schema):
+    # 検証せずにエンコードするので、列がスキーマのフィールドとずれたらここで気付く
+    assert [column.key for column in columns] == list(schema.model_fields)
+
+
+def test_orjson_and_adapter_paths_produce_the_same_body(monkeypatch):
+    rows = [user_row(), user_row(id=2, avatar="x.jpg")]
+    fast = fastjson.list_response(rows, fastjson.UserListAdapter).body
+    monkeypatch.setattr(fastjson, "orjson", None)
+    assert fastjson.list_response(rows, fastjson.UserListAdapter).body == fast
+    assert json.loads(fast)[0] == {
+        "email": "a@example.com", "name": "a", "id": 1, "is_active": True,
+        "avatar": None, "created_at": "2026-01-01T09:30:00.123456",
+    }
+
+
+def test_adapter_fallback_filters_and_validates(monkeypatch):
+    monkeypatch.setattr(fastjson, "orjson", None)
+    data = {"tasks": [], "dependencies": [{"task_id": 1, "depends_on_id": 2, "extra": True}]}
+    body = json.loads(fastjson.object_response(data, fastjson.TaskHierarchyAdapter).body)
+    assert body == {"tasks": [], "dependencies": [{"task_id": 1, "depends_on_id": 2}]}
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_partial_response_returns_selected_columns_as_is(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(fastjson, "orjson", None)
+    Row = namedtuple("Row", "id title")
+    body = fastjson.list_response([Row(1, "task")], fastjson.TaskListAdapter, partial=True).body
+    assert json.loads(body) == [{"id": 1, "title": "task"}]
+
+
+def test_select_columns_rejects_unknown_fields():
+    assert [column.key for column in fastjson.select_columns("title,id,title", fastjson.TASK_COLUMNS)] == ["title", "id"]
+    with pytest.raises(fastjson.HTTPException):
+        fastjson.select_columns("title,hashed_password", fastjson.USER_COLUMNS)
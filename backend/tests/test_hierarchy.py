@@ -0,0 +1,73 @@
+import pytest
+
+from app import hierarchy, models
+
+
+@pytest.fixture
+def chain(db, project):
+    """root → child → grandchild(grandchild は完了)"""
+    root = models.Task(title="root", project_id=project.id, status=models.TaskStatus.TODO.value)
+    db.add(root)
+    db.flush()
+    child = models.Task(title="child", project_id=project.id, status=models.TaskStatus.TODO.value)
+    grandchild = models.Task(title="grandchild", project_id=project.id, status=models.TaskStatus.DONE.value)
+    db.add_all([child, grandchild])
+    db.flush()
+    hierarchy.set_parent(db, child, root.id)
+    hierarchy.set_parent(db, grandchild, child.id)
+    db.commit()
+    return root, child, grandchild
+
+
+def rollup(db, task):
+    db.refresh(task)
+    return task.subtasks_total, task.subtasks_done
+
+
+def test_set_parent_rolls_up_to_all_ancestors(db, chain):
+    root, child, grandchild = chain
+    assert rollup(db, root) == (2, 1)
+    assert rollup(db, child) == (1, 1)
+    assert rollup(db, grandchild) == (0, 0)
+
+
+def test_parent_cycles_are_rejected(db, chain):
+    root, child, grandchild = chain
+    assert hierarchy.would_create_parent_cycle(db, root.id, root.id)
+    assert hierarchy.would_create_parent_cycle(db, root.id, grandchild.id)
+    assert not hierarchy.would_create_parent_cycle(db, grandchild.id, root.id)
+    with pytest.raises(ValueError):
+        hierarchy.set_parent(db, root, grandchild.id)
+
+
+def test_moving_a_subtree_moves_its_rollup(db, chain):
+    root, child, grandchild = chain
+    hierarchy.set_parent(db, child, None)
+    db.commit()
+    assert rollup(db, root) == (0, 0)
+    assert rollup(db, child) == (1, 1)
+
+
+def test_dependency_cycles_are_rejected(db, chain):
+    root, child, grandchild = chain
+    db.add_all([
+        models.TaskDependency(task_id=root.id, depends_on_id=child.id),
+        models.TaskDependency(task_id=child.id, depends_on_id=grandchild.id),
+    ])
+    db.commit()
+    assert hierarchy.would_create_dependency_cycle(db, grandchild.id, root.id)
+    assert hierarchy.would_create_dependency_cycle(db, grandchild.id, grandchild.id)
+    assert not hierarchy.would_create_dependency_cycle(db, root.id, grandchild.id)
+
+
+def test_detach_reparents_children_and_rebuild_matches(db, chain):
+    root, child, grandchild = chain
+    hierarchy.detach(db, [child.id])
+    db.delete(child)
+    db.commit()
+    db.refresh(grandchild)
+    assert grandchild.parent_id == root.id
+    assert rollup(db, root) == (1, 1)
+    hierarchy.rebuild_rollups(db)
+    db.commit()
+    assert rollup(db, root) == (1, 1)
@@ -0,0 +1,73 @@
+import io
+
+import pytest
+from PIL import Image
+
+from app import images
+
+
+def encode(size, image_format="PNG", mode="RGB"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, "red").save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def test_process_avatar_creates_every_variant():
+    data = encode((640, 480))
+    variants = images.process_avatar(data)
+    digest = images.content_hash(data)
+    assert sorted(variants) == sorted(images.all_variant_filenames(digest))
+    for name, body in variants.items():
+        size = int(images.AVATAR_NAME_PATTERN.match(name).group(2))
+        decoded = Image.open(io.BytesIO(body))
+        assert decoded.format == images.AVATAR_FORMATS[name.rsplit(".", 1)[1]]
+        # 縦横比を保ったまま長辺がサイズに収まる
+        assert max(decoded.size) == size
+        assert decoded.size[1] == round(size * 3 / 4)
+
+
+def test_small_and_transparent_images_are_not_enlarged():
+    variants = images.process_avatar(encode((20, 20), mode="RGBA"))
+    for body in variants.values():
+        assert Image.open(io.BytesIO(body)).size == (20, 20)
+
+
+@pytest.mark.parametrize("data", [b"", b"not an image", encode((10, 10))[:40]])
+def test_undecodable_images_are_rejected(data):
+    with pytest.raises(images.ImageRejected):
+        images.process_avatar(data)
+
+
+@pytest.mark.parametrize("size", [(images.MAX_IMAGE_SIDE + 1, 1), (5001, 5001)])
+def test_oversized_images_are_rejected(size):
+    with pytest.raises(images.ImageRejected, match="解像度"):
+        images.process_avatar(encode(size, mode="1"))
+
+
+def test_disallowed_formats_are_rejected():
+    with pytest.raises(images.ImageRejected):
+        images.process_avatar(encode((10, 10), "BMP"))
+
+
+def test_variant_filenames():
+    digest = "0123456789abcdef0123456789abcdef"
+    assert images.variant_filenames(images.variant_filename(digest)) == images.all_variant_filenames(digest)
+    # 旧形式のファイル名はそれだけ
+    assert images.variant_filenames("legacy.png") == ["legacy.png"]
+
+
+def test_upload_replaces_the_old_avatar(client, auth_headers, monkeypatch, tmp_path):
+    from app import main, storage
+
+    monkeypatch.setattr(main, "avatar_storage", storage.LocalStorage(str(tmp_path)))
+    names = []
+    for color in ("red", "blue"):
+        buffer = io.BytesIO()
+        Image.new("RGB", (100, 100), color).save(buffer, "PNG")
+        response = client.post("/api/profile/avatar", headers=auth_headers,
+                               files={"file": ("avatar.png", buffer.getvalue(), "image/png")})
+        assert response.status_code == 200
+        names.append(response.json()["avatar"])
+    assert client.get("/api/users/me", headers=auth_headers).json()["avatar"] == names[1]
+    assert not main.avatar_storage.exists(names[0])
+    assert main.avatar_storage.exists(names[1])
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from app import jobs, models
+
+
+@pytest.fixture
+def counting_job(monkeypatch):
+    """2バッチ処理してから終わる1手順のジョブ"""
+    calls = []
+
+    def step(db, params, batch_size):
+        calls.append(batch_size)
+        return batch_size if len(calls) <= 2 else 0
+
+    monkeypatch.setitem(jobs.HANDLERS, "count", [("count", step)])
+    return calls
+
+
+def test_claim_runs_batches_until_done(db, counting_job):
+    job = jobs.enqueue(db, "count")
+    db.commit()
+    job_id = jobs._claim(db, "w1")
+    assert job_id == job.id
+    assert jobs._claim(db, "w2") is None
+
+    results = [jobs._run_batch(db, job_id, "w1", 10) for _ in range(3)]
+    assert results == [False, False, True]
+    status = jobs.job_status(db.get(models.Job, job_id))
+    assert status["status"] == "done"
+    assert status["progress"] == {"count": 20}
+    assert status["steps_done"] == 1
+
+
+def test_expired_lease_is_taken_over(db, counting_job):
+    job = jobs.enqueue(db, "count")
+    db.commit()
+    job_id = jobs._claim(db, "w1")
+    assert jobs._run_batch(db, job_id, "w1", 10) is False
+
+    job.locked_until = time.time() - 1
+    db.commit()
+    assert jobs._claim(db, "w2") == job_id
+    # 元のワーカーは引き継がれたことに気付いて手を止める
+    assert jobs._run_batch(db, job_id, "w1", 10) is True
+    assert counting_job == [10]
+    db.refresh(job)
+    assert (job.locked_by, job.attempts, job.progress) == ("w2", 2, '{"count": 10}')
+
+
+def test_failed_job_backs_off_and_release_requeues(db, counting_job):
+    job = jobs.enqueue(db, "count")
+    db.commit()
+    job_id = jobs._claim(db, "w1")
+    jobs._fail(db, job_id, "boom")
+    db.refresh(job)
+    assert (job.status, job.locked_by, job.error) == ("queued", None, "boom")
+    assert job.available_at > time.time()
+    assert jobs._claim(db, "w1") is None
+
+    job.available_at = time.time()
+    db.commit()
+    jobs._claim(db, "w1")
+    jobs._release(db, "w1")
+    db.refresh(job)
+    assert (job.status, job.locked_by) == ("queued", None)
@@ -0,0 +1,21 @@
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from app import metrics
+
+
+def test_failed_statement_does_not_leave_start_time():
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    stats = metrics.RequestStats()
+    token = metrics._request_stats.set(stats)
+    try:
+        with engine.connect() as conn:
+            with pytest.raises(exc.OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+            assert not conn.info.get("query_start")
+            conn.execute(text("SELECT 1"))
+            assert not conn.info["query_start"]
+    finally:
+        metrics._request_stats.reset(token)
+    assert stats.queries == 1
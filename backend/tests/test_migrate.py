@@ -0,0 +1,60 @@
+from sqlalchemy import create_engine, inspect, text
+
+from app import migrate
+
+# マイグレーション導入前のスキーマ(create_all で作られていたもの)
+LEGACY_SCHEMA = [
+    """CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR NOT NULL UNIQUE, name VARCHAR NOT NULL,
+       hashed_password VARCHAR NOT NULL, avatar VARCHAR, is_active BOOLEAN, created_at DATETIME)""",
+    """CREATE TABLE projects (id INTEGER PRIMARY KEY, title VARCHAR NOT NULL, description TEXT, color VARCHAR,
+       owner_id INTEGER REFERENCES users (id), created_at DATETIME)""",
+    """CREATE TABLE tasks (id INTEGER PRIMARY KEY, title VARCHAR NOT NULL, description TEXT, status VARCHAR,
+       priority VARCHAR, due_date VARCHAR, start_time VARCHAR, end_time VARCHAR,
+       assignee_id INTEGER REFERENCES users (id), project_id INTEGER REFERENCES projects (id),
+       comments INTEGER, attachments INTEGER, is_overdue BOOLEAN, created_at DATETIME)""",
+    """CREATE TABLE comments (id INTEGER PRIMARY KEY, content TEXT NOT NULL,
+       task_id INTEGER NOT NULL REFERENCES tasks (id), user_id INTEGER NOT NULL REFERENCES users (id),
+       created_at DATETIME, updated_at DATETIME)""",
+    """CREATE TABLE notifications (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id),
+       task_id INTEGER REFERENCES tasks (id), type VARCHAR NOT NULL, message TEXT NOT NULL, is_read BOOLEAN,
+       created_at DATETIME)""",
+]
+
+LEGACY_ROWS = [
+    "INSERT INTO users (id, email, name, hashed_password) VALUES (1, 'old@example.com', 'old', 'x')",
+    "INSERT INTO projects (id, title, owner_id) VALUES (1, 'old', 1)",
+    """INSERT INTO tasks (id, title, status, priority, due_date, assignee_id, project_id, is_overdue, created_at)
+       VALUES (1, 'a', 'todo', 'high', '2000-01-01', 1, 1, 0, '2026-01-01 00:00:00'),
+              (2, 'b', 'todo', 'low', NULL, 1, 1, 0, '2026-01-02 00:00:00'),
+              (3, 'c', 'done', 'medium', NULL, NULL, 1, 0, '2026-01-03 00:00:00')""",
+    """INSERT INTO notifications (id, user_id, task_id, type, message, is_read, created_at)
+       VALUES (1, 1, 1, 'assigned', 'assigned', 0, '2026-01-01 00:00:00')""",
+]
+
+
+def test_upgrades_a_legacy_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.sqlite'}")
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA + LEGACY_ROWS:
+            conn.execute(text(statement))
+
+    assert migrate.run_migrations(bind=engine) == [version for version, _, _ in migrate.MIGRATIONS]
+
+    columns = {column["name"] for column in inspect(engine).get_columns("tasks")}
+    assert {"completed_at", "rank", "parent_id", "subtasks_total", "subtasks_done"} <= columns
+    with engine.connect() as conn:
+        ranks = conn.execute(text("SELECT rank FROM tasks WHERE status = 'todo' ORDER BY rank")).scalars().all()
+        assert len(ranks) == 2 and all(ranks) and ranks[0] < ranks[1]
+        assert conn.execute(text("SELECT is_overdue FROM tasks WHERE id = 1")).scalar() == 1
+        assert conn.execute(text(
+            "SELECT SUM(count) FROM task_stats WHERE scope = 'project' AND scope_id = 1"
+        )).scalar() == 3
+        assert conn.execute(text(
+            "SELECT event_count, first_created_at = created_at FROM notifications WHERE id = 1"
+        )).one() == (1, 1)
+        assert conn.execute(text("SELECT COUNT(*) FROM cache_versions")).scalar() == 2
+        assert conn.execute(text("SELECT subtasks_total FROM tasks WHERE id = 1")).scalar() == 0
+
+    # 2回目は何もしない
+    assert migrate.run_migrations(bind=engine) == []
+    engine.dispose()
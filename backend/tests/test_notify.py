@@ -0,0 +1,108 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app import models, notify, outbox
+
+
+@pytest.fixture
+def task(db, user, project):
+    db_task = models.Task(title="task", project_id=project.id, assignee_id=user.id)
+    db.add(db_task)
+    db.commit()
+    return db_task
+
+
+def item(user, task, message="commented", notification_type="comment"):
+    return {"user_id": user.id, "task_id": task.id, "type": notification_type, "message": message}
+
+
+def notifications(db, user):
+    db.expire_all()
+    return db.query(models.Notification).filter(models.Notification.user_id == user.id).order_by(
+        models.Notification.id).all()
+
+
+def test_same_batch_is_folded_into_one_row(db, user, task):
+    coalesced = notify.coalesce(db, [item(user, task, "1"), item(user, task, "2"),
+                                     item(user, task, "assigned", "assigned")], window=60)
+    db.commit()
+    assert coalesced == 1
+    rows = notifications(db, user)
+    assert [(row.type, row.message, row.event_count) for row in rows] == [("comment", "2", 2), ("assigned", "assigned", 1)]
+
+
+def test_folds_into_an_existing_unread_row(db, user, task):
+    notify.coalesce(db, [item(user, task, "1")], window=60)
+    db.commit()
+    first = notifications(db, user)[0]
+    first_created_at = first.first_created_at
+
+    assert notify.coalesce(db, [item(user, task, "2")], window=60) == 1
+    db.commit()
+    rows = notifications(db, user)
+    assert len(rows) == 1
+    assert (rows[0].message, rows[0].event_count, rows[0].first_created_at) == ("2", 2, first_created_at)
+    assert rows[0].created_at >= first_created_at
+
+
+def test_read_or_expired_rows_are_not_folded(db, user, task):
+    notify.coalesce(db, [item(user, task, "1")], window=60)
+    db.commit()
+    row = notifications(db, user)[0]
+    row.created_at = datetime.utcnow() - timedelta(seconds=120)
+    db.commit()
+    assert notify.coalesce(db, [item(user, task, "2")], window=60) == 0
+    db.commit()
+
+    notifications(db, user)[-1].is_read = True
+    db.commit()
+    assert notify.coalesce(db, [item(user, task, "3")], window=60) == 0
+    db.commit()
+    assert [row.message for row in notifications(db, user)] == ["1", "2", "3"]
+
+
+def test_window_zero_disables_coalescing(db, user, task):
+    assert notify.coalesce(db, [item(user, task, "1"), item(user, task, "2")], window=0) == 0
+    db.commit()
+    assert len(notifications(db, user)) == 2
+
+
+def test_build_digests_summarises_and_marks_read(db, user, task):
+    notify.coalesce(db, [item(user, task, str(i)) for i in range(3)], window=60)
+    notify.coalesce(db, [item(user, task, "assigned", "assigned")], window=60)
+    db.commit()
+
+    assert notify.build_digests(db, min_events=5) == 0
+    assert notify.build_digests(db, min_events=4) == 1
+    rows = notifications(db, user)
+    assert all(row.is_read for row in rows if row.type != notify.DIGEST_TYPE)
+    digest = [row for row in rows if row.type == notify.DIGEST_TYPE]
+    assert len(digest) == 1 and not digest[0].is_read
+    assert digest[0].event_count == 4
+    assert "4件" in digest[0].message and "1件のタスク" in digest[0].message
+
+
+def test_due_date_checks_are_coalesced(db, engine, user, task, monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(outbox, "SessionLocal", sessionmaker(bind=engine, autocommit=False, autoflush=False))
+    task.due_date = date.today().isoformat()
+    db.commit()
+
+    async def emit(name, payload):
+        pass
+
+    dispatcher = outbox.OutboxDispatcher(emit)
+    # 送信前に2回チェックしても通知は1件
+    main.check_due_dates(db=db, current_user=user)
+    main.check_due_dates(db=db, current_user=user)
+    assert asyncio.run(dispatcher.dispatch_once()) == 2
+    rows = notifications(db, user)
+    assert [(row.type, row.event_count) for row in rows] == [("due_soon", 2)]
+
+    # 通知済みなら予約しない
+    main.check_due_dates(db=db, current_user=user)
+    assert asyncio.run(dispatcher.dispatch_once()) == 0
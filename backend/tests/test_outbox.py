@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app import models, outbox
+
+
+@pytest.fixture
+def session_factory(engine, monkeypatch):
+    factory = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    monkeypatch.setattr(outbox, "SessionLocal", factory)
+    return factory
+
+
+def emit(db, entity, number):
+    outbox.enqueue_emit(db, "task_update", "task_updated", {"n": number}, entity)
+
+
+def rows(db):
+    db.expire_all()
+    return {e.id: e for e in db.query(models.OutboxEvent).order_by(models.OutboxEvent.id)}
+
+
+def test_claim_commits_a_lease_and_releases_the_connection(db, engine):
+    emit(db, "task:1", 1)
+    emit(db, "task:2", 2)
+    db.commit()
+
+    events, lease_until = outbox._claim(db, 10)
+    # 取得はコミット済みで、送信中にトランザクションを持たない
+    assert not db.in_transaction()
+    assert [e.entity for e in events] == ["task:1", "task:2"]
+    assert all(e.status == "inflight" and e.available_at == lease_until for e in rows(db).values())
+
+    # リース中の行は他のワーカーからは取得できない
+    other = sessionmaker(bind=engine)()
+    try:
+        assert outbox._claim(other, 10) == ([], 0.0)
+    finally:
+        other.close()
+
+
+def test_failure_blocks_later_events_of_the_same_entity(db):
+    for number in (1, 2):
+        emit(db, "task:1", number)
+    emit(db, "task:2", 3)
+    db.commit()
+    events, lease_until = outbox._claim(db, 10)
+    first, second, third = events
+
+    outbox._finish(db, events, lease_until, [third], {first.id: "boom"})
+    remaining = rows(db)
+    assert set(remaining) == {first.id, second.id}
+    assert remaining[first.id].status == "pending"
+    assert remaining[first.id].attempts == 1
+    assert remaining[first.id].last_error == "boom"
+    assert remaining[second.id].status == "pending"
+    # 失敗したイベントの再試行を待つ間は、後のイベントも送らない
+    assert outbox._claim(db, 10) == ([], 0.0)
+
+
+def test_event_is_dead_after_max_attempts(db, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 1)
+    emit(db, "task:1", 1)
+    db.commit()
+    events, lease_until = outbox._claim(db, 10)
+    outbox._finish(db, events, lease_until, [], {events[0].id: "boom"})
+    assert [e.status for e in rows(db).values()] == ["dead"]
+
+
+def test_expired_lease_is_taken_over_without_duplicate_notifications(db, user, monkeypatch):
+    outbox.enqueue_notification(db, user.id, None, "comment", "hello")
+    db.commit()
+    events, lease_until = outbox._claim(db, 10)
+
+    # ワーカーが止まったままリースが切れ、他のワーカーが引き継いで処理する
+    now = lease_until + 1
+    monkeypatch.setattr(outbox.time, "time", lambda: now)
+    taken, new_lease = outbox._claim(db, 10)
+    assert [e.id for e in taken] == [e.id for e in events]
+    outbox._finish(db, taken, new_lease, list(taken), {})
+
+    # 元のワーカーが後から結果を記録しても、通知は増えない
+    outbox._finish(db, events, lease_until, list(events), {})
+    assert db.query(models.Notification).count() == 1
+    assert rows(db) == {}
+
+
+def test_dispatch_once_emits_in_order_without_holding_a_connection(db, engine, session_factory):
+    for number in range(3):
+        emit(db, "task:1", number)
+    db.commit()
+    sent = []
+
+    async def fake_emit(name, payload):
+        # 送信中はプールの接続を借りていない(トランザクションも行ロックも無い)
+        assert engine.pool.checkedout() == 0
+        await asyncio.sleep(0)
+        sent.append(payload["data"]["n"])
+
+    dispatcher = outbox.OutboxDispatcher(fake_emit, batch_size=10)
+    assert asyncio.run(dispatcher.dispatch_once()) == 3
+    assert sent == [0, 1, 2]
+    assert rows(db) == {}
+
+
+def test_dispatch_once_retries_failed_emit(db, session_factory):
+    emit(db, "task:1", 1)
+    emit(db, "task:1", 2)
+    db.commit()
+
+    async def failing_emit(name, payload):
+        raise ConnectionError("socket down")
+
+    asyncio.run(outbox.OutboxDispatcher(failing_emit, batch_size=10).dispatch_once())
+    remaining = list(rows(db).values())
+    assert [e.status for e in remaining] == ["pending", "pending"]
+    assert [e.attempts for e in remaining] == [1, 0]
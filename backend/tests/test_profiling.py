@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from app import profiling
+
+
+def test_middleware_joins_sampler_and_saves_report(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_INTERVAL_MS", 1.0)
+    monkeypatch.setattr(profiling, "PROFILE_TOP_STACKS", 10000)
+    saved = []
+    monkeypatch.setattr(profiling, "save_report", lambda report: saved.append(report))
+
+    async def app(scope, receive, send):
+        await asyncio.sleep(0.02)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/api/ping", "headers": []}
+    asyncio.run(profiling.ProfilingMiddleware(app)(scope, None, send))
+
+    assert (b"x-profile-id", saved[0]["id"].encode()) in messages[0]["headers"]
+    assert saved[0]["status"] == 200
+    # レポートを作る前にサンプラーは止まっている
+    assert not any(thread.name == f"profile-{saved[0]['id']}" for thread in threading.enumerate())
+    assert saved[0]["samples"]["count"] == sum(stack["count"] for stack in saved[0]["samples"]["stacks"])
+    assert not profiling.tracemalloc.is_tracing() or profiling._tracing_users == 0
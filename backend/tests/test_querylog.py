@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from app import querylog
+
+
+def run(app, raise_on_detect=True):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/api/items", "headers": []}
+    asyncio.run(querylog.QueryDebugMiddleware(app, raise_on_detect=raise_on_detect)(scope, None, send))
+    return messages
+
+
+def repeat_query(count=10):
+    for i in range(count):
+        querylog._tracker.get().record(f"SELECT * FROM tasks WHERE id = {i}")
+
+
+def test_raises_before_the_response_starts():
+    async def app(scope, receive, send):
+        repeat_query()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"[]"})
+
+    with pytest.raises(querylog.NPlusOneDetected):
+        run(app)
+
+
+def test_only_logs_after_the_response_started(caplog):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        repeat_query()
+        await send({"type": "http.response.body", "body": b"[]"})
+
+    with caplog.at_level(logging.WARNING, logger=querylog.__name__):
+        messages = run(app)
+    assert [message["type"] for message in messages] == ["http.response.start", "http.response.body"]
+    assert "N+1" in caplog.text
+
+
+def test_failed_statement_does_not_leave_start_time():
+    engine = create_engine("sqlite://")
+    querylog.instrument_engine(engine)
+    with engine.connect() as conn:
+        with pytest.raises(exc.OperationalError):
+            conn.execute(text("SELECT * FROM missing_table"))
+        assert not conn.info.get("querylog_start")
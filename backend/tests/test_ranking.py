@@ -0,0 +1,93 @@
+import pytest
+
+from app import crud, models, ranking, schemas
+
+
+def assert_valid(ranks):
+    assert ranks == sorted(ranks)
+    assert len(set(ranks)) == len(ranks)
+    assert not any(rank.endswith("0") for rank in ranks)
+
+
+def test_rank_between_orders_and_rejects_reversed_bounds():
+    assert "a" < ranking.rank_between("a", "b") < "b"
+    assert "a" < ranking.rank_between("a", "a1") < "a1"
+    with pytest.raises(ValueError):
+        ranking.rank_between("b", "a")
+
+
+@pytest.mark.parametrize("count", [10, 100, 2000])
+def test_appending_keeps_ranks_short(count):
+    ranks = [ranking.rank_between(None, None)]
+    for _ in range(count):
+        ranks.append(ranking.rank_between(ranks[-1], None))
+    assert_valid(ranks)
+    assert max(len(rank) for rank in ranks) <= 5
+
+
+@pytest.mark.parametrize("count", [10, 100, 2000])
+def test_prepending_keeps_ranks_short(count):
+    ranks = [ranking.rank_between(None, None)]
+    for _ in range(count):
+        ranks.insert(0, ranking.rank_between(None, ranks[0]))
+    assert_valid(ranks)
+    assert max(len(rank) for rank in ranks) <= 5
+
+
+def test_appending_after_spread_ranks_stays_within_max_length():
+    ranks = ranking.spread_ranks(30)
+    for _ in range(5000):
+        ranks.append(ranking.rank_after(ranks[-1]))
+    assert_valid(ranks)
+    assert max(len(rank) for rank in ranks) <= ranking.RANK_MAX_LENGTH
+
+
+@pytest.mark.parametrize("count", [10, 50, 100])
+def test_inserting_at_the_same_position_grows_logarithmically(count):
+    # 毎回 first の直後(直前に挿入したタスクの前)に挿入する
+    first, last = "i", "j"
+    inserted = []
+    upper = last
+    for _ in range(count):
+        upper = ranking.rank_between(first, upper)
+        inserted.insert(0, upper)
+    assert_valid([first] + inserted + [last])
+    # 1回で間隔が半分になるので、5回ほどで1桁伸びる
+    assert max(len(rank) for rank in inserted) <= 2 + count // 5
+
+
+def test_spread_ranks_are_ordered_and_evenly_sized():
+    for count in (1, 5, 35, 36, 1000):
+        ranks = ranking.spread_ranks(count)
+        assert len(ranks) == count
+        assert_valid(ranks)
+
+
+def _create(db, project, count):
+    return [
+        crud.create_task(db, schemas.TaskCreate(title=f"task {i}", project_id=project.id), project.owner_id)
+        for i in range(count)
+    ]
+
+
+def test_created_tasks_do_not_need_rebalancing(db, project):
+    tasks = _create(db, project, 200)
+    ranks = [task.rank for task in tasks]
+    assert_valid(ranks)
+    assert max(len(rank) for rank in ranks) <= ranking.RANK_MAX_LENGTH
+    assert ranking.rebalance_dense_columns(db) == 0
+
+
+def test_rebalance_column_keeps_order_and_shortens_ranks(db, project):
+    tasks = _create(db, project, 3)
+    # 同じ位置への挿入を繰り返して長くなったランク
+    upper = tasks[1].rank
+    for _ in range(100):
+        upper = ranking.rank_between(tasks[0].rank, upper)
+    tasks[2].rank = upper
+    db.commit()
+    assert ranking.rebalance_dense_columns(db) == 1
+
+    ordered = db.query(models.Task).order_by(models.Task.rank).all()
+    assert [task.id for task in ordered] == [tasks[0].id, tasks[2].id, tasks[1].id]
+    assert max(len(task.rank) for task in ordered) <= 3
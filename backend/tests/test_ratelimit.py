@@ -0,0 +1,62 @@
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from app import ratelimit
+
+
+def make_request(forwarded=None, client=("203.0.113.7", 50000)):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "client": client})
+
+
+def test_forwarded_header_is_ignored_by_default():
+    assert ratelimit.client_key(make_request("198.51.100.1")) == "ip:203.0.113.7"
+
+
+def test_uses_entry_added_by_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(ratelimit, "TRUST_PROXY_HEADERS", True)
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXY_HOPS", 1)
+    assert ratelimit.client_key(make_request("198.51.100.1")) == "ip:198.51.100.1"
+    # クライアントが先頭に書いた値ではなく、プロキシが右端に追加した値を使う
+    assert ratelimit.client_key(make_request("10.0.0.1, 198.51.100.1")) == "ip:198.51.100.1"
+
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXY_HOPS", 2)
+    assert ratelimit.client_key(make_request("10.0.0.1, 198.51.100.1, 192.0.2.10")) == "ip:198.51.100.1"
+    # プロキシの数より要素が少なければ、接続元のアドレスを使う
+    assert ratelimit.client_key(make_request("198.51.100.1")) == "ip:203.0.113.7"
+
+
+def _limited_client(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "_store", ratelimit.MemoryStore())
+    app = FastAPI()
+
+    @app.post("/login", dependencies=[Depends(ratelimit.rate_limit("login"))])
+    def login():
+        return {}
+
+    return TestClient(app)
+
+
+def _statuses(client, headers_list):
+    return [client.post("/login", headers=headers).status_code for headers in headers_list]
+
+
+def test_spoofed_forwarded_for_does_not_get_a_fresh_bucket(monkeypatch):
+    client = _limited_client(monkeypatch)
+    capacity = int(ratelimit.ROUTE_BUDGETS["login"][0])
+    spoofed = [{"X-Forwarded-For": f"10.0.{i}.1"} for i in range(capacity + 1)]
+    assert _statuses(client, spoofed) == [200] * capacity + [429]
+
+
+def test_spoofed_prefix_behind_trusted_proxy_does_not_get_a_fresh_bucket(monkeypatch):
+    monkeypatch.setattr(ratelimit, "TRUST_PROXY_HEADERS", True)
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXY_HOPS", 1)
+    client = _limited_client(monkeypatch)
+    capacity = int(ratelimit.ROUTE_BUDGETS["login"][0])
+    # プロキシは本当の接続元を右端に追加する
+    spoofed = [{"X-Forwarded-For": f"10.0.{i}.1, 198.51.100.1"} for i in range(capacity + 1)]
+    assert _statuses(client, spoofed) == [200] * capacity + [429]
+    # 別のクライアントは別のバケット
+    assert _statuses(client, [{"X-Forwarded-For": "198.51.100.2"}]) == [200]
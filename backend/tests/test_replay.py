@@ -0,0 +1,75 @@
+import asyncio
+
+from app import replay
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def emit(self, event, data, room=None, to=None):
+        self.sent.append((event, data, room, to))
+
+
+def test_buffer_evicts_by_event_count():
+    buffer = replay.RoomBuffer(max_events=3, max_bytes=1000)
+    for i in range(5):
+        buffer.append("e", str(i))
+    assert len(buffer) == 3
+    assert [seq for seq, _, _ in buffer.since(2)] == [3, 4, 5]
+    # 溢れた分を要求されたら再取得
+    assert buffer.since(1) is None
+    assert buffer.since(5) == []
+    assert buffer.since(6) is None
+
+
+def test_buffer_evicts_by_bytes():
+    buffer = replay.RoomBuffer(max_events=100, max_bytes=10)
+    for body in ("aaaa", "bbbb", "cccc"):
+        buffer.append("e", body)
+    assert len(buffer) == 2
+    assert buffer.bytes == 8
+    assert [body for _, _, body in buffer.since(1)] == ["bbbb", "cccc"]
+
+
+def test_resume_replays_only_missed_events():
+    sio = FakeSocket()
+    hub = replay.ReplayHub(sio, max_events=10)
+
+    async def scenario():
+        for i in range(4):
+            await hub.emit("task_update", {"n": i})
+        sio.sent.clear()
+        return await hub.resume("sid-1", hub.epoch, 2)
+
+    result = asyncio.run(scenario())
+    assert result == {"epoch": hub.epoch, "seq": 4, "status": "ok", "replayed": 2}
+    assert [(event, data["n"], data["seq"], to) for event, data, _, to in sio.sent] == [
+        ("task_update", 2, 3, "sid-1"), ("task_update", 3, 4, "sid-1"),
+    ]
+    assert set(hub.rooms) == {replay.BROADCAST_ROOM}
+
+
+def test_resume_asks_for_resync():
+    sio = FakeSocket()
+    hub = replay.ReplayHub(sio, max_events=2)
+
+    async def scenario():
+        for i in range(5):
+            await hub.emit("task_update", {"n": i})
+        sio.sent.clear()
+        return [
+            # バッファより大きい取りこぼし
+            await hub.resume("sid-1", hub.epoch, 1),
+            # 再起動で epoch が変わった
+            await hub.resume("sid-1", "old-epoch", 4),
+            await hub.resume("sid-1", hub.epoch, None),
+            # 知らないルームではバッファを作らない
+            await hub.resume("sid-1", hub.epoch, 1, room="unknown"),
+        ]
+
+    results = asyncio.run(scenario())
+    assert [result["status"] for result in results] == ["resync"] * 4
+    assert results[0]["seq"] == 5
+    assert sio.sent == []
+    assert "unknown" not in hub.rooms
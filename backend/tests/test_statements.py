@@ -0,0 +1,47 @@
+from app import models, statements
+
+
+def add_notifications(db, user, task):
+    for i, is_read in enumerate([False, True, False]):
+        db.add(models.Notification(user_id=user.id, task_id=task.id, type="comment", message=f"n{i}",
+                                   is_read=is_read))
+    db.commit()
+
+
+def test_user_and_task_lookups(db, user, project):
+    task = models.Task(title="task", project_id=project.id)
+    db.add(task)
+    db.commit()
+    assert statements.user_by_email(db, user.email).id == user.id
+    assert statements.user_by_email(db, "missing@example.com") is None
+    assert statements.task_by_id(db, task.id).title == "task"
+    assert statements.task_by_id(db, -1) is None
+
+
+def test_notification_statements(db, user, project):
+    other = models.User(email="other@example.com", name="other", hashed_password="x")
+    task = models.Task(title="task", project_id=project.id)
+    db.add_all([other, task])
+    db.commit()
+    add_notifications(db, user, task)
+    add_notifications(db, other, task)
+
+    assert len(statements.notifications(db, user.id)) == 3
+    assert all(not n.is_read for n in statements.notifications(db, user.id, unread_only=True))
+    assert statements.unread_count(db, user.id) == 2
+
+    first = statements.notifications(db, user.id)[0]
+    assert statements.notification_for_user(db, first.id, user.id).id == first.id
+    assert statements.notification_for_user(db, first.id, other.id) is None
+
+    statements.mark_all_read(db, user.id)
+    db.commit()
+    assert statements.unread_count(db, user.id) == 0
+    assert statements.unread_count(db, other.id) == 2
+
+
+def test_notification_list_is_limited(db, user):
+    db.add_all([models.Notification(user_id=user.id, type="comment", message=str(i))
+                for i in range(statements.NOTIFICATION_LIST_LIMIT + 5)])
+    db.commit()
+    assert len(statements.notifications(db, user.id)) == statements.NOTIFICATION_LIST_LIMIT
@@ -0,0 +1,68 @@
+from app import crud, models, schemas, stats
+
+
+def snapshot(db):
+    """0件の行を除いた集計"""
+    db.expire_all()
+    return sorted(
+        (row.scope, row.scope_id, row.status, row.priority, row.count, row.overdue)
+        for row in db.query(models.TaskStat)
+        if row.count or row.overdue
+    )
+
+
+def rebuilt(db):
+    stats.rebuild(db)
+    db.flush()
+    result = snapshot(db)
+    db.rollback()
+    return result
+
+
+def test_incremental_counters_match_a_rebuild(db, user, project):
+    other = models.User(email="other@example.com", name="other", hashed_password="x")
+    second = models.Project(title="second", owner_id=user.id)
+    db.add_all([other, second])
+    db.commit()
+
+    def create(title, **fields):
+        return crud.create_task(db, schemas.TaskCreate(title=title, project_id=project.id, **fields), user.id)
+
+    overdue = create("overdue", due_date="2000-01-01")
+    high = create("high", priority="high")
+    done = create("done", status="done", due_date="2000-01-01")
+    gone = create("gone", assignee_id=other.id)
+    assert snapshot(db) == rebuilt(db)
+    assert (overdue.is_overdue, done.is_overdue) == (True, False)
+
+    crud.update_task(db, high.id, schemas.TaskUpdate(assignee_id=other.id, priority="low"))
+    crud.update_task(db, overdue.id, schemas.TaskUpdate(project_id=second.id))
+    crud.update_task(db, done.id, schemas.TaskUpdate(status="todo"))
+    crud.move_task(db, high.id, schemas.TaskMove(status="in_progress"))
+    crud.delete_task(db, gone.id)
+    assert snapshot(db) == rebuilt(db)
+    project_summary = [row for row in snapshot(db) if row[:2] == ("project", second.id)]
+    assert project_summary == [("project", second.id, "todo", "medium", 1, 1)]
+
+
+def test_refresh_overdue_and_remove_tasks(db, user, project):
+    task = crud.create_task(db, schemas.TaskCreate(title="later", project_id=project.id, due_date="2030-01-02"),
+                            user.id)
+    crud.create_task(db, schemas.TaskCreate(title="far", project_id=project.id, due_date="2099-01-01"), user.id)
+    assert not task.is_overdue
+
+    # 日付が進んで期限切れになった
+    assert stats.refresh_overdue(db, today="2030-01-03") == 1
+    db.commit()
+    assert [row[-1] for row in snapshot(db)] == [1, 1]
+    assert stats.refresh_overdue(db, today="2030-01-03") == 0
+    # 日付が戻れば外れる
+    assert stats.refresh_overdue(db, today="2030-01-01") == 1
+    db.commit()
+    assert [row[-1] for row in snapshot(db)] == [0, 0]
+
+    stats.remove_tasks(db, models.Task.id == task.id)
+    db.query(models.Task).filter(models.Task.id == task.id).delete()
+    db.commit()
+    assert snapshot(db) == rebuilt(db)
+    assert [row[4] for row in snapshot(db)] == [1, 1]
@@ -0,0 +1,105 @@
+import pytest
+
+from app import storage
+
+AVATAR = "0123456789abcdef0123456789abcdef_64.webp"
+
+
+def test_storage_interface_is_abstract():
+    with pytest.raises(TypeError):
+        storage.Storage()
+
+
+@pytest.mark.parametrize("name", ["../etc/passwd", "a/b.jpg", "", "x.jpg", "0123456789abcdef0123456789abcdef_64.png"])
+def test_safe_filename_rejects_unexpected_names(name):
+    assert storage.safe_filename(name) is None
+
+
+@pytest.fixture(params=["local", "memory"])
+def backend(request, tmp_path):
+    return storage.create_storage(str(tmp_path), request.param)
+
+
+def test_storage_round_trip_and_traversal(backend):
+    backend.save(AVATAR, b"data")
+    assert backend.load(AVATAR) == b"data"
+    assert backend.exists(AVATAR)
+    backend.save(AVATAR, b"new")
+    assert backend.load(AVATAR) == b"new"
+    backend.delete(AVATAR)
+    backend.delete(AVATAR)
+    assert backend.load(AVATAR) is None
+    assert not backend.exists(AVATAR)
+    with pytest.raises(ValueError):
+        backend.save("../outside", b"x")
+
+
+def test_local_storage_serves_files_from_disk(tmp_path):
+    local = storage.LocalStorage(str(tmp_path))
+    local.save(AVATAR, b"data")
+    assert local.local_path(AVATAR) == str(tmp_path / AVATAR)
+
+
+def test_memory_storage_uses_s3_style_objects():
+    objects = storage.MemoryObjectStorage(prefix="avatars")
+    objects.save(AVATAR, b"data")
+    key = f"avatars/{AVATAR}"
+    assert objects.key(AVATAR) == key
+    head = objects.head_object(key)
+    assert head["ETag"] == '"8d777f385d3dfec8815d20f7496026dc"'
+    assert head["ContentLength"] == 4 and "Body" not in head
+    assert objects.get_object(key)["Body"] == b"data"
+    assert objects.head_object("avatars/missing") is None
+    # ローカルファイルとしては配信できない
+    assert objects.local_path(AVATAR) is None
+
+
+def test_create_storage_rejects_unknown_backends(tmp_path):
+    with pytest.raises(ValueError):
+        storage.create_storage(str(tmp_path), "s3")
+
+
+def test_bytes_lru_evicts_least_recently_used():
+    cache = storage.BytesLRU(max_bytes=10, max_item_bytes=6)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    cache.put("big", b"x" * 7)
+    assert cache.get("big") is None
+
+
+def test_avatar_served_with_cache_headers(client, api_app):
+    from app import main
+
+    main.avatar_storage.save(AVATAR, b"x" * (main.avatar_cache.max_item_bytes + 1))
+    try:
+        response = client.get(f"/api/avatars/{AVATAR}")
+        assert response.status_code == 200
+        assert "immutable" in response.headers["cache-control"]
+        etag = response.headers["etag"]
+        assert client.get(f"/api/avatars/{AVATAR}", headers={"If-None-Match": etag}).status_code == 304
+    finally:
+        main.avatar_storage.delete(AVATAR)
+
+
+def test_avatar_deleted_after_lookup_is_404(client, api_app, monkeypatch, tmp_path):
+    from app import main
+
+    # local_path で見つかった後、サイズを読む前に削除された
+    monkeypatch.setattr(main.avatar_storage, "local_path", lambda name: str(tmp_path / name))
+    assert client.get(f"/api/avatars/{AVATAR}").status_code == 404
+
+
+def test_avatar_served_from_object_storage(client, api_app, monkeypatch):
+    from app import main
+
+    objects = storage.MemoryObjectStorage()
+    monkeypatch.setattr(main, "avatar_storage", objects)
+    objects.save(AVATAR, b"webp")
+    response = client.get(f"/api/avatars/{AVATAR}")
+    assert response.status_code == 200
+    assert response.content == b"webp"
+    main.avatar_cache.discard(AVATAR)
@@ -228,6 +228,24 @@ const LoadingMessage = styled.div`
   color: ${colors.text.secondary};
 `;
 
+// 日付を YYYY-MM-DD 形式に変換
+const formatDate = (d) => {
+  const month = String(d.getMonth() + 1).padStart(2, '0');
+  const day = String(d.getDate()).padStart(2, '0');
+  return `${d.getFullYear()}-${month}-${day}`;
+};
+
+// 表示中の月の前後1週間と、予定ビューの30日分を含む期間
+const getVisibleRange = (date) => {
+  const start = new Date(date.getFullYear(), date.getMonth(), 1);
+  start.setDate(start.getDate() - 7);
+  const end = new Date(date.getFullYear(), date.getMonth() + 1, 0);
+  end.setDate(end.getDate() + 7);
+  const agendaEnd = new Date(date);
+  agendaEnd.setDate(agendaEnd.getDate() + 31);
+  return { from: formatDate(start), to: formatDate(agendaEnd > end ? agendaEnd : end) };
+};
+
 const CalendarView = () => {
   const [tasks, setTasks] = useState([]);
   const [events, setEvents] = useState([]);
@@ -236,9 +254,11 @@ const CalendarView = () => {
   const [view, setView] = useState('month');
   const [date, setDate] = useState(new Date());
 
+  const { from: rangeFrom, to: rangeTo } = getVisibleRange(date);
+
   useEffect(() => {
     fetchTasks();
-  }, []);
+  }, [rangeFrom, rangeTo]);
 
   useEffect(() => {
     // 日付セルにクラスを追加
@@ -294,7 +314,8 @@ const CalendarView = () => {
 
   const fetchTasks = async () => {
     try {
-      const response = await taskAPI.getTasks(true);
+      // 表示中の期間のタスクだけをサーバーで絞り込んで取得
+      const response = await taskAPI.getCalendarTasks(rangeFrom, rangeTo, { my_tasks: true });
       const tasksData = response.data;
       
       const calendarEvents = tasksData
@@ -2,7 +2,7 @@ import React, { useState, useEffect } from 'react';
 import styled from 'styled-components';
 import { useNavigate } from 'react-router-dom';
 import { colors } from '../styles/GlobalStyles';
-import { taskAPI, projectAPI, authAPI } from '../services/api';
+import { batchAPI } from '../services/api';
 
 const PageContainer = styled.div`
   margin-left: 240px;
@@ -160,10 +160,11 @@ const HomePage = () => {
 
   const fetchData = async () => {
     try {
-      const [userRes, tasksRes, projectsRes] = await Promise.all([
-        authAPI.getCurrentUser(),
-        taskAPI.getTasks(true),  // true を追加
-        projectAPI.getProjects()
+      // ユーザー・自分のタスク・プロジェクトを1回のリクエストで取得
+      const [userRes, tasksRes, projectsRes] = await batchAPI.getAll([
+        ['/users/me'],
+        ['/tasks', { my_tasks: true }],
+        ['/projects'],
       ]);
 
       setUser(userRes.data);
@@ -310,9 +310,11 @@ const MyTasksPage = () => {
     };
 
     window.addEventListener('task_update', handleTaskUpdate);
+    window.addEventListener('realtime_resync', fetchTasks);
 
     return () => {
       window.removeEventListener('task_update', handleTaskUpdate);
+      window.removeEventListener('realtime_resync', fetchTasks);
     };
   }, []);
 
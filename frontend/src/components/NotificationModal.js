@@ -230,6 +230,8 @@ const NotificationModal = ({ onClose }) => {
         return '割り当て';
       case 'comment':
         return 'コメント';
+      case 'digest':
+        return 'まとめ';
       default:
         return '通知';
     }
@@ -286,7 +288,10 @@ const NotificationModal = ({ onClose }) => {
                     {formatDate(notification.created_at)}
                   </NotificationTime>
                 </NotificationHeader>
-                <NotificationMessage>{notification.message}</NotificationMessage>
+                <NotificationMessage>
+                  {notification.message}
+                  {notification.type !== 'digest' && notification.event_count > 1 && ` (他${notification.event_count - 1}件)`}
+                </NotificationMessage>
               </NotificationItem>
             ))}
           </NotificationList>
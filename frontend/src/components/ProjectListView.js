@@ -365,10 +365,12 @@ const ProjectListView = () => {
 
     window.addEventListener('task_update', handleTaskUpdate);
     window.addEventListener('project_update', handleProjectUpdate);
+    window.addEventListener('realtime_resync', handleTaskUpdate);
 
     return () => {
       window.removeEventListener('task_update', handleTaskUpdate);
       window.removeEventListener('project_update', handleProjectUpdate);
+      window.removeEventListener('realtime_resync', handleTaskUpdate);
     };
   }, [projectId]);
 
@@ -424,7 +426,7 @@ const ProjectListView = () => {
 
     try {
       await projectAPI.deleteProject(projectId);
-      alert('プロジェクトを削除しました');
+      alert('プロジェクトの削除を開始しました');
       navigate('/');
     } catch (error) {
       console.error('プロジェクトの削除に失敗しました:', error);
@@ -436,20 +438,34 @@ const ProjectListView = () => {
     }
   };
 
-  const handleDragEnd = (event, section) => {
+  const handleDragEnd = async (event, section) => {
     const { active, over } = event;
 
-    if (active.id !== over.id) {
+    if (over && active.id !== over.id) {
+      const sectionTasks = getTasksBySection(section);
+      const oldIndex = sectionTasks.findIndex(t => t.id === active.id);
+      const newIndex = sectionTasks.findIndex(t => t.id === over.id);
+
+      const reorderedSection = arrayMove(sectionTasks, oldIndex, newIndex);
+
       setTasks((items) => {
-        const sectionTasks = getTasksBySection(section);
-        const oldIndex = sectionTasks.findIndex(t => t.id === active.id);
-        const newIndex = sectionTasks.findIndex(t => t.id === over.id);
-        
-        const reorderedSection = arrayMove(sectionTasks, oldIndex, newIndex);
-        
         const otherTasks = items.filter(t => !sectionTasks.find(st => st.id === t.id));
         return [...otherTasks, ...reorderedSection];
       });
+
+      // 並び順はステータスごとなので、同じステータスの前後のタスクを基準に移動する
+      const moved = reorderedSection[newIndex];
+      const sameStatus = reorderedSection.filter(t => t.status === moved.status);
+      const position = sameStatus.findIndex(t => t.id === moved.id);
+      try {
+        await taskAPI.moveTask(moved.id, {
+          after_id: sameStatus[position - 1]?.id ?? null,
+          before_id: sameStatus[position + 1]?.id ?? null
+        });
+      } catch (error) {
+        console.error('タスクの移動に失敗しました:', error);
+        fetchData();
+      }
     }
   };
 
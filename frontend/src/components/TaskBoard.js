@@ -68,6 +68,34 @@ const ErrorMessage = styled.div`
   color: ${colors.primary};
 `;
 
+// 移動したタスクをランク順の位置に入れ直す
+const placeByRank = (columns, tasks, moved) => {
+  const newColumns = {};
+  Object.keys(columns).forEach(columnId => {
+    newColumns[columnId] = {
+      ...columns[columnId],
+      taskIds: columns[columnId].taskIds.filter(id => id !== moved.id)
+    };
+  });
+  const column = newColumns[moved.status];
+  if (column) {
+    const index = column.taskIds.findIndex(id => tasks[id] && (tasks[id].rank || '') > moved.rank);
+    column.taskIds.splice(index === -1 ? column.taskIds.length : index, 0, moved.id);
+  }
+  return newColumns;
+};
+
+// 並び順はプロジェクトの列ごとなので、同じプロジェクトの前後のタスクを基準に移動する
+const findNeighbors = (taskIds, index, tasks, task) => {
+  const sameProject = (id) => tasks[id] && tasks[id].project_id === task.project_id;
+  const after = taskIds.slice(0, index).reverse().find(sameProject);
+  const before = taskIds.slice(index + 1).find(sameProject);
+  return {
+    after_id: after === undefined ? null : after,
+    before_id: before === undefined ? null : before
+  };
+};
+
 const TaskBoard = () => {
   const [columns, setColumns] = useState({
     'todo': {
@@ -151,6 +179,40 @@ const TaskBoard = () => {
 
           return newTasks;
         });
+      } else if (type === 'task_moved') {
+        // 移動したタスクだけを並べ直す
+        setTasks(prevTasks => {
+          if (!prevTasks[data.id]) {
+            return prevTasks;
+          }
+          const newTasks = {
+            ...prevTasks,
+            [data.id]: { ...prevTasks[data.id], ...data }
+          };
+          setColumns(prevColumns => placeByRank(prevColumns, newTasks, data));
+          return newTasks;
+        });
+      } else if (type === 'attachments_changed') {
+        // 添付ファイル数だけを更新
+        setTasks(prevTasks => (
+          prevTasks[data.id]
+            ? { ...prevTasks, [data.id]: { ...prevTasks[data.id], attachments: data.attachments } }
+            : prevTasks
+        ));
+      } else if (type === 'subtasks_progress') {
+        // 親タスクのサブタスクの進捗だけを更新
+        setTasks(prevTasks => {
+          const newTasks = { ...prevTasks };
+          data.items.forEach(item => {
+            if (newTasks[item.id]) {
+              newTasks[item.id] = { ...newTasks[item.id], ...item };
+            }
+          });
+          return newTasks;
+        });
+      } else if (type === 'column_rebalanced') {
+        // 列のランクが振り直されたので取り直す
+        fetchData();
       } else if (type === 'task_deleted') {
         // タスクを削除
         setTasks(prevTasks => {
@@ -171,9 +233,11 @@ const TaskBoard = () => {
     };
 
     window.addEventListener('task_update', handleTaskUpdate);
+    window.addEventListener('realtime_resync', fetchData);
 
     return () => {
       window.removeEventListener('task_update', handleTaskUpdate);
+      window.removeEventListener('realtime_resync', fetchData);
     };
   }, []);
 
@@ -196,7 +260,10 @@ const TaskBoard = () => {
       setProject(currentProject);
 
       const tasksResponse = await taskAPI.getTasks();
-      const fetchedTasks = tasksResponse.data;
+      // 列内はランク順に並べる
+      const fetchedTasks = [...tasksResponse.data].sort(
+        (a, b) => ((a.rank || '') < (b.rank || '') ? -1 : (a.rank || '') > (b.rank || '') ? 1 : a.id - b.id)
+      );
 
       const newColumns = {
         'todo': { id: 'todo', title: 'To Do', taskIds: [] },
@@ -239,13 +306,16 @@ const TaskBoard = () => {
       return;
     }
 
+    const taskId = parseInt(draggableId);
     const startColumn = columns[source.droppableId];
     const finishColumn = columns[destination.droppableId];
+    let neighbors;
 
     if (startColumn === finishColumn) {
       const newTaskIds = Array.from(startColumn.taskIds);
       newTaskIds.splice(source.index, 1);
-      newTaskIds.splice(destination.index, 0, draggableId);
+      newTaskIds.splice(destination.index, 0, taskId);
+      neighbors = findNeighbors(newTaskIds, destination.index, tasks, tasks[taskId]);
 
       const newColumn = {
         ...startColumn,
@@ -265,7 +335,8 @@ const TaskBoard = () => {
       };
 
       const finishTaskIds = Array.from(finishColumn.taskIds);
-      finishTaskIds.splice(destination.index, 0, draggableId);
+      finishTaskIds.splice(destination.index, 0, taskId);
+      neighbors = findNeighbors(finishTaskIds, destination.index, tasks, tasks[taskId]);
       const newFinishColumn = {
         ...finishColumn,
         taskIds: finishTaskIds
@@ -276,15 +347,16 @@ const TaskBoard = () => {
         [newStartColumn.id]: newStartColumn,
         [newFinishColumn.id]: newFinishColumn
       });
+    }
 
-      try {
-        await taskAPI.updateTask(parseInt(draggableId), {
-          status: destination.droppableId
-        });
-      } catch (err) {
-        console.error('タスクの更新に失敗しました:', err);
-        fetchData();
-      }
+    try {
+      await taskAPI.moveTask(taskId, {
+        status: destination.droppableId,
+        ...neighbors
+      });
+    } catch (err) {
+      console.error('タスクの移動に失敗しました:', err);
+      fetchData();
     }
   };
 
@@ -157,10 +157,40 @@ export const projectAPI = {
 export const taskAPI = {
   getTasks: (myTasks = false) => api.get('/tasks', { params: { my_tasks: myTasks } }),
   searchTasks: (query) => api.get('/tasks/search', { params: { q: query } }),
+  getCalendarTasks: (from, to, params = {}) => api.get('/tasks/calendar', { params: { from, to, ...params } }),
   getTask: (id) => api.get(`/tasks/${id}`),
   createTask: (taskData) => api.post('/tasks', taskData),
   updateTask: (id, taskData) => api.put(`/tasks/${id}`, taskData),
+  // ボード上の移動(after_id の直後・before_id の直前へ)
+  moveTask: (id, position) => api.post(`/tasks/${id}/move`, position),
+  // 変更履歴(cursorに前のページのnext_cursorを渡す)
+  getTaskActivity: (id, cursor = null) => api.get(`/tasks/${id}/activity`, { params: cursor ? { cursor } : {} }),
   deleteTask: (id) => api.delete(`/tasks/${id}`),
+  // サブタスクと依存関係(親が子より先に並んだ一覧で返る)
+  getProjectHierarchy: (projectId) => api.get(`/projects/${projectId}/hierarchy`),
+  getTaskSubtree: (id) => api.get(`/tasks/${id}/subtree`),
+  addDependency: (id, dependsOnId) => api.post(`/tasks/${id}/dependencies`, { depends_on_id: dependsOnId }),
+  removeDependency: (id, dependsOnId) => api.delete(`/tasks/${id}/dependencies/${dependsOnId}`),
+};
+
+// 一括API(複数の呼び出しを1回のリクエストで実行)
+export const batchAPI = {
+  // requests: [{ method, path, params, body }](path は /api を除いた部分)
+  run: (requests) => api.post('/batch', {
+    requests: requests.map(({ path, ...rest }) => ({ ...rest, path: `/api${path}` })),
+  }),
+  // 複数のGETをまとめて取得し、それぞれ { data } で返す(1件でも失敗したらエラー)
+  getAll: async (requests) => {
+    const response = await batchAPI.run(requests.map(([path, params]) => ({ method: 'GET', path, params })));
+    return response.data.responses.map((result, index) => {
+      if (result.status >= 400) {
+        const error = new Error(`${requests[index][0]}: ${result.status}`);
+        error.response = { status: result.status, data: result.body };
+        throw error;
+      }
+      return { data: result.body };
+    });
+  },
 };
 
 // コメントAPI
@@ -170,6 +200,44 @@ export const commentAPI = {
   deleteComment: (taskId, commentId) => api.delete(`/tasks/${taskId}/comments/${commentId}`),
 };
 
+// 添付ファイルAPI
+export const attachmentAPI = {
+  getAttachments: (taskId) => api.get(`/tasks/${taskId}/attachments`),
+  // 分割して送り、失敗したら受信済みの位置を確認して続きから送り直す
+  upload: async (taskId, file, onProgress) => {
+    const { data: started } = await api.post(`/tasks/${taskId}/attachments/uploads`, {
+      filename: file.name,
+      size: file.size,
+      content_type: file.type || null
+    });
+    let status = started;
+    let retries = 0;
+    while (!status.complete) {
+      const end = Math.min(status.offset + status.chunk_size, status.size);
+      try {
+        const response = await api.put(`/attachments/uploads/${status.upload_id}`, file.slice(status.offset, end), {
+          headers: { 'Upload-Offset': status.offset, 'Content-Type': 'application/octet-stream' }
+        });
+        status = response.data;
+        retries = 0;
+      } catch (error) {
+        if (retries >= 3) {
+          throw error;
+        }
+        retries += 1;
+        const response = await api.get(`/attachments/uploads/${status.upload_id}`);
+        status = response.data;
+      }
+      if (onProgress) {
+        onProgress(status.size ? status.offset / status.size : 1);
+      }
+    }
+    return status.attachment;
+  },
+  download: (id) => api.get(`/attachments/${id}`, { responseType: 'blob' }),
+  deleteAttachment: (id) => api.delete(`/attachments/${id}`),
+};
+
 // 通知API
 export const notificationAPI = {
   getNotifications: (unreadOnly = false) => api.get('/notifications', { params: { unread_only: unreadOnly } }),
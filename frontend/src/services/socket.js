@@ -22,6 +22,37 @@ socket.on('connect_error', (error) => {
   console.error('接続エラー:', error);
 });
 
+// 再接続時のリプレイ用に、最後に受け取ったイベントの連番を覚えておく
+const REALTIME_EVENTS = ['task_update', 'project_update', 'comment_update'];
+let replayEpoch = null;
+let lastSeq = null;
+
+socket.onAny((event, data) => {
+  if (REALTIME_EVENTS.includes(event) && data && data.epoch === replayEpoch && data.seq > lastSeq) {
+    lastSeq = data.seq;
+  }
+});
+
+socket.on('replay_position', (position) => {
+  if (replayEpoch === null) {
+    // 初回接続
+    replayEpoch = position.epoch;
+    lastSeq = position.seq;
+    return;
+  }
+  // 再接続: 取りこぼしたイベントだけを送り直してもらう
+  socket.emit('resume', { epoch: replayEpoch, last_seq: lastSeq }, (result) => {
+    if (!result || result.status === 'resync') {
+      // 取りこぼしがバッファより多い(またはサーバーが再起動した)ので全件を取り直す
+      window.dispatchEvent(new CustomEvent('realtime_resync'));
+    }
+    if (result) {
+      replayEpoch = result.epoch;
+      lastSeq = Math.max(result.status === 'resync' ? 0 : lastSeq, result.seq);
+    }
+  });
+});
+
 // タスク更新のイベントリスナー
 const taskListeners = [];
 const projectListeners = [];